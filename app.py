@@ -1,8 +1,16 @@
 import streamlit as st
-from utils.auth import init_db,init_profile_table,is_user_profile_complete
+import utils.assets  # builds the CSS bundles at startup with ASTRO_CSS_PRECOMPILE=1
+from utils import metrics, profiler, tracing
+from utils.auth import is_admin, is_user_profile_complete
+from utils.llm_client import start_warm_up
+from utils.schema import ensure_schema
 
-init_db()
-init_profile_table()
+ensure_schema()
+start_warm_up()
+metrics.start_exporters()
+
+PAGE_SECONDS = metrics.histogram("astro_page_run_seconds", "Page render time per script run", ["page"])
+PAGE_ERRORS = metrics.counter("astro_page_errors_total", "Script runs whose page raised", ["page"])
 
 
 st.set_page_config(page_title="Astro App", page_icon="🔮", layout="wide")
@@ -18,36 +26,51 @@ if "user" not in st.session_state:
 def logout():
     st.session_state.user = 0
     st.session_state.page = "login"
-    
-#st.session_state.user = 1
 
-if st.session_state.user:       
 
+def current_page() -> str:
+    """Name of the page this run renders; also its label in the page metrics."""
+    if not st.session_state.user:
+        return st.session_state.page
     if not is_user_profile_complete(st.session_state.user):
-        from views.userpopup_view.user_popup import user_profile_popup
-        user_profile_popup()
-    else:
-        # ---------- PAGE ROUTER (AFTER PROFILE COMPLETE) ----------
-        from views.dashboard_view.dashboard import astrology_dashboard
-        from views.profile_view.profile import profile_page
+        return "profile_popup"
+    page = st.session_state.get("current_page", "dashboard")
+    if page == "metrics" and not is_admin(st.session_state.user):
+        return "dashboard"
+    return page if page in ("profile", "metrics") else "dashboard"
 
-        current_page = st.session_state.get("current_page", "dashboard")
+#st.session_state.user = 1
 
-        if current_page == "profile":
+with tracing.trace("rerun", user=st.session_state.user) as rerun, profiler.rerun(st.session_state) as profile:
+    page = current_page()
+    rerun.set(page=page)
+    profile.set_page(page)
+
+    with metrics.timed(PAGE_SECONDS, page, errors=PAGE_ERRORS):
+        if page == "profile_popup":
+            from views.userpopup_view.user_popup import user_profile_popup
+            user_profile_popup()
+
+        # ---------- PAGE ROUTER (AFTER PROFILE COMPLETE) ----------
+        elif page == "profile":
+            from views.profile_view.profile import profile_page
             profile_page()
-        else:
+        elif page == "metrics":
+            from views.metrics_view.metrics import metrics_page
+            metrics_page()
+        elif page == "dashboard":
+            from views.dashboard_view.dashboard import astrology_dashboard
             astrology_dashboard(logout)
 
-else:
-    if st.session_state.page == "login":
-        from views.auth_view.login_view.login import login_page
-        login_page()
-    elif st.session_state.page == "register":
-        from views.auth_view.register_view.register import register_page
-        register_page()
-    elif st.session_state.page == "forgot":
-        from views.auth_view.forgot_password_view.forgot_password import forgot_password_page
-        forgot_password_page()
+        elif page == "login":
+            from views.auth_view.login_view.login import login_page
+            login_page()
+        elif page == "register":
+            from views.auth_view.register_view.register import register_page
+            register_page()
+        elif page == "forgot":
+            from views.auth_view.forgot_password_view.forgot_password import forgot_password_page
+            forgot_password_page()
 
 
 
@@ -0,0 +1,302 @@
+"""
+Latency and throughput of utils.auth against large user tables.
+
+    python -m benchmarks.bench_auth
+    python -m benchmarks.bench_auth --sizes 10000 1000000 --backends file --threads 16
+    python -m benchmarks.bench_auth --json --out results/auth-$(git rev-parse --short HEAD).json
+
+For every backend (file-backed WAL database in a temp dir, or in-memory) and
+table size, the users and user_profiles tables are bulk-seeded, then each
+operation is measured twice:
+    - single-thread latency: --ops sequential calls, p50/p95/p99 in microseconds
+    - throughput: --threads threads calling it for --duration seconds, ops/s
+
+Operations: create_user, verify_user, reset_flow (generate_reset_token followed
+by reset_password), save_user_profile, get_user_profile (through the shared
+profile cache, random users), and get_user_profile_uncached (straight from SQLite).
+
+In-memory databases use a shared-cache URI and, by default, a single pooled
+connection (--memory-pool-size): shared-cache tables lock without honouring
+busy_timeout, so several connections would fail writes instead of waiting.
+
+create_user, verify_user and reset_flow are dominated by the password KDF
+(utils.passwords); set ASTRO_PASSWORD_* to benchmark another cost.
+
+The JSON output (--json / --out) includes the SQLite and Python versions so runs
+from different releases can be compared.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+
+OPS = [
+    "create_user",
+    "verify_user",
+    "reset_flow",
+    "save_user_profile",
+    "get_user_profile",
+    "get_user_profile_uncached",
+]
+PASSWORD = "bench-pw"
+RASHIS = [
+    "Aries", "Taurus", "Gemini", "Cancer", "Leo", "Virgo",
+    "Libra", "Scorpio", "Sagittarius", "Capricorn", "Aquarius", "Pisces",
+]
+
+
+def _pct(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# ==========================================================
+# DATABASE SETUP
+# ==========================================================
+
+def open_database(backend: str, rows: int, workdir: str, pool_size: int):
+    from utils import db
+    from utils.auth import PROFILE_CACHE
+    from utils.schema import ensure_schema
+
+    if backend == "memory":
+        path = f"file:auth_bench_{rows}_{os.getpid()}?mode=memory&cache=shared"
+    else:
+        path = os.path.join(workdir, f"auth_{rows}.db")
+    pool = db.configure_pool(path, size=pool_size)
+    ensure_schema()
+    PROFILE_CACHE.clear()
+    return pool
+
+
+def seed(rows: int, batch: int = 50_000) -> float:
+    """Bulk-inserts `rows` users (all with PASSWORD) and a profile for each."""
+    from utils.db import get_conn
+    from utils.passwords import hash_password
+
+    start = time.perf_counter()
+    salt, pw_hash, scheme = hash_password(PASSWORD)
+    with get_conn() as conn:
+        for offset in range(0, rows, batch):
+            ids = range(offset + 1, min(rows, offset + batch) + 1)
+            conn.executemany(
+                "INSERT INTO users (id, username, email, password_hash, salt, password_scheme) VALUES (?, ?, ?, ?, ?, ?)",
+                ((i, f"user{i}", f"user{i}@example.com", pw_hash, salt, scheme) for i in ids),
+            )
+            conn.executemany(
+                """
+                INSERT INTO user_profiles (user_id, dob, tob, place, fav_color, rashi, language, gender)
+                VALUES (?, '1995-01-01', '06:30:00', 'Delhi', 'Red', ?, 'English', 'Male')
+                """,
+                ((i, RASHIS[i % 12]) for i in ids),
+            )
+            conn.commit()
+    return time.perf_counter() - start
+
+
+# ==========================================================
+# OPERATIONS
+# ==========================================================
+
+def make_ops(rows: int) -> dict:
+    """Returns op name -> callable(rng) performing one call."""
+    from utils import auth
+
+    fresh = itertools.count()
+    run_id = f"{os.getpid()}_{time.monotonic_ns()}"
+
+    def create_user(rng):
+        n = next(fresh)
+        return auth.create_user(f"new{n}", f"new{n}_{run_id}@example.com", PASSWORD)
+
+    def verify_user(rng):
+        return auth.verify_user(f"user{rng.randint(1, rows)}@example.com", PASSWORD)
+
+    def reset_flow(rng):
+        email = f"user{rng.randint(1, rows)}@example.com"
+        token = auth.generate_reset_token(email)
+        return token is not None and auth.reset_password(email, token, PASSWORD)
+
+    def save_user_profile(rng):
+        return auth.save_user_profile(
+            user_id=rng.randint(1, rows),
+            dob="1995-01-01",
+            tob="06:30:00",
+            place="Delhi",
+            fav_color="Red",
+            rashi=rng.choice(RASHIS),
+            language="English",
+            gender="Male",
+        )
+
+    def get_user_profile(rng):
+        return auth.get_user_profile(rng.randint(1, rows))
+
+    def get_user_profile_uncached(rng):
+        return auth._load_user_profile(rng.randint(1, rows))
+
+    return {
+        "create_user": create_user,
+        "verify_user": verify_user,
+        "reset_flow": reset_flow,
+        "save_user_profile": save_user_profile,
+        "get_user_profile": get_user_profile,
+        "get_user_profile_uncached": get_user_profile_uncached,
+    }
+
+
+def measure_latency(fn, count: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    timings = []
+    failures = 0
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            ok = fn(rng)
+        except Exception:
+            ok = False
+        timings.append(time.perf_counter() - start)
+        failures += ok is False
+    return {
+        "calls": count,
+        "failures": failures,
+        "p50_us": _pct(timings, 50) * 1e6,
+        "p95_us": _pct(timings, 95) * 1e6,
+        "p99_us": _pct(timings, 99) * 1e6,
+        "mean_us": statistics.fmean(timings) * 1e6,
+    }
+
+
+def measure_throughput(fn, threads: int, duration: float, seed: int) -> dict:
+    counts = [0] * threads
+    failures = [0] * threads
+    barrier = threading.Barrier(threads + 1)
+    stop = threading.Event()
+
+    def worker(i):
+        rng = random.Random(seed * 1000 + i)
+        barrier.wait()
+        while not stop.is_set():
+            try:
+                ok = fn(rng)
+            except Exception:
+                ok = False
+            counts[i] += 1
+            failures[i] += ok is False
+
+    workers = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "threads": threads,
+        "calls": sum(counts),
+        "failures": sum(failures),
+        "ops_per_s": sum(counts) / elapsed,
+    }
+
+
+# ==========================================================
+# DRIVER
+# ==========================================================
+
+def run(args) -> dict:
+    from utils.db import get_pool
+
+    workdir = tempfile.mkdtemp(prefix="astro-auth-bench-")
+    results = []
+    for backend in args.backends:
+        for rows in args.sizes:
+            pool_size = args.memory_pool_size if backend == "memory" else args.pool_size
+            keep_alive = sqlite3.connect(  # an in-memory database dies with its last connection
+                f"file:auth_bench_{rows}_{os.getpid()}?mode=memory&cache=shared", uri=True
+            ) if backend == "memory" else None
+            open_database(backend, rows, workdir, pool_size)
+            seed_s = seed(rows)
+            ops = make_ops(rows)
+
+            for name in args.ops:
+                entry = {"backend": backend, "rows": rows, "op": name, "seed_s": seed_s}
+                entry["latency"] = measure_latency(ops[name], args.ops_count, args.seed)
+                entry["throughput"] = measure_throughput(ops[name], args.threads, args.duration, args.seed)
+                results.append(entry)
+                if not args.json:
+                    lat, thr = entry["latency"], entry["throughput"]
+                    print(
+                        f"{backend:<7}{rows:>9}  {name:<26}{lat['p50_us']:>9.1f}{lat['p95_us']:>9.1f}"
+                        f"{lat['p99_us']:>9.1f}{thr['ops_per_s']:>11.0f}{lat['failures'] + thr['failures']:>7}",
+                        flush=True,
+                    )
+
+            get_pool().close()
+            if keep_alive is not None:
+                keep_alive.close()
+            if backend == "file":
+                for suffix in ("", "-wal", "-shm"):
+                    try:
+                        os.remove(os.path.join(workdir, f"auth_{rows}.db{suffix}"))
+                    except FileNotFoundError:
+                        pass
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "threads": args.threads,
+            "duration_s": args.duration,
+            "ops_per_latency_run": args.ops_count,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--backends", nargs="+", choices=["file", "memory"], default=["file", "memory"])
+    parser.add_argument("--ops", nargs="+", choices=OPS, default=OPS)
+    parser.add_argument("--ops-count", type=int, default=1000, help="calls per single-thread latency run")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per throughput run")
+    parser.add_argument("--pool-size", type=int, default=8, help="connection pool size for file databases")
+    parser.add_argument("--memory-pool-size", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("--out", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    # Keep the benchmark away from the real users.db.
+    os.environ.setdefault("ASTRO_DB_PATH", os.path.join(tempfile.gettempdir(), "astro-auth-bench-bootstrap.db"))
+
+    if not args.json:
+        print(f"{'backend':<7}{'rows':>9}  {'op':<26}{'p50 us':>9}{'p95 us':>9}{'p99 us':>9}{'ops/s':>11}{'fail':>7}")
+    report = run(args)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
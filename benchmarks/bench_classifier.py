@@ -0,0 +1,125 @@
+"""
+Accuracy and latency of the local astrology classifier versus the LLM classifier.
+
+    python -m benchmarks.bench_classifier            # local model only, offline
+    python -m benchmarks.bench_classifier --llm      # also call Groq (needs GROQ_API_KEY)
+
+The evaluation set (benchmarks/data/classifier_eval.jsonl) is disjoint from the
+training rows in utils/data/astro_classifier_train.jsonl. Its negatives include
+adversarial questions using astrology words in other senses ("symptoms of
+cancer", "yoga poses"); FP rate is the share of all negatives answered True,
+i.e. let through to the expert. It also holds Hindi and Telugu questions: the
+run exits 1 if the local model refuses any non-Latin astrology question, since
+those must reach the LLM classifier at worst.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from utils import classifier
+
+
+EVAL_PATH = Path(__file__).parent / "data" / "classifier_eval.jsonl"
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(name, predict, texts, labels, repeat=1):
+    timings = []
+    correct = 0
+    deferred = 0
+    false_positives = 0
+    for text, label in zip(texts, labels):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            decision = predict(text)
+            timings.append(time.perf_counter() - start)
+        if decision is None:
+            deferred += 1
+        elif decision == bool(label):
+            correct += 1
+        elif not label:
+            false_positives += 1
+
+    decided = len(texts) - deferred
+    negatives = sum(1 for label in labels if not label)
+    return {
+        "path": name,
+        "n": len(texts),
+        "decided": decided,
+        "deferred_to_llm": deferred,
+        "accuracy_on_decided": correct / decided if decided else 0.0,
+        "accuracy_overall": correct / len(texts),
+        "false_positive_rate": false_positives / negatives if negatives else 0.0,
+        "p50_us": _percentile(timings, 50) * 1e6,
+        "p99_us": _percentile(timings, 99) * 1e6,
+        "mean_us": statistics.fmean(timings) * 1e6,
+    }
+
+
+def refused_non_latin(texts, labels, threshold):
+    """Non-Latin astrology questions the local model answers a confident False."""
+    return [
+        text for text, label in zip(texts, labels)
+        if label and classifier.mostly_non_latin(text) and classifier.classify(text, threshold) is False
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--llm", action="store_true", help="also benchmark the Groq classifier")
+    parser.add_argument("--threshold", type=float, default=classifier.THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=200, help="timing repetitions per question (local)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    texts, labels = classifier.load_examples(EVAL_PATH)
+
+    start = time.perf_counter()
+    classifier.get_model()
+    train_ms = (time.perf_counter() - start) * 1000
+
+    results = [
+        run("local (thresholded)", lambda t: classifier.classify(t, args.threshold), texts, labels, args.repeat),
+        run("local (argmax)", lambda t: classifier.probability(t) >= 0.5, texts, labels, args.repeat),
+    ]
+
+    if args.llm:
+        from utils.extension import llm_is_astrology_question
+
+        def hybrid(text):
+            decision = classifier.classify(text, args.threshold)
+            return llm_is_astrology_question(text) if decision is None else decision
+
+        results.append(run("llm", llm_is_astrology_question, texts, labels))
+        results.append(run("hybrid", hybrid, texts, labels))
+
+    if args.json:
+        print(json.dumps({"train_ms": train_ms, "threshold": args.threshold, "results": results}, indent=2))
+        return
+
+    print(f"model trained in {train_ms:.1f} ms, threshold {args.threshold}, {len(texts)} questions\n")
+    print(f"{'path':<22}{'decided':>9}{'deferred':>10}{'acc(dec)':>10}{'acc(all)':>10}{'FP rate':>9}{'p50 us':>12}{'p99 us':>12}")
+    for r in results:
+        print(
+            f"{r['path']:<22}{r['decided']:>9}{r['deferred_to_llm']:>10}"
+            f"{r['accuracy_on_decided']:>10.3f}{r['accuracy_overall']:>10.3f}{r['false_positive_rate']:>9.3f}"
+            f"{r['p50_us']:>12.1f}{r['p99_us']:>12.1f}"
+        )
+
+    refused = refused_non_latin(texts, labels, args.threshold)
+    for text in refused:
+        print(f"REFUSED non-Latin astrology question: {text}")
+    if refused:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
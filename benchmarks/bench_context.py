@@ -0,0 +1,125 @@
+"""
+Prompt size of the expert call over a long conversation, with conversation context.
+
+    python -m benchmarks.bench_context
+    python -m benchmarks.bench_context --turns 100 --budget 400 --json
+
+One user asks --turns questions in a row (mostly follow-ups) through
+get_astro_response, answered by benchmarks.mock_groq, with the conversation
+context the dashboard builds (utils.conversation): recent turns within --budget
+tokens plus a running summary, slid in the background after every answer.
+
+For every turn the report gives the prompt tokens the API counted for the
+expert call, how many of them were conversation context, and what the prompt
+would have been with the whole chat appended instead. The prompt should level
+off below budget + summary + question while the naive one keeps growing, with
+one summarizer call every few turns.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+
+QUESTIONS = [
+    "What does my birth chart say about my career this year?",
+    "And what about next year?",
+    "Which planet is behind that?",
+    "Is there a remedy for it?",
+    "How does my rashi affect marriage compatibility?",
+    "Would a gemstone help with that?",
+    "When is the next good transit for me?",
+]
+
+
+def run(args) -> dict:
+    from utils import conversation
+    from utils.auth import create_user, save_user_profile
+    from utils.extension import get_astro_response, new_conversation
+    from utils.governor import estimate_tokens
+    from utils.schema import ensure_schema
+
+    ensure_schema()
+    create_user("bench", "bench@example.com", "bench-pw")
+    save_user_profile(
+        user_id=1, dob="1995-01-01", tob="06:30:00", place="Delhi",
+        fav_color="Red", rashi="Leo", language="English", gender="Male",
+    )
+
+    chat = new_conversation()
+    history = []
+    turns = []
+    folds = 0
+    for i in range(args.turns):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        context = chat.context(history)
+        answer = get_astro_response(question, 1, context=context)
+        stats = conversation.PROMPT_STATS[-1]
+        full_history = estimate_tokens([{"content": m["content"]} for m in history], 0)
+        turns.append({
+            "turn": i + 1,
+            "prompt_tokens": stats["prompt_tokens"],
+            "context_tokens": stats["context_tokens"],
+            "summary_tokens": stats["summary_tokens"],
+            "context_turns": stats["turns"],
+            "naive_prompt_tokens": stats["prompt_tokens"] - stats["context_tokens"] + full_history,
+            "summarized": chat.folds != folds,
+        })
+        folds = chat.folds
+        history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        chat.slide(history, background=True)
+
+    return {
+        "budget": conversation.BUDGET,
+        "summary_tokens": conversation.SUMMARY_TOKENS,
+        "summaries": chat.folds,
+        "max_prompt_tokens": max(t["prompt_tokens"] for t in turns),
+        "max_naive_prompt_tokens": max(t["naive_prompt_tokens"] for t in turns),
+        "turns": turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--budget", type=int, default=800, help="ASTRO_CONTEXT_TOKENS")
+    parser.add_argument("--summary-tokens", type=int, default=200, help="ASTRO_CONTEXT_SUMMARY_TOKENS")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    from benchmarks import mock_groq
+    from benchmarks.load_test import quiet_streamlit
+
+    server = mock_groq.start_server(latency="fixed:0", token_ms=0)
+    # Must be set before utils.* is imported: the app reads them at import time.
+    os.environ["ASTRO_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="astro-context-"), "bench.db")
+    os.environ["GROQ_BASE_URL"] = server.url
+    os.environ["GROQ_API_KEY"] = "mock"
+    os.environ["ASTRO_CONTEXT"] = "1"
+    os.environ["ASTRO_CONTEXT_TOKENS"] = str(args.budget)
+    os.environ["ASTRO_CONTEXT_SUMMARY_TOKENS"] = str(args.summary_tokens)
+    # This measures prompt size, not the free-tier quota.
+    os.environ.setdefault("ASTRO_LLM_RPM", "100000")
+    os.environ.setdefault("ASTRO_LLM_TPM", "100000000")
+    quiet_streamlit()
+
+    report = run(args)
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{'turn':>5}{'prompt':>9}{'context':>9}{'summary':>9}{'turns':>7}{'naive':>9}")
+    for t in report["turns"]:
+        mark = "  summarized" if t["summarized"] else ""
+        print(f"{t['turn']:>5}{t['prompt_tokens']:>9}{t['context_tokens']:>9}{t['summary_tokens']:>9}"
+              f"{t['context_turns']:>7}{t['naive_prompt_tokens']:>9}{mark}")
+    print(f"\nbudget {report['budget']} + summary {report['summary_tokens']} tokens; "
+          f"{report['summaries']} summarizer calls in {len(report['turns'])} turns")
+    print(f"max prompt {report['max_prompt_tokens']} tokens (whole chat appended: {report['max_naive_prompt_tokens']})")
+
+
+if __name__ == "__main__":
+    main()
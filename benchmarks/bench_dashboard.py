@@ -0,0 +1,222 @@
+"""
+Rerun cost of the dashboard with a long conversation in the session.
+
+    python -m benchmarks.bench_dashboard
+    python -m benchmarks.bench_dashboard --messages 200 --rounds 20 --json
+
+A user with --messages stored chat messages opens the dashboard (through
+app.py, as a streamlit.testing AppTest session). The first ASTRO_CHAT_PAGE
+messages are paged in with "Load older messages", then each round repeats the
+interactions a user makes while writing a question:
+
+    type       edit the prompt box
+    improve    press "↺" (the improver reply comes from benchmarks.mock_groq)
+    edit       edit the improved prompt
+    send       send the question and wait for the streamed answer
+
+For each interaction the report gives the wall time of the rerun(s) it causes
+and how many elements the script emitted. The mock answers with no latency, so
+the numbers are the app's own rendering cost.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks import mock_groq
+from benchmarks.load_test import APP, _button, _pct, quiet_streamlit
+
+
+INTERACTIONS = ["open", "load_older", "type", "improve", "edit", "send"]
+PAGE = 50
+
+
+class FragmentReplay:
+    """
+    Makes AppTest rerun like the browser does. AppTest requests a full-app run
+    for every interaction; the browser reruns only the fragment holding the
+    widget. Before a run that targets a widget, the request gets that widget's
+    fragment id and the runner's message queue is seeded with the previous
+    run's elements, so everything outside the fragment survives the rerun.
+    """
+
+    def __init__(self):
+        from dataclasses import replace
+        from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+        self.fragment_of = {}  # widget id -> fragment id, from the last run
+        self.target = None
+        self._messages = []
+        replay = self
+        request_rerun = LocalScriptRunner.request_rerun
+        forward_msgs = LocalScriptRunner.forward_msgs
+
+        def _request_rerun(runner, rerun_data):
+            fragment_id = replay.fragment_of.get(replay.target)
+            replay.target = None
+            accepted = request_rerun(runner, rerun_data)
+            if fragment_id:
+                for msg in replay._messages:
+                    runner.forward_msg_queue.enqueue(msg)
+                # The runner was created with a pending full-app request, which
+                # would absorb a fragment request, so retarget the pending one.
+                pending = runner._requests
+                pending._rerun_data = replace(pending._rerun_data, fragment_id_queue=[fragment_id])
+            return accepted
+
+        def _forward_msgs(runner):
+            messages = forward_msgs(runner)
+            replay._record(messages)
+            return messages
+
+        LocalScriptRunner.request_rerun = _request_rerun
+        LocalScriptRunner.forward_msgs = _forward_msgs
+
+    def _record(self, messages):
+        self._messages = list(messages)
+        self.fragment_of = {}
+        for msg in messages:
+            if msg.WhichOneof("type") != "delta" or not msg.delta.fragment_id:
+                continue
+            element = msg.delta.new_element
+            kind = element.WhichOneof("type")
+            widget_id = getattr(getattr(element, kind), "id", None) if kind else None
+            if widget_id:
+                self.fragment_of[widget_id] = msg.delta.fragment_id
+
+    def interact(self, at, widget, action):
+        """Applies `action` to `widget` and reruns what the browser would rerun."""
+        self.target = widget.id
+        action(widget)
+        at.run()
+
+
+class ElementCounter:
+    """Counts elements the script sends to the frontend."""
+
+    def __init__(self):
+        from streamlit.delta_generator import DeltaGenerator
+
+        self.count = 0
+        original = DeltaGenerator._enqueue
+
+        def _enqueue(dg, *args, **kwargs):
+            self.count += 1
+            return original(dg, *args, **kwargs)
+
+        DeltaGenerator._enqueue = _enqueue
+
+
+def seed_conversation(messages: int) -> int:
+    from utils import chat_history
+    from utils.auth import create_user, save_user_profile
+    from utils.schema import ensure_schema
+
+    ensure_schema()
+    create_user("bench", "bench@example.com", "bench-pw")
+    save_user_profile(
+        user_id=1, dob="1995-01-01", tob="06:30:00", place="Delhi",
+        fav_color="Red", rashi="Leo", language="English", gender="Male",
+    )
+    for i in range(messages):
+        if i % 2 == 0:
+            chat_history.append(1, "user", f"Question {i}: how will my career be this year?")
+        else:
+            chat_history.append(1, "assistant", "🪐 Saturn's transit favours steady work. " * 8)
+    return 1
+
+
+def run(args) -> dict:
+    from streamlit.testing.v1 import AppTest
+
+    user_id = seed_conversation(args.messages)
+    counter = ElementCounter()
+    replay = FragmentReplay()
+    timings = {name: [] for name in INTERACTIONS}
+    elements = {name: [] for name in INTERACTIONS}
+
+    at = AppTest.from_file(str(APP), default_timeout=args.timeout)
+    at.session_state["user"] = user_id
+
+    def measure(name, action):
+        counter.count = 0
+        start = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].message}")
+        timings[name].append(elapsed)
+        elements[name].append(counter.count)
+
+    def interact(widget, action):
+        return lambda: replay.interact(at, widget(), action)
+
+    measure("open", at.run)
+    measure("load_older", interact(lambda: at.button(key="load_older"), lambda w: w.click()))
+    loaded = len(at.session_state["messages"])
+
+    for i in range(args.rounds):
+        question = f"will I change jobs in {2030 + i}"
+        measure("type", interact(lambda: at.text_input(key="prompt_input"), lambda w: w.input(question)))
+        measure("improve", interact(lambda: _button(at, "↺"), lambda w: w.click()))
+        measure("edit", interact(lambda: at.text_area[0], lambda w: w.input(question.capitalize() + ", and when?")))
+        measure("send", interact(lambda: _button(at, "Send"), lambda w: w.click()))
+        if at.session_state["messages"][-2]["content"] != question:
+            raise RuntimeError("send: the question did not reach the chat")
+
+    return {
+        "messages": args.messages,
+        "messages_in_session": loaded,
+        "rounds": args.rounds,
+        "interactions": {
+            name: {
+                "count": len(values),
+                "p50_ms": _pct(values, 50) * 1000,
+                "p95_ms": _pct(values, 95) * 1000,
+                "mean_ms": statistics.fmean(values) * 1000,
+                "elements": round(statistics.fmean(elements[name])),
+            }
+            for name, values in timings.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=200, help="messages in the conversation")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=60.0, help="max seconds per script run")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    server = mock_groq.start_server(latency="fixed:0", token_ms=0)
+    # Must be set before utils.* is imported: the app reads them at import time.
+    os.environ["ASTRO_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="astro-dashboard-"), "bench.db")
+    os.environ["GROQ_BASE_URL"] = server.url
+    os.environ["GROQ_API_KEY"] = "mock"
+    os.environ["ASTRO_CHAT_PAGE"] = str(PAGE)
+    os.environ["ASTRO_CHAT_WINDOW"] = str(max(1, args.messages - PAGE))
+    os.environ["ASTRO_CHAT_MEMORY_CAP"] = str(args.messages + 2 * args.rounds)
+    # This measures rendering, not the free-tier quota.
+    os.environ.setdefault("ASTRO_LLM_RPM", "100000")
+    os.environ.setdefault("ASTRO_LLM_TPM", "100000000")
+    quiet_streamlit()
+
+    report = run(args)
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{report['messages_in_session']} messages in the session, {report['rounds']} rounds\n")
+    print(f"{'interaction':<12}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'elements':>10}")
+    for name, s in report["interactions"].items():
+        print(f"{name:<12}{s['count']:>5}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['mean_ms']:>10.1f}{s['elements']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Reproducible benchmark of the question pipeline over a corpus of questions and profiles.
+
+    python -m benchmarks.bench_pipeline --record          # call Groq once, write the cassette
+    python -m benchmarks.bench_pipeline --record --mock   # same, against benchmarks.mock_groq
+    python -m benchmarks.bench_pipeline                   # replay offline, compare with the baseline
+    python -m benchmarks.bench_pipeline --save-baseline   # accept the current numbers
+
+Every (profile, question) pair from benchmarks/data/pipeline_corpus.json goes
+through build_astro_prompt, is_astrology_question, get_astro_response and
+get_astro_response_stream (answer caches bypassed), and the "improve" inputs
+through improve_prompt. LLM calls are served by the cassette (utils.cassette),
+so replays are offline and deterministic. Per stage, the report gives p50/p95
+latency; per LLM call kind, it gives call and token counts.
+
+By default replay does not sleep, so latencies are the app's own overhead. With
+--realtime the recorded Groq timings are replayed too. After editing a prompt
+template, pass --fuzzy: requests that no longer match exactly are answered by
+the closest recording.
+
+Against a baseline (--baseline, written by --save-baseline), a stage whose p50
+grows by more than --tolerance, or a call kind whose token count grows, is a
+regression, and the command exits with status 1.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+DATA = Path(__file__).resolve().parent / "data"
+STAGES = ["build_prompt", "classify", "answer", "stream_ttft", "stream_total", "improve"]
+MIN_DELTA_MS = 0.05  # ignore p50 changes smaller than this, whatever the ratio
+
+
+def _pct(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run_corpus(corpus: dict, repeat: int) -> dict:
+    from utils import cassette
+    from utils.auth import create_user, get_user_profile, save_user_profile
+    from utils.extension import (
+        build_astro_prompt,
+        get_astro_response,
+        get_astro_response_stream,
+        improve_prompt,
+        is_astrology_question,
+    )
+    from utils.schema import ensure_schema
+
+    ensure_schema()
+    users = []
+    for i, profile in enumerate(corpus["profiles"]):
+        create_user(f"bench{i}", f"bench{i}@example.com", "bench-pw")
+        user_id = i + 1
+        save_user_profile(user_id=user_id, **profile)
+        users.append((user_id, get_user_profile(user_id)))
+
+    timings = {stage: [] for stage in STAGES}
+    tokens = {}
+    for _ in range(repeat):
+        cassette.ACTIVE.stats.clear()
+        for user_id, profile in users:
+            for question in corpus["questions"]:
+                _, ms = _timed(build_astro_prompt, question, profile)
+                timings["build_prompt"].append(ms)
+                _, ms = _timed(is_astrology_question, question)
+                timings["classify"].append(ms)
+                _, ms = _timed(get_astro_response, question, user_id, use_cache=False)
+                timings["answer"].append(ms)
+
+                stream = get_astro_response_stream(question, user_id, use_cache=False)
+                for _ in stream:
+                    pass
+                timings["stream_ttft"].append(stream.ttft_ms)
+                timings["stream_total"].append(stream.total_ms)
+
+        for text in corpus.get("improve", []):
+            _, ms = _timed(improve_prompt, text)
+            timings["improve"].append(ms)
+        # Deterministic per pass, so the last pass stands for all of them.
+        tokens = cassette.ACTIVE.snapshot()
+
+    stages = {
+        stage: {
+            "count": len(values),
+            "p50_ms": _pct(values, 50),
+            "p95_ms": _pct(values, 95),
+            "mean_ms": statistics.fmean(values),
+        }
+        for stage, values in timings.items()
+        if values
+    }
+    return {"stages": stages, "llm": tokens}
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for stage, now in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before:
+            continue
+        delta = now["p50_ms"] - before["p50_ms"]
+        if delta > MIN_DELTA_MS and now["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{stage}: p50 {before['p50_ms']:.3f} -> {now['p50_ms']:.3f} ms (+{delta / before['p50_ms']:.0%})"
+            )
+    for kind, now in report["llm"].items():
+        before = baseline.get("llm", {}).get(kind)
+        if not before:
+            continue
+        for field in ("calls", "prompt_tokens", "completion_tokens"):
+            if now[field] > before[field]:
+                regressions.append(f"{kind}: {field} {before[field]} -> {now[field]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", default=str(DATA / "pipeline_corpus.json"))
+    parser.add_argument("--cassette", default=str(DATA / "pipeline.cassette.jsonl.gz"))
+    parser.add_argument("--baseline", default=str(DATA / "pipeline_baseline.json"))
+    parser.add_argument("--record", action="store_true", help="call the API and (re)write the cassette")
+    parser.add_argument("--mock", action="store_true", help="record against a local benchmarks.mock_groq server")
+    parser.add_argument("--fuzzy", action="store_true", help="serve changed prompts from the closest recording")
+    parser.add_argument("--realtime", action="store_true", help="replay recorded API latency")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed p50 growth before flagging (default 15%%)")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    if not args.record and not os.path.exists(args.cassette):
+        sys.exit(f"{args.cassette} not found; record it first with --record (or --record --mock)")
+
+    # Must be set before utils.* is imported: the app reads them at import time.
+    os.environ["ASTRO_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="astro-bench-"), "bench.db")
+    if args.mock:
+        from benchmarks import mock_groq
+
+        server = mock_groq.start_server(latency="lognormal:300,0.5")
+        os.environ["GROQ_BASE_URL"] = server.url
+        os.environ["GROQ_API_KEY"] = "mock"
+    os.environ.setdefault("GROQ_API_KEY", "replay")
+
+    from benchmarks.load_test import quiet_streamlit
+    from utils import cassette
+
+    quiet_streamlit()
+    if args.record and os.path.exists(args.cassette):
+        os.remove(args.cassette)
+    cassette.use_cassette(
+        args.cassette,
+        mode="record" if args.record else "replay",
+        fuzzy=args.fuzzy,
+        realtime=args.realtime,
+    )
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    try:
+        report = run_corpus(corpus, 1 if args.record else args.repeat)
+    except cassette.CassetteMiss as exc:
+        sys.exit(f"cassette miss: {exc}\nre-record with --record, or pass --fuzzy after prompt changes")
+    cassette.ACTIVE.save()
+    report["mode"] = "record" if args.record else ("replay-realtime" if args.realtime else "replay")
+    report["cassette_entries"] = len(cassette.ACTIVE)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("mode") == report["mode"]:
+            report["regressions"] = compare(report, baseline, args.tolerance)
+        else:
+            print(f"baseline was taken in {baseline.get('mode')} mode, not {report['mode']}; not comparing", file=sys.stderr)
+            baseline = None
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"mode: {report['mode']}, cassette: {report['cassette_entries']} recordings\n")
+        print(f"{'stage':<14}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'base p50':>10}")
+        for stage, s in report["stages"].items():
+            base = (baseline or {}).get("stages", {}).get(stage)
+            base_p50 = f"{base['p50_ms']:>10.3f}" if base else f"{'-':>10}"
+            print(f"{stage:<14}{s['count']:>6}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['mean_ms']:>10.3f}{base_p50}")
+        print(f"\n{'llm kind':<14}{'calls':>7}{'prompt tok':>12}{'compl tok':>11}{'fuzzy':>7}")
+        for kind, s in sorted(report["llm"].items()):
+            print(f"{kind:<14}{s['calls']:>7}{s['prompt_tokens']:>12}{s['completion_tokens']:>11}{s['fuzzy']:>7}")
+        if args.save_baseline:
+            print(f"\nbaseline written to {args.baseline}")
+        elif baseline is not None:
+            print(f"\n{len(report['regressions'])} regressions against {args.baseline}")
+            for line in report["regressions"]:
+                print(f"  {line}")
+
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
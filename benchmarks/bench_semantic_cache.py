@@ -0,0 +1,160 @@
+"""
+Lookup latency of the semantic answer cache at 10k, 100k and 1M entries.
+
+    python -m benchmarks.bench_semantic_cache
+    python -m benchmarks.bench_semantic_cache --sizes 10000 100000 --partitions 1
+
+Rows are synthetic unit vectors spread over `--partitions` rashis (12 by default,
+as in production), so building a 1M-entry index takes seconds rather than the
+minutes real embeddings would. Embedding cost is reported separately.
+Memory: 1M entries x 256 dims x float32 is ~1 GiB.
+
+Before timing anything, it checks the real embeddings on NEAR_MISSES, pairs
+that must never share an answer, and on PARAPHRASES, pairs that should. It
+exits 1 if any near miss is served from the cache.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from utils.semantic_cache import EMBED_DIM, THRESHOLD, SemanticCache, embed
+
+
+RASHIS = [
+    "Aries", "Taurus", "Gemini", "Cancer", "Leo", "Virgo",
+    "Libra", "Scorpio", "Sagittarius", "Capricorn", "Aquarius", "Pisces",
+]
+
+QUERIES = [
+    "will I marry soon",
+    "when will my marriage happen",
+    "career prediction as per my kundli",
+    "what is my lucky color",
+    "is saturn transit good for me this year",
+]
+
+
+# Questions that look alike but ask different things.
+NEAR_MISSES = [
+    ("is saturn good in 7th house", "is saturn good in 8th house"),
+    ("what does jupiter in 10th house mean", "what does jupiter in 2nd house mean"),
+    ("mangal dosha effects for men", "mangal dosha effects for women"),
+    ("my horoscope for 2025", "my horoscope for 2026"),
+    ("is saturn good in seventh house", "is saturn good in eighth house"),
+    ("will he get married this year", "will she get married this year"),
+    ("what is my lucky color", "what is my lucky number"),
+    ("is saturn good for me", "is saturn not good for me"),
+    ("horoscope for today", "horoscope for tomorrow"),
+]
+
+# Questions that should share an answer.
+PARAPHRASES = [
+    ("will I marry soon", "when will my marriage happen"),
+    ("is saturn good in 7th house", "is saturn good in seventh house"),
+]
+
+
+def check_pairs(threshold, dim):
+    """Returns (near misses served from cache, paraphrases missed)."""
+    false_hits, misses = [], []
+    for pairs, failures, should_hit in ((NEAR_MISSES, false_hits, False), (PARAPHRASES, misses, True)):
+        for cached, asked in pairs:
+            cache = SemanticCache(threshold=threshold, max_entries=10, scope="rashi", dim=dim)
+            cache.insert(cached, "Aries", "answer")
+            hit = cache.lookup(asked, "Aries")
+            if (hit is not None) != should_hit:
+                failures.append((cached, asked, hit[1] if hit else None))
+    return false_hits, misses
+
+
+def _pct(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bench_size(size, partitions, queries, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    cache = SemanticCache(threshold=0.8, max_entries=size, scope="rashi", dim=dim)
+
+    start = time.perf_counter()
+    batch = 10_000
+    for offset in range(0, size, batch):
+        n = min(batch, size - offset)
+        vecs = rng.standard_normal((n, dim)).astype(np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        tags = rng.integers(0, 32, n)
+        for i in range(n):
+            cache.insert_vector(vecs[i], int(tags[i]), RASHIS[(offset + i) % partitions], "answer")
+    build_s = time.perf_counter() - start
+
+    probes = [embed(q, dim) for q in QUERIES]
+    timings = []
+    for i in range(queries):
+        vec, tag = probes[i % len(probes)]
+        t0 = time.perf_counter()
+        cache.lookup_vector(vec, tag, RASHIS[i % partitions])
+        timings.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    for i in range(1000):
+        cache.insert_vector(probes[i % len(probes)][0], 0, RASHIS[i % partitions], "answer")
+    insert_us = (time.perf_counter() - t0) / 1000 * 1e6
+
+    return {
+        "entries": size,
+        "partitions": partitions,
+        "rows_per_partition": size // partitions,
+        "build_s": build_s,
+        "lookup_p50_ms": _pct(timings, 50) * 1000,
+        "lookup_p99_ms": _pct(timings, 99) * 1000,
+        "lookup_mean_ms": statistics.fmean(timings) * 1000,
+        "insert_with_eviction_us": insert_us,
+        "matrix_mb": sum(p.vectors.nbytes for p in cache._partitions.values()) / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--partitions", type=int, default=12, choices=range(1, 13))
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=EMBED_DIM)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    false_hits, misses = check_pairs(THRESHOLD, args.dim)
+    for cached, asked, similarity in false_hits:
+        print(f"FALSE HIT ({similarity:.2f}): {asked!r} answered from {cached!r}")
+    for cached, asked, _ in misses:
+        print(f"paraphrase missed: {asked!r} vs {cached!r}")
+    if false_hits:
+        sys.exit(1)
+
+    t0 = time.perf_counter()
+    for i in range(2000):
+        embed(QUERIES[i % len(QUERIES)], args.dim)
+    embed_us = (time.perf_counter() - t0) / 2000 * 1e6
+
+    results = [bench_size(size, args.partitions, args.queries, args.dim) for size in args.sizes]
+
+    if args.json:
+        print(json.dumps({"embed_us": embed_us, "dim": args.dim, "results": results}, indent=2))
+        return
+
+    print(f"embedding: {embed_us:.1f} us/question, dim {args.dim}\n")
+    print(f"{'entries':>10}{'per part':>10}{'build s':>9}{'p50 ms':>9}{'p99 ms':>9}{'insert us':>11}{'matrix MB':>11}")
+    for r in results:
+        print(
+            f"{r['entries']:>10}{r['rows_per_partition']:>10}{r['build_s']:>9.1f}"
+            f"{r['lookup_p50_ms']:>9.3f}{r['lookup_p99_ms']:>9.3f}"
+            f"{r['insert_with_eviction_us']:>11.1f}{r['matrix_mb']:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Cold import time of app.py's dependency graph, with a budget check.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget-ms 1500      # exit 1 if over budget
+    python -m benchmarks.import_time --top 30 --json
+
+Every module app.py imports, including the views it imports lazily inside the
+router, is found by reading app.py's import statements. All of them are imported
+in a fresh interpreter under `python -X importtime`, without GROQ_API_KEY, so
+the check also fails if a module needs credentials to import. The report
+lists the slowest modules by cumulative and by self time.
+
+The budget (--budget-ms, or ASTRO_IMPORT_BUDGET_MS) applies to the total
+import time reported by the interpreter. Cold-start numbers vary between
+machines, so set it with some headroom over a measured run.
+"""
+
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parents[1]
+APP = ROOT / "app.py"
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def app_imports(path: Path = APP) -> list[str]:
+    """Top-level modules imported anywhere in app.py, including inside branches."""
+    modules = []
+    for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"))):
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def measure(modules: list[str]) -> dict:
+    env = {k: v for k, v in os.environ.items() if k != "GROQ_API_KEY"}
+    env["PYTHONPATH"] = str(ROOT)
+    env.setdefault("ASTRO_DB_PATH", os.path.join(tempfile.gettempdir(), "astro-import-time.db"))
+    code = "; ".join(f"import {name}" for name in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    records = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append({
+                "module": name,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                "depth": len(indent) // 2,
+            })
+    errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+    return {
+        "ok": proc.returncode == 0,
+        "errors": errors[-20:] if proc.returncode else [],
+        # Top-level entries are what the -c statement imported directly.
+        "total_ms": sum(r["cumulative_ms"] for r in records if r["depth"] == 0),
+        "modules": records,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("ASTRO_IMPORT_BUDGET_MS", "0")),
+                        help="fail if the total exceeds this (0 = report only)")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    modules = app_imports()
+    result = measure(modules)
+    over = bool(args.budget_ms) and result["total_ms"] > args.budget_ms
+    by_cumulative = sorted(result["modules"], key=lambda r: r["cumulative_ms"], reverse=True)[:args.top]
+    by_self = sorted(result["modules"], key=lambda r: r["self_ms"], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({
+            "imports": modules,
+            "ok": result["ok"],
+            "errors": result["errors"],
+            "total_ms": result["total_ms"],
+            "budget_ms": args.budget_ms or None,
+            "over_budget": over,
+            "top_cumulative": by_cumulative,
+            "top_self": by_self,
+        }, indent=2))
+    else:
+        print(f"app.py imports: {', '.join(modules)}\n")
+        print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+        for r in by_cumulative:
+            print(f"{r['cumulative_ms']:>14.1f}{r['self_ms']:>10.1f}  {r['module']}")
+        print(f"\n{'self ms':>14}  module")
+        for r in by_self:
+            print(f"{r['self_ms']:>14.1f}  {r['module']}")
+        print(f"\ntotal: {result['total_ms']:.1f} ms" + (f" (budget {args.budget_ms:.0f} ms)" if args.budget_ms else ""))
+        for line in result["errors"]:
+            print(line, file=sys.stderr)
+
+    if not result["ok"]:
+        sys.exit("import failed (without GROQ_API_KEY)")
+    if over:
+        sys.exit(f"over budget: {result['total_ms']:.1f} ms > {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
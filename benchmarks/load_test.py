@@ -0,0 +1,320 @@
+"""
+Offline load test: N concurrent users log in, complete their profile and ask
+dashboard questions against app.py, with Groq replaced by benchmarks.mock_groq.
+
+    python -m benchmarks.load_test --users 20 --questions 5
+    python -m benchmarks.load_test --users 50 --latency lognormal:500,0.6 --rate-limit-rate 0.05 --json
+
+Each user is a streamlit.testing AppTest session running the real app.py script
+in this process, so the shared caches, connection pool, governor and event loop
+behave as in one Streamlit server. Accounts are created up front in a throwaway
+database (ASTRO_DB_PATH); the login form then runs the normal verify_user path.
+
+Stages timed per user:
+    open      first render of the login page
+    login     submit the login form (lands on the profile popup)
+    profile   submit the profile form (lands on the dashboard)
+    question  type a question, press Send, wait for the full answer
+
+SQLite lock waits are sampled by a probe thread that repeatedly takes the write
+lock (BEGIN IMMEDIATE) on its own connection and times how long that blocks;
+pool checkout waits come from the connection pool's counters.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from benchmarks import mock_groq
+
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+STAGES = ["open", "login", "profile", "question"]
+PASSWORD = "load-test-pw"
+
+QUESTIONS = [
+    "When will I get married?",
+    "How will my career be this year?",
+    "Is Saturn transit good for my rashi?",
+    "What is my lucky colour according to astrology?",
+    "Do I have manglik dosha in my kundali?",
+    "Which gemstone should I wear for Jupiter?",
+    "Will I travel abroad for work?",
+    "How is my love life looking as per my horoscope?",
+    "Write a python function to reverse a string",
+    "What is the capital of France?",
+]
+PLACES = ["Delhi", "Mumbai", "Bengaluru", "Chennai", "Kolkata", "Pune", "Jaipur"]
+RASHIS = [
+    "Aries", "Taurus", "Gemini", "Cancer", "Leo", "Virgo",
+    "Libra", "Scorpio", "Sagittarius", "Capricorn", "Aquarius", "Pisces",
+]
+
+
+def _pct(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(values) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": _pct(values, 50) * 1000,
+        "p95_ms": _pct(values, 95) * 1000,
+        "p99_ms": _pct(values, 99) * 1000,
+        "mean_ms": statistics.fmean(values) * 1000,
+        "max_ms": max(values) * 1000,
+    }
+
+
+# ==========================================================
+# LOCK PROBE
+# ==========================================================
+
+class LockProbe(threading.Thread):
+    """Times BEGIN IMMEDIATE on a private connection every `interval` seconds."""
+
+    def __init__(self, path: str, interval: float = 0.02):
+        super().__init__(name="lock-probe", daemon=True)
+        self.path = path
+        self.interval = interval
+        self.waits = []
+        self.timeouts = 0
+        self._halt = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            while not self._halt.wait(self.interval):
+                start = time.perf_counter()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                except sqlite3.OperationalError:
+                    self.timeouts += 1
+                    continue
+                self.waits.append(time.perf_counter() - start)
+                conn.execute("ROLLBACK")
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+# ==========================================================
+# SIMULATED USER
+# ==========================================================
+
+def _share_runtime() -> None:
+    """
+    AppTest installs a mock Runtime singleton for each run and clears it when the
+    run ends, so with several sessions running at once one session's cleanup would
+    pull the runtime out from under the others. Keep serving the last one installed.
+    """
+    from streamlit.runtime import Runtime
+
+    last = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            last["runtime"] = cls._instance
+        elif "runtime" not in last:
+            raise RuntimeError("Runtime hasn't been created!")
+        return cls._instance or last["runtime"]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or "runtime" in last)
+
+
+def quiet_streamlit() -> None:
+    # Bare-mode and accessibility warnings are printed once per session and run.
+    from streamlit import config, logger
+
+    config.get_config_options()  # parse now, or a later parse resets the level
+    config.set_option("logger.level", "error")
+    logger.set_log_level("error")
+
+
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def simulate_user(index: int, args, timings: dict, errors: list, lock: threading.Lock) -> None:
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(args.seed * 1000 + index)
+    at = AppTest.from_file(str(APP), default_timeout=args.timeout)
+
+    def stage(name, action):
+        start = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].message}")
+        with lock:
+            timings[name].append(elapsed)
+
+    try:
+        stage("open", at.run)
+
+        def login():
+            at.text_input[0].input(f"load{index}@example.com")
+            at.text_input[1].input(PASSWORD)
+            _button(at, "Login").click().run()
+        stage("login", login)
+        if not at.session_state["user"]:
+            raise RuntimeError("login: still on the login page")
+
+        def profile():
+            at.text_input[0].input(rng.choice(PLACES))
+            at.selectbox[1].set_value(rng.choice(RASHIS))
+            _button(at, "Continue").click().run()
+        stage("profile", profile)
+
+        for _ in range(args.questions):
+            question = rng.choice(QUESTIONS)
+            if args.unique:
+                question = f"{question} (asked by user {index})"
+            before = len(at.session_state["messages"])
+
+            def ask():
+                at.text_input(key="prompt_input").input(question)
+                _button(at, "Send").click().run()
+            stage("question", ask)
+            if len(at.session_state["messages"]) != before + 2:
+                raise RuntimeError("question: no answer was added to the chat")
+            if args.think_ms:
+                time.sleep(rng.uniform(0, 2 * args.think_ms) / 1000)
+    except Exception as exc:
+        with lock:
+            errors.append(f"user {index}: {exc}")
+
+
+# ==========================================================
+# DRIVER
+# ==========================================================
+
+def run(args) -> dict:
+    from utils.auth import create_user
+    from utils.db import get_pool
+    from utils.governor import GOVERNOR
+    from utils.schema import ensure_schema
+
+    ensure_schema()
+    _share_runtime()
+    quiet_streamlit()
+    for i in range(args.users):
+        create_user(f"load{i}", f"load{i}@example.com", PASSWORD)
+
+    probe = LockProbe(os.environ["ASTRO_DB_PATH"])
+    probe.start()
+
+    timings = {name: [] for name in STAGES}
+    errors = []
+    lock = threading.Lock()
+    threads = []
+    start = time.perf_counter()
+    for i in range(args.users):
+        thread = threading.Thread(target=simulate_user, args=(i, args, timings, errors, lock))
+        thread.start()
+        threads.append(thread)
+        if args.ramp_s:
+            time.sleep(args.ramp_s / args.users)
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    probe.stop()
+
+    pool = get_pool().stats
+    return {
+        "users": args.users,
+        "questions_per_user": args.questions,
+        "wall_s": wall,
+        "throughput": {
+            "questions_per_s": len(timings["question"]) / wall,
+            "sessions_per_s": len(timings["profile"]) / wall,
+        },
+        "stages": {name: summarize(values) for name, values in timings.items()},
+        "sqlite": {
+            "lock_wait": summarize(probe.waits),
+            "lock_wait_over_1ms": sum(1 for w in probe.waits if w > 0.001),
+            "lock_timeouts": probe.timeouts,
+            "pool_checkout_waits": pool["waits"],
+            "pool_wait_s": pool["wait_seconds"],
+        },
+        "governor": GOVERNOR.snapshot(),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--questions", type=int, default=3, help="questions per user")
+    parser.add_argument("--ramp-s", type=float, default=0.0, help="spread user start times over this many seconds")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between questions")
+    parser.add_argument("--unique", action="store_true", help="make every question unique (defeats the answer caches)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="max seconds per script run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    mock_groq.add_arguments(parser)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    server = mock_groq.start_server(**mock_groq.server_options(args))
+    workdir = tempfile.mkdtemp(prefix="astro-load-")
+    # Must be set before utils.* is imported: the app reads them at import time.
+    os.environ["ASTRO_DB_PATH"] = os.path.join(workdir, "load.db")
+    os.environ["GROQ_BASE_URL"] = server.url
+    os.environ["GROQ_API_KEY"] = "mock"
+
+    report = run(args)
+    report["mock"] = server.stats
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{report['users']} users x {report['questions_per_user']} questions in {report['wall_s']:.1f}s")
+    print(
+        f"throughput: {report['throughput']['questions_per_s']:.2f} questions/s, "
+        f"{report['throughput']['sessions_per_s']:.2f} sessions/s\n"
+    )
+    print(f"{'stage':<10}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name in STAGES:
+        s = report["stages"][name]
+        if s["count"]:
+            print(f"{name:<10}{s['count']:>6}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}")
+    lw = report["sqlite"]["lock_wait"]
+    if lw["count"]:
+        print(
+            f"\nsqlite write-lock wait: p50 {lw['p50_ms']:.2f} ms, p99 {lw['p99_ms']:.2f} ms, "
+            f"max {lw['max_ms']:.2f} ms ({report['sqlite']['lock_wait_over_1ms']} of {lw['count']} probes > 1 ms, "
+            f"{report['sqlite']['lock_timeouts']} timeouts)"
+        )
+    print(
+        f"pool checkout waits: {report['sqlite']['pool_checkout_waits']} "
+        f"({report['sqlite']['pool_wait_s']:.3f}s total)"
+    )
+    gov = report["governor"]
+    print(f"governor: {gov['acquired']} admitted, {gov['retries']} retries, {gov['throttled']} throttled")
+    print(f"mock: {report['mock']}")
+    if report["errors"]:
+        print(f"\n{len(report['errors'])} errors:")
+        for line in report["errors"][:20]:
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
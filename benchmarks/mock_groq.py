@@ -0,0 +1,279 @@
+"""
+Local stand-in for Groq's chat-completions endpoint, for offline load tests.
+
+    python -m benchmarks.mock_groq --port 8765 --latency lognormal:300,0.5
+    GROQ_BASE_URL=http://127.0.0.1:8765 GROQ_API_KEY=mock streamlit run app.py
+
+Serves POST .../chat/completions in the OpenAI/Groq wire format, streaming
+(server-sent events) or not. Replies are canned but shaped like the real ones
+for each prompt in utils.extension (classifier JSON, batched classifier array,
+single-pass JSON, improved prompt, expert answer), so the app's parsing paths
+run as in production. GET .../models answers the app's connection warm-up.
+
+Timing: time to first token is drawn from --latency, then every completion token
+costs --token-ms (streamed one word per chunk). --error-rate returns 500s and
+--rate-limit-rate returns 429s with a Retry-After header, to exercise the
+governor's backoff.
+
+Latency specs: fixed:MS, uniform:LOW,HIGH, lognormal:MEDIAN,SIGMA (all ms).
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+ASTRO_WORDS = set(
+    """
+    astrology astrologer horoscope kundali kundli zodiac rashi nakshatra dosha doshas
+    manglik planet planets saturn shani jupiter rahu ketu mars venus moon sun sign
+    birth chart marriage career gemstone lucky transit yoga dasha compatibility
+    """.split()
+)
+
+ANSWER_WORDS = (
+    "Based on your birth chart the current Jupiter transit supports steady progress "
+    "while Saturn asks for patience in matters of career and relationships. Your rashi "
+    "lord is well placed so the coming months favour planning over hasty decisions. "
+    "Wearing your lucky colour and chanting the planetary mantra on its weekday can "
+    "help balance minor dosha effects. Stay consistent and trust the timing of the stars."
+).split()
+
+
+# ==========================================================
+# LATENCY MODEL
+# ==========================================================
+
+def parse_latency(spec: str):
+    """Returns a zero-argument function drawing one latency in seconds."""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        low, high = values
+        return lambda: random.uniform(low, high) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma) / 1000
+    raise ValueError(f"bad latency spec {spec!r}; use fixed:MS, uniform:LO,HI or lognormal:MEDIAN,SIGMA")
+
+
+# ==========================================================
+# CANNED REPLIES
+# ==========================================================
+
+def _is_astro(text: str) -> bool:
+    return bool(ASTRO_WORDS & set(re.findall(r"[a-z]+", text.lower())))
+
+
+def reply_for(messages: list[dict], max_tokens: int) -> str:
+    system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+    user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+
+    if "numbered list" in system:
+        lines = [line for line in user.splitlines() if line.strip()]
+        return json.dumps([_is_astro(line) for line in lines])
+    if "strict classifier" in system:
+        return json.dumps({"is_astrology": _is_astro(user)})
+
+    words = ANSWER_WORDS[: max(1, min(len(ANSWER_WORDS), max_tokens))]
+    if "single JSON object" in system:
+        astro = _is_astro(user)
+        return json.dumps({"is_astrology": astro, "answer": " ".join(words) if astro else ""})
+    if "Rewrite the user input" in system:
+        return f"Please give a detailed astrological reading about: {user.strip()}"
+    return " ".join(words)
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+# ==========================================================
+# SERVER
+# ==========================================================
+
+class MockGroqServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency="lognormal:300,0.5", token_ms=5.0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0):
+        super().__init__(address, _Handler)
+        self.first_token = parse_latency(latency)
+        self.token_ms = token_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "streams": 0, "errors_injected": 0, "throttled": 0}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def bump(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: MockGroqServer
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status: int, payload: dict, headers: dict | None = None) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # The app's connection warm-up (utils.llm_client) lists models.
+        if not self.path.endswith("/models"):
+            self._json(404, {"error": {"message": f"unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        self._json(200, {"object": "list", "data": [{"id": "llama-3.1-8b-instant", "object": "model", "owned_by": "mock"}]})
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._json(404, {"error": {"message": f"unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        server.bump("requests")
+
+        roll = random.random()
+        if roll < server.rate_limit_rate:
+            server.bump("throttled")
+            self._json(
+                429,
+                {"error": {"message": "Rate limit reached (mock)", "type": "tokens", "code": "rate_limit_exceeded"}},
+                {"Retry-After": f"{server.retry_after:g}"},
+            )
+            return
+        if roll < server.rate_limit_rate + server.error_rate:
+            server.bump("errors_injected")
+            self._json(500, {"error": {"message": "Internal server error (mock)", "type": "internal_server_error"}})
+            return
+
+        messages = request.get("messages") or []
+        text = reply_for(messages, int(request.get("max_tokens") or 200))
+        usage = {
+            "prompt_tokens": sum(count_tokens(m.get("content") or "") for m in messages),
+            "completion_tokens": count_tokens(text),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = request.get("model", "mock")
+
+        time.sleep(server.first_token())
+
+        if request.get("stream"):
+            server.bump("streams")
+            self._stream(completion_id, model, text, usage)
+            return
+
+        time.sleep(usage["completion_tokens"] * server.token_ms / 1000)
+        self._json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id: str, model: str, text: str, usage: dict) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta: dict, finish=None, extra=None) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                **(extra or {}),
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        words = text.split(" ")
+        per_word = usage["completion_tokens"] / max(1, len(words)) * self.server.token_ms / 1000
+        event({"role": "assistant", "content": ""})
+        for i, word in enumerate(words):
+            event({"content": word if i == 0 else " " + word})
+            time.sleep(per_word)
+        event({}, "stop", {"x_groq": {"id": completion_id, "usage": usage}})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(host="127.0.0.1", port=0, **options) -> MockGroqServer:
+    """Starts the mock in a daemon thread; port 0 picks a free port (see .url)."""
+    server = MockGroqServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="mock-groq", daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", default="lognormal:300,0.5", help="time to first token (default %(default)s)")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="time per completion token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+
+
+def server_options(args) -> dict:
+    return {
+        "latency": args.latency,
+        "token_ms": args.token_ms,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "retry_after": args.retry_after,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=None)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    server = MockGroqServer((args.host, args.port), **server_options(args))
+    print(f"mock Groq listening on {server.url}  (export GROQ_BASE_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
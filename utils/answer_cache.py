@@ -0,0 +1,228 @@
+"""
+Persistent answer cache for get_astro_response, stored in SQLite (answer_cache table).
+
+Entries are keyed by the normalized question text plus a fingerprint of the
+profile fields the expert prompt actually uses, so the fixed suggestion buttons
+and common questions are answered without an LLM call for users with the same
+birth details. A lookup is a single indexed SELECT, so concurrent readers
+never queue on SQLite's write lock; hit counts and last-use times are kept in
+memory and written in one batch every HIT_FLUSH_S by a background thread (and
+before eviction, which orders by them).
+
+Configuration (environment variables):
+    ASTRO_ANSWER_CACHE        set to 0 to bypass the cache entirely (default 1)
+    ASTRO_ANSWER_CACHE_TTL    seconds an answer stays valid          (default 86400)
+    ASTRO_ANSWER_CACHE_MAX    max rows kept; least recently used go first (default 50000)
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from utils.classifier import tokenize
+from utils.db import get_conn
+from utils.schema import ensure_schema
+
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("ASTRO_ANSWER_CACHE", "1") != "0"
+TTL_SECONDS = int(os.getenv("ASTRO_ANSWER_CACHE_TTL", "86400"))
+MAX_ENTRIES = int(os.getenv("ASTRO_ANSWER_CACHE_MAX", "50000"))
+
+# Size/TTL eviction runs once every this many inserts rather than on every put.
+EVICT_EVERY = 100
+
+# Seconds between writes of the pending hit counts.
+HIT_FLUSH_S = 5.0
+
+STATS = {"hits": 0, "misses": 0, "puts": 0, "evicted": 0}
+_stats_lock = threading.Lock()
+_puts_since_evict = 0
+_pending_hits = {}  # key -> [hits, last_used_at] not yet written
+
+
+def _bump(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        STATS[key] += n
+
+
+# ==========================================================
+# KEYS
+# ==========================================================
+
+def normalize_question(question: str) -> str:
+    """Casefolds and drops emoji/punctuation: "🧘 Daily Horoscope!" -> "daily horoscope".
+
+    Letters in any script are kept, so "मेरी कुंडली?" -> "मेरी कुंडली".
+    """
+    return " ".join(tokenize(question))
+
+
+def cacheable(question: str) -> bool:
+    """False for questions with no words at all ("🔮🔮?"), which would all share one key."""
+    return bool(normalize_question(question))
+
+
+def profile_fingerprint(profile: dict | None, fields) -> str:
+    values = [(profile or {}).get(field) or "" for field in fields]
+    return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+
+def make_key(question: str, fingerprint: str, namespace: str = "") -> str:
+    """
+    namespace should change whenever answers for the same input would change
+    (e.g. a hash of the system prompt), so old entries stop matching.
+    """
+    raw = "\x1f".join((namespace, normalize_question(question), fingerprint))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ==========================================================
+# STORE
+# ==========================================================
+
+def get(key: str) -> str | None:
+    """Returns the cached answer, or None. Never raises."""
+    ensure_schema()
+    now = int(time.time())
+    try:
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT answer FROM answer_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            )
+            row = cur.fetchone()
+    except sqlite3.Error as e:
+        log.warning("answer cache read failed: %s", e)
+        row = None
+
+    if not row:
+        _bump("misses")
+        return None
+    with _stats_lock:
+        STATS["hits"] += 1
+        pending = _pending_hits.setdefault(key, [0, now])
+        pending[0] += 1
+        pending[1] = now
+    _start_flusher()
+    return row[0]
+
+
+def flush_hits() -> None:
+    """Writes the hit counts and last-use times gathered since the last flush."""
+    global _pending_hits
+    with _stats_lock:
+        pending, _pending_hits = _pending_hits, {}
+    if not pending:
+        return
+    try:
+        with get_conn() as conn:
+            conn.executemany(
+                "UPDATE answer_cache SET hits = hits + ?, last_used_at = max(last_used_at, ?) WHERE key = ?",
+                [(hits, last_used, key) for key, (hits, last_used) in pending.items()],
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        # Only the LRU order and hit counts suffer.
+        log.warning("answer cache hit update failed: %s", e)
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(HIT_FLUSH_S)
+        flush_hits()
+
+
+_flusher_started = False
+_flusher_lock = threading.Lock()
+
+
+def _start_flusher() -> None:
+    """Starts the hit-count writer on the first hit, once per process."""
+    global _flusher_started
+    if _flusher_started:
+        return
+    with _flusher_lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+    threading.Thread(target=_flush_loop, name="astro-answer-cache-hits", daemon=True).start()
+    atexit.register(flush_hits)
+
+
+def put(key: str, question: str, answer: str, ttl_seconds: int | None = None) -> None:
+    """Stores an answer. Failures are logged, never raised: the cache is optional."""
+    global _puts_since_evict
+    ensure_schema()
+    now = int(time.time())
+    ttl = TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    try:
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO answer_cache (key, question, answer, created_at, expires_at, hits, last_used_at)
+                VALUES (?, ?, ?, ?, ?, 0, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    answer = excluded.answer,
+                    created_at = excluded.created_at,
+                    expires_at = excluded.expires_at,
+                    last_used_at = excluded.last_used_at
+                """,
+                (key, question, answer, now, now + ttl, now),
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        log.warning("answer cache write failed: %s", e)
+        return
+    _bump("puts")
+
+    with _stats_lock:
+        _puts_since_evict += 1
+        due = _puts_since_evict >= EVICT_EVERY
+        if due:
+            _puts_since_evict = 0
+    if due:
+        try:
+            evict()
+        except sqlite3.Error as e:
+            log.warning("answer cache eviction failed: %s", e)
+
+
+def evict(max_entries: int | None = None) -> int:
+    """Drops expired rows, then the least recently used rows above max_entries."""
+    limit = MAX_ENTRIES if max_entries is None else max_entries
+    flush_hits()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM answer_cache WHERE expires_at <= ?", (int(time.time()),))
+        removed = cur.rowcount
+        cur.execute(
+            """
+            DELETE FROM answer_cache WHERE key IN (
+                SELECT key FROM answer_cache
+                ORDER BY last_used_at
+                LIMIT max(0, (SELECT COUNT(*) FROM answer_cache) - ?)
+            )
+            """,
+            (limit,),
+        )
+        removed += cur.rowcount
+        conn.commit()
+    _bump("evicted", removed)
+    return removed
+
+
+def clear() -> None:
+    with _stats_lock:
+        _pending_hits.clear()
+    with get_conn() as conn:
+        conn.execute("DELETE FROM answer_cache")
+        conn.commit()
@@ -0,0 +1,150 @@
+"""
+Stylesheet bundles for the views.
+
+Each page injects one bundle: its view's .css files (see BUNDLES), minified
+and concatenated. A bundle is built the first time it is needed and then served
+from memory by every session in the process, so a rerun no longer opens and
+reads the file. Streamlit drops any element a full run does not render again,
+so the <style> element is still emitted on every full run. Its content is
+identical each time, and fragment reruns skip it.
+
+With ASTRO_CSS_RELOAD=1 (the default) a bundle is rebuilt when one of its
+files changes on disk (mtime), so CSS edits show up on the next rerun. Set it
+to 0 in production to skip the stat calls.
+
+Configuration (environment variables):
+    ASTRO_CSS_RELOAD       rebuild bundles whose files changed (default 1)
+    ASTRO_CSS_PRECOMPILE   build every bundle at server start  (default 0)
+
+Inspect or precompile the bundles from the command line:
+    python -m utils.assets
+    python -m utils.assets --out build/css
+"""
+
+import argparse
+import os
+import re
+import threading
+from pathlib import Path
+
+from utils import profiler
+
+
+VIEWS = Path(__file__).resolve().parents[1] / "views"
+
+RELOAD = os.getenv("ASTRO_CSS_RELOAD", "1") != "0"
+PRECOMPILE = os.getenv("ASTRO_CSS_PRECOMPILE", "0") == "1"
+
+# bundle name -> stylesheets (relative to views/), in cascade order
+BUNDLES = {
+    "dashboard": ["dashboard_view/dashboard.css"],
+    "login": ["auth_view/login_view/login.css"],
+    "register": ["auth_view/register_view/register.css"],
+    "forgot_password": ["auth_view/forgot_password_view/forgot_password.css"],
+}
+
+
+# ==========================================================
+# MINIFY
+# ==========================================================
+
+# Strings are matched first so nothing inside quotes is touched.
+_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(/\*.*?\*/)|(\s+)', re.S)
+_PUNCTUATION = re.compile(r"\s*([{};,>])\s*|(:)\s+")
+
+
+def minify(css: str) -> str:
+    """Drops comments and redundant whitespace. Selectors keep their descendant spaces."""
+    parts = []
+    for chunk, string in _split(css):
+        parts.append(chunk if string else _PUNCTUATION.sub(lambda m: m.group(1) or m.group(2), chunk).replace(";}", "}"))
+    return "".join(parts).strip()
+
+
+def _split(css: str):
+    """Yields (text, is_string) with comments removed and whitespace runs collapsed."""
+    pos = 0
+    buffer = []
+    for match in _TOKENS.finditer(css):
+        buffer.append(css[pos:match.start()])
+        pos = match.end()
+        string, comment, space = match.groups()
+        if string:
+            yield "".join(buffer), False
+            buffer = []
+            yield string, True
+        elif space or comment:
+            buffer.append(" ")
+    buffer.append(css[pos:])
+    yield "".join(buffer), False
+
+
+# ==========================================================
+# BUNDLES
+# ==========================================================
+
+_bundles = {}  # name -> (mtimes, css)
+_lock = threading.Lock()
+
+
+def _paths(name: str) -> list[Path]:
+    try:
+        return [VIEWS / rel for rel in BUNDLES[name]]
+    except KeyError:
+        raise KeyError(f"unknown CSS bundle {name!r}") from None
+
+
+def build(name: str) -> str:
+    """Reads, minifies and concatenates the bundle's files (no caching)."""
+    return "".join(minify(path.read_text(encoding="utf-8")) for path in _paths(name))
+
+
+def bundle(name: str) -> str:
+    cached = _bundles.get(name)
+    if cached is not None and not RELOAD:
+        return cached[1]
+
+    mtimes = tuple(path.stat().st_mtime_ns for path in _paths(name))
+    if cached is not None and cached[0] == mtimes:
+        return cached[1]
+    with _lock:
+        cached = _bundles.get(name)
+        if cached is None or cached[0] != mtimes:
+            cached = (mtimes, build(name))
+            _bundles[name] = cached
+    return cached[1]
+
+
+def precompile() -> dict:
+    """Builds every bundle now; returns name -> minified size in bytes."""
+    return {name: len(bundle(name).encode("utf-8")) for name in BUNDLES}
+
+
+def inject_css(name: str) -> None:
+    import streamlit as st
+
+    with profiler.phase("css"):
+        st.markdown(f"<style>{bundle(name)}</style>", unsafe_allow_html=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the view CSS bundles.")
+    parser.add_argument("--out", help="also write each bundle to OUT/<name>.min.css")
+    args = parser.parse_args()
+
+    print(f"{'bundle':<18}{'files':>6}{'source B':>10}{'minified B':>12}")
+    for name, size in precompile().items():
+        source = sum(path.stat().st_size for path in _paths(name))
+        print(f"{name:<18}{len(BUNDLES[name]):>6}{source:>10}{size:>12}")
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+            with open(os.path.join(args.out, f"{name}.min.css"), "w", encoding="utf-8") as f:
+                f.write(bundle(name))
+
+
+if PRECOMPILE:
+    precompile()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 """
-Simple authentication backend using SQLite and secure password hashing (sha256 + salt).
-This is intentionally lightweight for demo purposes only — do NOT use in production.
+Simple authentication backend using SQLite and salted password hashing.
+New passwords use a slow KDF (scrypt or PBKDF2, see utils.passwords); legacy
+sha256 + salt hashes are upgraded on the next successful login.
 """
 
 """
@@ -89,71 +90,38 @@ import smtplib
 
 
 import streamlit as st
-import sqlite3
-import hashlib
+import os
 import secrets
 import time
-from typing import Optional, Tuple
-
-
-DB_PATH = "users.db"
-
-
-def get_conn():   
-    # with(connect(host="127.0.0.1",
-    #              user="root",
-    #              password="Ghjk!@123",
-    #              database="astrology_app")
-    #     as conn):     
-    #     st.warning("connection done")
-    return sqlite3.connect(DB_PATH)
-    
-    print("connection created")
+from typing import Optional
+from utils.db import get_conn
+from utils.schema import ensure_schema
+from utils.cache import LRUCache, MISSING
+from utils import metrics, passwords, tracing
 
 
 def init_db() -> None:
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT,
-                email TEXT UNIQUE,
-                password_hash TEXT,
-                salt TEXT,
-                reset_token TEXT,
-                reset_token_expiry INTEGER
-            )
-            """
-        )
-        conn.commit()
+    """Kept for callers of the old API; the schema now lives in utils.schema."""
+    ensure_schema()
 
 # ==========================================================
 # USER PROFILE STORAGE
 # ==========================================================
 
 def init_profile_table() -> None:
-    with get_conn() as conn:
-        cur = conn.cursor()        
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE,
-                dob TEXT,
-                tob TEXT,
-                place TEXT,
-                fav_color TEXT,
-                rashi TEXT,
-                language TEXT,
-                gender TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-            """
-        )
-        conn.commit()
+    """Kept for callers of the old API; the schema now lives in utils.schema."""
+    ensure_schema()
 
+
+# Process-wide read-through cache of profiles keyed by user_id, shared by all sessions.
+# "No profile yet" is cached as None; save_user_profile() invalidates the entry.
+PROFILE_CACHE = LRUCache(
+    maxsize=int(os.getenv("ASTRO_PROFILE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("ASTRO_PROFILE_CACHE_TTL", "300")),
+)
+metrics.register_cache("profile", PROFILE_CACHE)
+
+@tracing.traced("auth.save_user_profile")
 def save_user_profile(   
     user_id: int,
     dob: str,
@@ -188,6 +156,7 @@ def save_user_profile(
                 (user_id, dob, tob, place, fav_color, rashi, language, gender),
             )
             conn.commit()
+        PROFILE_CACHE.invalidate(user_id)
         return True
     except Exception as e:
         # Optional: log the error
@@ -219,7 +188,23 @@ def save_user_profile_session(
         "gender": gender,
     }
 
+@tracing.traced("auth.get_user_profile")
 def get_user_profile(user_id: int) -> dict | None:
+    """
+    Returns the user's profile, served from PROFILE_CACHE when possible.
+    Callers get their own copy, so mutating it never touches the shared cache.
+    A row loaded while save_user_profile() invalidated a profile isn't cached,
+    as it may predate the save.
+    """
+    profile = PROFILE_CACHE.get(user_id)
+    tracing.set_attributes(cache="hit" if profile is not MISSING else "miss")
+    if profile is MISSING:
+        generation = PROFILE_CACHE.generation()
+        profile = _load_user_profile(user_id)
+        PROFILE_CACHE.set(user_id, profile, generation)
+    return dict(profile) if profile else None
+
+def _load_user_profile(user_id: int) -> dict | None:
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute(
@@ -268,21 +253,22 @@ def get_user_profile_session(user_id: int) -> dict | None:
         "gender": profile.get("gender"),
     }
 
+@tracing.traced("auth.get_user_profile_smart")
 def get_user_profile_smart(user_id: int) -> dict | None:
     """
-    Smart profile retrieval: checks session first, then DB, then caches in session.
+    Smart profile retrieval: checks session first, then the shared profile cache
+    (which falls back to the DB), then caches in session.
     Returns None if profile doesn't exist.
     """
     # Try to get from session first
     profile = get_user_profile_session(user_id)    
     if profile:
-        st.warning("hi")
+        tracing.set_attributes(source="session")
         return profile
     
-    # If not in session, fetch from database
+    # If not in session, fetch from the shared cache / database
     profile = get_user_profile(user_id)    
     if not profile:
-        st.warning("hello")
         return None
     
     # Cache the profile in session for future use
@@ -299,36 +285,49 @@ def get_user_profile_smart(user_id: int) -> dict | None:
     
     return profile   
 
+@tracing.traced("auth.is_user_profile_complete")
 def is_user_profile_complete(user_id: int) -> bool:
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT 1
-            FROM user_profiles
-            WHERE user_id = ?
-            """,
-            (user_id,),
-        )
-        return cur.fetchone() is not None
+    return get_user_profile(user_id) is not None
 
 
-def _hash_password(password: str, salt: Optional[str] = None) -> Tuple[str, str]:
-    if salt is None:
-        salt = secrets.token_hex(16)
-    h = hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
-    return salt, h
+# Users allowed on the admin pages (Metrics), by email, comma-separated.
+ADMIN_EMAILS = {
+    email.strip().lower() for email in os.getenv("ASTRO_ADMIN_EMAILS", "").split(",") if email.strip()
+}
+
 
+# user_id -> admin or not; the sidebar asks on every rerun. Emails never change.
+ADMIN_CACHE = LRUCache(
+    maxsize=int(os.getenv("ASTRO_ADMIN_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("ASTRO_ADMIN_CACHE_TTL", "300")),
+)
+metrics.register_cache("admin", ADMIN_CACHE)
 
+
+@tracing.traced("auth.is_admin")
+def is_admin(user_id: int) -> bool:
+    if not ADMIN_EMAILS or not user_id:
+        return False
+    admin = ADMIN_CACHE.get(user_id)
+    tracing.set_attributes(cache="hit" if admin is not MISSING else "miss")
+    if admin is MISSING:
+        with get_conn() as conn:
+            row = conn.execute("SELECT email FROM users WHERE id = ?", (user_id,)).fetchone()
+        admin = row is not None and row[0] in ADMIN_EMAILS
+        ADMIN_CACHE.set(user_id, admin)
+    return admin
+
+
+@tracing.traced("auth.create_user")
 def create_user(username: str, email: str, password: str) -> bool:
-    salt, pw_hash = _hash_password(password)
+    salt, pw_hash, scheme = passwords.hash_password(password)
     #breakpoint()
     try:
         with get_conn() as conn:
             cur = conn.cursor()
             cur.execute(
-                "INSERT INTO users (username, email, password_hash, salt) VALUES (?, ?, ?, ?)",
-                (username, email.lower(), pw_hash, salt),
+                "INSERT INTO users (username, email, password_hash, salt, password_scheme) VALUES (?, ?, ?, ?, ?)",
+                (username, email.lower(), pw_hash, salt, scheme),
             )
             conn.commit()
         return True
@@ -336,26 +335,42 @@ def create_user(username: str, email: str, password: str) -> bool:
         return False
 
 
+@tracing.traced("auth.verify_user")
 def verify_user(email: str, password: str) -> Optional[int]:
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute(
-            "SELECT id, password_hash, salt FROM users WHERE email = ?",
+            "SELECT id, password_hash, salt, password_scheme FROM users WHERE email = ?",
             (email.lower(),)
         )
         row = cur.fetchone()
-        if not row:
-            return None
-
-        user_id, stored_hash, salt = row
-        _, computed_hash = _hash_password(password, salt)
+    if not row:
+        # Pay for a KDF run anyway, so response time doesn't tell which emails have accounts.
+        passwords.verify_dummy(password)
+        return None
 
-        if computed_hash == stored_hash:
-            return user_id
+    # Hashing runs on the password pool, with no pooled connection held meanwhile.
+    user_id, stored_hash, salt, scheme = row
+    if not passwords.verify_password(password, salt, stored_hash, scheme):
+        if passwords.needs_rehash(scheme):
+            # A legacy SHA-256 row fails in microseconds; pad it to a current-scheme
+            # run so response time doesn't tell which accounts are still on it.
+            passwords.verify_dummy(password)
         return 0
 
+    if passwords.needs_rehash(scheme):
+        new_salt, new_hash, new_scheme = passwords.hash_password(password)
+        with get_conn() as conn:
+            # Skipped if the password changed since we read it.
+            conn.execute(
+                "UPDATE users SET password_hash = ?, salt = ?, password_scheme = ? WHERE id = ? AND password_hash = ?",
+                (new_hash, new_salt, new_scheme, user_id, stored_hash),
+            )
+    return user_id
+
 
 
+@tracing.traced("auth.generate_reset_token")
 def generate_reset_token(email: str, ttl_seconds: int = 3600) -> Optional[str]:
     token = secrets.token_urlsafe(32)
     expiry = int(time.time()) + ttl_seconds
@@ -373,6 +388,7 @@ def generate_reset_token(email: str, ttl_seconds: int = 3600) -> Optional[str]:
     return token
 
 
+@tracing.traced("auth.verify_reset_token")
 def verify_reset_token(email: str, token: str) -> bool:
     with get_conn() as conn:
         cur = conn.cursor()
@@ -393,20 +409,22 @@ def verify_reset_token(email: str, token: str) -> bool:
         return True
 
 
+@tracing.traced("auth.reset_password")
 def reset_password(email: str, token: str, new_password: str) -> bool:
     if not verify_reset_token(email, token):
         return False
-    salt, pw_hash = _hash_password(new_password)
+    salt, pw_hash, scheme = passwords.hash_password(new_password)
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute(
-            "UPDATE users SET password_hash = ?, salt = ?, reset_token = NULL, reset_token_expiry = NULL WHERE email = ?",
-            (pw_hash, salt, email.lower()),
+            "UPDATE users SET password_hash = ?, salt = ?, password_scheme = ?, reset_token = NULL, reset_token_expiry = NULL WHERE email = ?",
+            (pw_hash, salt, scheme, email.lower()),
         )
         conn.commit()
     return True
 
 
+@tracing.traced("auth.user_exists")
 def user_exists(email: str) -> bool:
     with get_conn() as conn:
         cur = conn.cursor()
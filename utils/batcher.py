@@ -0,0 +1,117 @@
+"""
+Cross-session micro-batching.
+
+Callers from any Streamlit session thread submit one item and block; a collector
+thread groups items that arrive within `window` seconds (or until `max_batch`
+items) and hands the whole list to `handler`, which must return one result per
+item in order. Batches are processed on a small worker pool so a slow batch
+doesn't hold up the next window.
+
+    batcher = MicroBatcher(handler=classify_many, window=0.03, max_batch=16)
+    result = batcher.submit(question)
+
+A batch is processed under the tracing span (utils.tracing) of its first item's
+submit, so it shows up in that run's trace; the others show their wait.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from utils import tracing
+
+
+class MicroBatcher:
+    def __init__(self, handler, window: float = 0.03, max_batch: int = 16, workers: int = 4, name: str = "batcher"):
+        self.handler = handler
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.name = name
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"astro-{name}")
+        self._collector = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "items": 0,
+            "batches": 0,
+            "batch_sizes": {},            # size -> number of batches
+            "queue_delay_total": 0.0,     # seconds items waited for their batch to start
+            "queue_delay_max": 0.0,
+            "errors": 0,
+        }
+
+    def _ensure_collector(self) -> None:
+        if self._collector is None:
+            with self._lock:
+                if self._collector is None:
+                    self._collector = threading.Thread(
+                        target=self._collect, name=f"astro-{self.name}-collector", daemon=True
+                    )
+                    self._collector.start()
+
+    def submit(self, item, timeout: float | None = None):
+        """Blocks until the item's batch has been processed and returns its result."""
+        self._ensure_collector()
+        future = Future()
+        with tracing.span(f"batch.{self.name}"):
+            self._queue.put((item, future, time.monotonic(), tracing.current()))
+            return future.result(timeout)
+
+    def _collect(self) -> None:
+        while True:
+            first = self._queue.get()
+            batch = [first]
+            deadline = first[2] + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._pool.submit(self._process, batch)
+
+    def _process(self, batch) -> None:
+        started = time.monotonic()
+        delays = [started - enqueued for _, _, enqueued, _ in batch]
+        with self._stats_lock:
+            self.stats["items"] += len(batch)
+            self.stats["batches"] += 1
+            sizes = self.stats["batch_sizes"]
+            sizes[len(batch)] = sizes.get(len(batch), 0) + 1
+            self.stats["queue_delay_total"] += sum(delays)
+            self.stats["queue_delay_max"] = max(self.stats["queue_delay_max"], max(delays))
+
+        for _, _, _, span in batch:
+            if span is not None:
+                span.set(batch_size=len(batch))
+
+        try:
+            handler = tracing.bind(self.handler, parent=batch[0][3])
+            results = handler([item for item, _, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"{self.name}: handler returned {len(results)} results for {len(batch)} items")
+        except Exception as exc:
+            with self._stats_lock:
+                self.stats["errors"] += 1
+            for _, future, _, _ in batch:
+                future.set_exception(exc)
+            return
+
+        for (_, future, _, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            items = self.stats["items"]
+            batches = self.stats["batches"]
+            return {
+                **self.stats,
+                "batch_sizes": dict(self.stats["batch_sizes"]),
+                "mean_batch_size": items / batches if batches else 0.0,
+                "mean_queue_delay_ms": self.stats["queue_delay_total"] / items * 1000 if items else 0.0,
+                "pending": self._queue.qsize(),
+            }
@@ -0,0 +1,87 @@
+"""
+Small thread-safe in-process caches shared by every Streamlit session in the process.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Bounded LRU cache with an optional per-entry time-to-live.
+
+    get() returns MISSING (not None) on a miss, so None can be cached as a value,
+    e.g. "this user has no profile yet".
+
+    Read-through callers pass set() the generation() read before loading the
+    value: if an entry was invalidated meanwhile, the possibly stale value is
+    not cached.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generation = 0  # bumped by every invalidate() and clear()
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self) -> int:
+        return self._generation
+
+    def set(self, key, value, generation: int | None = None) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,244 @@
+"""
+Record/replay layer under llm_chat for reproducible, offline benchmarks.
+
+In record mode every completion that reaches Groq is stored with its usage and
+timings (total latency; per-chunk offsets for streams). In replay mode the same
+requests are answered from the cassette without touching the network, so
+pipeline changes can be benchmarked against identical model output.
+
+Requests are matched on (model, messages, temperature, max_tokens, stream).
+When a prompt template changes, exact matches disappear; with fuzzy matching
+on, a miss is served by the most similar recorded request of the same kind
+and system prompt, with prompt_tokens adjusted for the length difference.
+
+The cassette is gzip-compressed JSON lines: a header, then one entry per
+request. Repeated system prompts compress to almost nothing.
+
+Configuration (environment variables):
+    ASTRO_LLM_CASSETTE           cassette file; unset disables the layer
+    ASTRO_LLM_CASSETTE_MODE      replay (default), record, or auto (replay, record misses)
+    ASTRO_LLM_CASSETTE_FUZZY     1 to serve misses from the closest recording (default 0)
+    ASTRO_LLM_CASSETTE_REALTIME  1 to sleep for the recorded latency on replay (default 0)
+"""
+
+import atexit
+import difflib
+import gzip
+import json
+import os
+import threading
+import time
+
+from utils.governor import estimate_tokens
+
+
+FORMAT_VERSION = 1
+
+
+class CassetteMiss(KeyError):
+    """No recording for a request in replay mode."""
+
+
+def request_key(model, messages, temperature, max_tokens, stream=False) -> str:
+    return json.dumps([model, messages, temperature, max_tokens, bool(stream)], sort_keys=True)
+
+
+def _roles(messages, role) -> str:
+    return "\n".join(m.get("content") or "" for m in messages if m.get("role") == role)
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = "replay", fuzzy: bool = False, realtime: bool = False):
+        if mode not in ("replay", "record", "auto"):
+            raise ValueError(f"unknown cassette mode {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.fuzzy = fuzzy
+        self.realtime = realtime
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.stats = {}  # kind -> counters, see _count
+        if os.path.exists(path):
+            self.load()
+
+    # ---------- STORAGE ----------
+
+    def load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != FORMAT_VERSION:
+                raise ValueError(f"{self.path}: unsupported cassette version {header.get('version')!r}")
+            for line in f:
+                entry = json.loads(line)
+                self._entries[entry["key"]] = entry
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = list(self._entries.values())
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"version": FORMAT_VERSION, "saved_at": time.time(), "entries": len(entries)}) + "\n")
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        os.replace(tmp, self.path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ---------- MATCHING ----------
+
+    def _find(self, key, kind, messages, stream):
+        entry = self._entries.get(key)
+        if entry is not None or not self.fuzzy:
+            return entry, False
+
+        system, user = _roles(messages, "system"), _roles(messages, "user")
+        best, best_score = None, 0.0
+        for candidate in self._entries.values():
+            if candidate["kind"] != kind or candidate["stream"] != stream:
+                continue
+            if _roles(candidate["messages"], "system") != system:
+                continue
+            score = difflib.SequenceMatcher(None, _roles(candidate["messages"], "user"), user).ratio()
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is None:
+            return None, False
+
+        # Same answer, but charge the prompt tokens of the request actually made.
+        delta = estimate_tokens(messages, 0) - estimate_tokens(best["messages"], 0)
+        usage = dict(best["usage"])
+        usage["prompt_tokens"] = max(1, usage.get("prompt_tokens", 0) + delta)
+        return {**best, "usage": usage}, True
+
+    def _count(self, kind, outcome, usage, latency_ms) -> None:
+        with self._lock:
+            s = self.stats.setdefault(kind, {
+                "calls": 0, "replayed": 0, "fuzzy": 0, "recorded": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "llm_ms": 0.0,
+            })
+            s["calls"] += 1
+            s[outcome] += 1
+            s["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            s["completion_tokens"] += usage.get("completion_tokens", 0)
+            s["llm_ms"] += latency_ms
+
+    def _lookup(self, kind, model, messages, temperature, max_tokens, stream):
+        key = request_key(model, messages, temperature, max_tokens, stream)
+        if self.mode == "record":
+            return key, None
+        entry, fuzzy = self._find(key, kind, messages, stream)
+        if entry is None and self.mode == "replay":
+            raise CassetteMiss(f"no recording for {kind} request ({len(self)} entries in {self.path})")
+        if entry is not None:
+            self._count(kind, "fuzzy" if fuzzy else "replayed", entry["usage"], entry["latency_ms"])
+        return key, entry
+
+    def _store(self, key, kind, model, messages, temperature, max_tokens, stream, text, usage, latency_ms, offsets=None):
+        entry = {
+            "key": key,
+            "kind": kind,
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream,
+            "text": text,
+            "usage": usage,
+            "latency_ms": round(latency_ms, 2),
+        }
+        if offsets is not None:
+            entry["chunks"] = offsets  # [[chars, ms since request start], ...]
+        with self._lock:
+            self._entries.setdefault(key, entry)
+            self._dirty = True
+        self._count(kind, "recorded", usage, latency_ms)
+
+    # ---------- ENTRY POINTS ----------
+
+    def complete(self, kind, model, messages, temperature, max_tokens, live) -> tuple[str, dict]:
+        """Replays a completion, or calls live() -> (text, usage) and records it."""
+        key, entry = self._lookup(kind, model, messages, temperature, max_tokens, False)
+        if entry is not None:
+            if self.realtime:
+                time.sleep(entry["latency_ms"] / 1000)
+            return entry["text"], dict(entry["usage"])
+
+        start = time.perf_counter()
+        text, usage = live()
+        self._store(key, kind, model, messages, temperature, max_tokens, False,
+                    text, usage, (time.perf_counter() - start) * 1000)
+        return text, usage
+
+    def stream(self, kind, model, messages, temperature, max_tokens, live):
+        """Replays a stream chunk by chunk, or iterates live() and records it."""
+        key, entry = self._lookup(kind, model, messages, temperature, max_tokens, True)
+        if entry is not None:
+            return self._replay_stream(entry)
+        return self._record_stream(key, kind, model, messages, temperature, max_tokens, live)
+
+    def _replay_stream(self, entry):
+        text = entry["text"]
+        chunks = entry.get("chunks") or [[len(text), entry["latency_ms"]]]
+        start = time.perf_counter()
+        pos = 0
+        for length, at_ms in chunks:
+            if self.realtime:
+                delay = at_ms / 1000 - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            yield text[pos:pos + length]
+            pos += length
+
+    def _record_stream(self, key, kind, model, messages, temperature, max_tokens, live):
+        start = time.perf_counter()
+        parts, offsets = [], []
+        for chunk in live():
+            offsets.append([len(chunk), round((time.perf_counter() - start) * 1000, 2)])
+            parts.append(chunk)
+            yield chunk
+        text = "".join(parts)
+        # Streams carry no usage in llm_stream; estimate like the governor does.
+        usage = {"prompt_tokens": estimate_tokens(messages, 0), "completion_tokens": max(1, len(text) // 4)}
+        self._store(key, kind, model, messages, temperature, max_tokens, True,
+                    text, usage, (time.perf_counter() - start) * 1000, offsets)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {kind: dict(counters) for kind, counters in self.stats.items()}
+
+
+# ==========================================================
+# PROCESS-WIDE CASSETTE
+# ==========================================================
+
+ACTIVE = None
+
+
+def use_cassette(path: str | None, mode: str = "replay", fuzzy: bool = False, realtime: bool = False):
+    """Installs (or with path=None removes) the cassette used by utils.extension."""
+    global ACTIVE
+    if ACTIVE is not None:
+        ACTIVE.save()
+    ACTIVE = Cassette(path, mode, fuzzy, realtime) if path else None
+    return ACTIVE
+
+
+@atexit.register
+def _save_on_exit() -> None:
+    if ACTIVE is not None:
+        ACTIVE.save()
+
+
+if os.getenv("ASTRO_LLM_CASSETTE"):
+    use_cassette(
+        os.getenv("ASTRO_LLM_CASSETTE"),
+        mode=os.getenv("ASTRO_LLM_CASSETTE_MODE", "replay"),
+        fuzzy=os.getenv("ASTRO_LLM_CASSETTE_FUZZY", "0") == "1",
+        realtime=os.getenv("ASTRO_LLM_CASSETTE_REALTIME", "0") == "1",
+    )
@@ -0,0 +1,138 @@
+"""
+Persistent chat history, stored in SQLite (chat_messages table).
+
+Messages are only ever appended, one INSERT per message, so a long conversation
+never rewrites the whole list. The dashboard keeps just a window of the most
+recent messages in st.session_state and pages older ones in on demand. The sidebar
+preview is read from here, cached per user and invalidated on every write.
+
+Configuration (environment variables):
+    ASTRO_CHAT_WINDOW       messages loaded when a session starts      (default 50)
+    ASTRO_CHAT_PAGE         messages per "load older" click            (default 50)
+    ASTRO_CHAT_MEMORY_CAP   max messages a session keeps in memory     (default 200)
+"""
+
+import logging
+import os
+import time
+
+from utils import metrics
+from utils.cache import LRUCache, MISSING
+from utils.db import get_conn
+from utils.schema import ensure_schema
+
+
+log = logging.getLogger(__name__)
+
+WINDOW = int(os.getenv("ASTRO_CHAT_WINDOW", "50"))
+PAGE = int(os.getenv("ASTRO_CHAT_PAGE", "50"))
+MEMORY_CAP = int(os.getenv("ASTRO_CHAT_MEMORY_CAP", "200"))
+
+PREVIEW_MESSAGES = 10
+PREVIEW_CHARS = 40
+
+_COLUMNS = "id, role, content, ttft_ms, total_ms"
+
+# user_id -> [(role, first PREVIEW_CHARS characters), ...], oldest first
+PREVIEW_CACHE = LRUCache(maxsize=10000)
+metrics.register_cache("chat_preview", PREVIEW_CACHE)
+
+
+def _to_message(row) -> dict:
+    message = {"id": row[0], "role": row[1], "content": row[2]}
+    if row[3] is not None:
+        message["ttft_ms"] = row[3]
+    if row[4] is not None:
+        message["total_ms"] = row[4]
+    return message
+
+
+# ==========================================================
+# WRITES
+# ==========================================================
+
+def append(user_id: int, role: str, content: str, ttft_ms: float | None = None, total_ms: float | None = None) -> int | None:
+    """Stores one message and returns its id (None if it could not be saved)."""
+    ensure_schema()
+    try:
+        with get_conn() as conn:
+            cur = conn.execute(
+                """
+                INSERT INTO chat_messages (user_id, role, content, created_at, ttft_ms, total_ms)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, role, content, int(time.time()), ttft_ms, total_ms),
+            )
+            message_id = cur.lastrowid
+    except Exception as e:
+        # The chat keeps working from session state; only persistence is lost.
+        log.warning("chat history append failed: %s", e)
+        return None
+    PREVIEW_CACHE.invalidate(user_id)
+    return message_id
+
+
+def clear(user_id: int) -> None:
+    ensure_schema()
+    with get_conn() as conn:
+        conn.execute("DELETE FROM chat_messages WHERE user_id = ?", (user_id,))
+    PREVIEW_CACHE.invalidate(user_id)
+
+
+# ==========================================================
+# READS
+# ==========================================================
+
+def load_recent(user_id: int, limit: int = WINDOW) -> list[dict]:
+    """The newest `limit` messages, oldest first."""
+    ensure_schema()
+    with get_conn() as conn:
+        rows = conn.execute(
+            f"SELECT {_COLUMNS} FROM chat_messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, limit),
+        ).fetchall()
+    return [_to_message(row) for row in reversed(rows)]
+
+
+def load_before(user_id: int, before_id: int, limit: int = PAGE) -> list[dict]:
+    """Up to `limit` messages older than message `before_id`, oldest first."""
+    ensure_schema()
+    with get_conn() as conn:
+        rows = conn.execute(
+            f"SELECT {_COLUMNS} FROM chat_messages WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (user_id, before_id, limit),
+        ).fetchall()
+    return [_to_message(row) for row in reversed(rows)]
+
+
+def has_before(user_id: int, before_id: int | None) -> bool:
+    if before_id is None:
+        return False
+    ensure_schema()
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM chat_messages WHERE user_id = ? AND id < ? LIMIT 1",
+            (user_id, before_id),
+        ).fetchone()
+    return row is not None
+
+
+def preview(user_id: int) -> list[tuple[str, str]]:
+    """
+    (role, truncated content) of the latest PREVIEW_MESSAGES messages, oldest first.
+    Rows read while append() or clear() invalidated the user aren't cached,
+    as they may predate the write.
+    """
+    cached = PREVIEW_CACHE.get(user_id)
+    if cached is not MISSING:
+        return cached
+    ensure_schema()
+    generation = PREVIEW_CACHE.generation()
+    with get_conn() as conn:
+        rows = conn.execute(
+            "SELECT role, substr(content, 1, ?) FROM chat_messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (PREVIEW_CHARS, user_id, PREVIEW_MESSAGES),
+        ).fetchall()
+    items = [(role, text) for role, text in reversed(rows)]
+    PREVIEW_CACHE.set(user_id, items, generation)
+    return items
@@ -0,0 +1,241 @@
+"""
+Local, zero-network astrology question classifier.
+
+Replaces the Groq round trip in utils.extension.is_astrology_question for
+questions it is confident about. Two signals are combined in one logistic model:
+    - lexicon scores: counts of astrology terms, "predict my future" phrasing
+      and clearly off-topic terms (code, recipes, astronomy facts, ...).
+      Words with common non-astrology meanings ("cancer", "yoga", "stars")
+      only count next to an unambiguous astrology term or phrase.
+    - hashed n-grams: word unigrams/bigrams and character trigrams hashed into
+      a fixed-size vector, so unseen spellings ("kundli", "rashifal") still score
+
+Tokens are Unicode words, so questions in Hindi, Telugu, Tamil, Kannada (the
+profile form's languages) get features too. The training set is mostly English,
+though: for text that is mostly non-Latin, classify() never answers a confident
+False, and the LLM decides.
+
+The model is trained lazily on first use from utils/data/astro_classifier_train.jsonl
+(a couple of hundred rows, NumPy only, well under a second) and is deterministic.
+A single prediction costs tens of microseconds.
+
+    probability(question)  -> P(astrology)
+    classify(question)     -> True / False, or None when the model is not
+                              confident enough and the LLM should decide
+"""
+
+import json
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+
+HASH_DIM = 4096
+TRAIN_PATH = Path(__file__).parent / "data" / "astro_classifier_train.jsonl"
+
+# Confidence needed to skip the LLM: P >= threshold -> yes, P <= 1 - threshold -> no.
+THRESHOLD = float(os.getenv("ASTRO_CLASSIFIER_THRESHOLD", "0.8"))
+
+# Word characters plus combining marks: Indic vowel signs and viramas aren't
+# \w, and splitting on them would break "कुंडली" into pieces.
+_TOKEN_RE = re.compile(r"[\w'\u0300-\u036f\u0900-\u0dff]+")
+
+ASTRO_TERMS = {
+    "astrology", "astrologer", "astrological", "horoscope", "horoscopes", "kundali",
+    "kundli", "kundalis", "janam", "rashi", "rashifal", "zodiac", "nakshatra",
+    "nakshatras", "dosha", "dosh", "doshas", "manglik", "mangal", "shani", "rahu",
+    "ketu", "shukra", "chandra", "surya", "budh", "graha", "lagna",
+    "ascendant", "retrograde", "mahadasha", "antardasha", "dasha",
+    "sade", "sati", "muhurat", "muhurta", "panchang", "jyotish", "vedic",
+    "gemstone", "rudraksha", "tarot", "numerology",
+    "aries", "taurus", "leo", "virgo", "libra", "scorpio",
+    "sagittarius", "capricorn", "aquarius", "pisces", "vrishabh", "mithun",
+    "kark", "simha", "kanya", "tula", "vrishchik", "dhanu", "makar", "kumbh", "meen",
+    "auspicious", "kaal", "sarp", "pitra", "pada",
+    # Devanagari spellings
+    "ज्योतिष", "कुंडली", "कुण्डली", "राशि", "राशिफल", "नक्षत्र", "दोष",
+    "मांगलिक", "ग्रह", "शनि", "राहु", "केतु", "लग्न", "महादशा", "साढ़ेसाती", "मुहूर्त",
+}
+
+# Astrology terms that are just as common elsewhere ("symptoms of cancer",
+# "yoga poses", "stars in the milky way", "lucky number in lottery"); counted
+# only in a question that also has an ASTRO_TERMS word or a predictive phrase.
+AMBIGUOUS_TERMS = {
+    "cancer", "gemini", "yoga", "stars", "guru", "remedy", "remedies", "transit",
+    "lucky", "mesh", "milan",
+}
+
+PREDICTIVE_PHRASES = {
+    "will i", "when will", "my future", "my chart", "my stars", "my sign",
+    "my planets", "birth chart", "as per", "according to", "my kundli",
+    "my kundali", "my horoscope", "my rashi", "my lucky", "sun sign", "moon sign",
+    "rising sign", "7th house", "house in",
+}
+
+OFFTOPIC_TERMS = {
+    "python", "javascript", "sql", "html", "code", "debug", "git", "install",
+    "recipe", "cook", "bake", "weather", "rain", "telescope", "nasa", "distance",
+    "far", "galaxy", "light", "orbit", "moons", "rings", "formula", "translate",
+    "capital", "population", "president", "minister", "ceo", "price", "stock",
+    "legal", "law", "tax", "passport", "resume", "laptop", "phone", "movie",
+    "joke", "poem", "story", "haiku", "novel", "diet", "workout",
+}
+
+
+# ==========================================================
+# FEATURES
+# ==========================================================
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.casefold())
+
+
+def mostly_non_latin(text: str) -> bool:
+    """Whether most letters (and marks) in the text are outside ASCII."""
+    letters = [c for c in text if c.isalpha() or unicodedata.category(c).startswith("M")]
+    return sum(not c.isascii() for c in letters) * 2 > len(letters)
+
+
+def feature_bucket(feature: str, dim: int) -> int:
+    # crc32 is stable across processes, unlike hash().
+    return zlib.crc32(feature.encode("utf-8")) % dim
+
+
+def hashed_ngrams(text: str, dim: int = HASH_DIM) -> dict[int, float]:
+    """
+    Sparse hashed bag of word unigrams, word bigrams and character trigrams,
+    L2-normalized. Returned as {bucket: weight}.
+    """
+    tokens = tokenize(text)
+    counts = {}
+
+    def add(feature):
+        idx = feature_bucket(feature, dim)
+        counts[idx] = counts.get(idx, 0.0) + 1.0
+
+    for i, tok in enumerate(tokens):
+        add("w:" + tok)
+        if i:
+            add("b:" + tokens[i - 1] + " " + tok)
+        padded = f"#{tok}#"
+        for j in range(len(padded) - 2):
+            add("c:" + padded[j:j + 3])
+
+    norm = sum(v * v for v in counts.values()) ** 0.5
+    if norm:
+        for idx in counts:
+            counts[idx] /= norm
+    return counts
+
+
+def lexicon_scores(text: str) -> tuple[float, float, float]:
+    """(astrology terms, predictive phrases, off-topic terms) found in the text."""
+    tokens = tokenize(text)
+    bigrams = {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+    astro = sum(1 for t in tokens if t in ASTRO_TERMS)
+    predictive = sum(1 for p in PREDICTIVE_PHRASES if p in bigrams or p in tokens)
+    if astro or predictive:
+        astro += sum(1 for t in tokens if t in AMBIGUOUS_TERMS)
+    offtopic = sum(1 for t in tokens if t in OFFTOPIC_TERMS)
+    return float(astro), float(predictive), float(offtopic)
+
+
+def _dense(text: str) -> np.ndarray:
+    x = np.zeros(HASH_DIM + 3, dtype=np.float32)
+    for idx, value in hashed_ngrams(text).items():
+        x[idx] = value
+    x[HASH_DIM:] = lexicon_scores(text)
+    return x
+
+
+# ==========================================================
+# MODEL
+# ==========================================================
+
+class LinearModel:
+    """Logistic regression over hashed n-grams plus three lexicon features."""
+
+    def __init__(self, weights: np.ndarray, bias: float):
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def train(cls, texts, labels, epochs: int = 400, lr: float = 1.0, l2: float = 1e-3):
+        X = np.stack([_dense(t) for t in texts])
+        y = np.asarray(labels, dtype=np.float32)
+        w = np.zeros(X.shape[1], dtype=np.float32)
+        b = 0.0
+
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(X @ w + b)))
+            err = p - y
+            w -= lr * (X.T @ err / len(y) + l2 * w)
+            b -= lr * float(err.mean())
+
+        return cls(w, b)
+
+    def probability(self, text: str) -> float:
+        z = self.bias
+        w = self.weights
+        for idx, value in hashed_ngrams(text).items():
+            z += w[idx] * value
+        astro, predictive, offtopic = lexicon_scores(text)
+        z += w[HASH_DIM] * astro + w[HASH_DIM + 1] * predictive + w[HASH_DIM + 2] * offtopic
+        return float(1.0 / (1.0 + np.exp(-z)))
+
+
+def load_examples(path: Path) -> tuple[list[str], list[int]]:
+    texts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                texts.append(row["text"])
+                labels.append(int(row["label"]))
+    return texts, labels
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model() -> LinearModel:
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = LinearModel.train(*load_examples(TRAIN_PATH))
+    return _model
+
+
+# ==========================================================
+# PUBLIC API
+# ==========================================================
+
+def probability(question: str) -> float:
+    if not question or not question.strip():
+        return 0.0
+    return get_model().probability(question)
+
+
+def classify(question: str, threshold: float | None = None) -> bool | None:
+    """
+    Returns True/False when the local model is confident,
+    None when the question is ambiguous and should go to the LLM classifier.
+    Questions without a single word token, or mostly non-Latin ones, are never
+    refused here: the model has seen too few of them.
+    """
+    if not tokenize(question):
+        return None
+    threshold = THRESHOLD if threshold is None else threshold
+    p = probability(question)
+    if p >= threshold:
+        return True
+    if p <= 1.0 - threshold and not mostly_non_latin(question):
+        return False
+    return None
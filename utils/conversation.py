@@ -0,0 +1,234 @@
+"""
+Conversation context for follow-up questions.
+
+A question is sent to the expert together with the chat before it, so "and what
+about next year?" is answered in context. Only the most recent turns are sent
+verbatim, within ASTRO_CONTEXT_TOKENS. Older turns are replaced by a running
+summary of the conversation, sent ahead of the recent turns, so the prompt stays
+below budget + ASTRO_CONTEXT_SUMMARY_TOKENS + the question however long the
+chat grows.
+
+The summary only changes when the window slides. Once the recent turns outgrow
+the budget, the window drops its oldest turns until it is down to half the
+budget, and one summarizer call folds the dropped turns into the summary. So a
+summarizer call comes every few questions, not every question. The call always
+runs in the background: the dashboard slides the window right after an answer,
+so it is usually finished before the next question is asked. A session restored
+with a long history slides when its first question is asked; that question goes
+out with the recent turns only, without waiting for the summary.
+
+Only follow-ups get the context: short questions ("and next year?") and ones
+that refer back ("is there a remedy for it?"), see is_follow_up(). Standalone
+questions are sent, and cached, as if the chat were empty; the dashboard's
+suggestion buttons always are.
+
+Token counts are estimates (about 4 characters per token, as in the governor).
+Every expert call records its prompt size in PROMPT_STATS.
+
+Configuration (environment variables):
+    ASTRO_CONTEXT                 0 to send every question standalone (default 1)
+    ASTRO_CONTEXT_TOKENS          token budget for the recent turns   (default 800)
+    ASTRO_CONTEXT_SUMMARY_TOKENS  max length of the summary           (default 200)
+    ASTRO_CONTEXT_WORKERS         threads for background summaries    (default 4)
+"""
+
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import tracing
+from utils.classifier import tokenize
+from utils.governor import estimate_tokens
+
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("ASTRO_CONTEXT", "1") != "0"
+BUDGET = int(os.getenv("ASTRO_CONTEXT_TOKENS", "800"))
+SUMMARY_TOKENS = int(os.getenv("ASTRO_CONTEXT_SUMMARY_TOKENS", "200"))
+
+SLIDE_TO = 0.5          # fraction of BUDGET the recent turns are cut down to
+TURN_TOKENS = int(BUDGET * SLIDE_TO)  # longer messages are truncated
+FOLD_LIMIT = 2 * BUDGET  # max tokens of old turns summarized in one call
+
+# Most recent expert calls, newest last: {"prompt_tokens", "estimated",
+# "context_tokens", "summary_tokens", "turns"}.
+PROMPT_STATS = deque(maxlen=500)
+
+# Questions this short, or with one of these words, are taken as follow-ups.
+FOLLOW_UP_TOKENS = 3
+FOLLOW_UP_WORDS = {
+    "it", "its", "that", "those", "these", "they", "them", "their", "he", "him",
+    "his", "she", "her", "same", "else", "again", "also", "too",
+}
+FOLLOW_UP_STARTS = {"and", "but", "so", "then", "what about", "how about", "what if"}
+
+_summary_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASTRO_CONTEXT_WORKERS", "4")),
+    thread_name_prefix="astro-summarize",
+)
+
+
+def count_tokens(messages) -> int:
+    return estimate_tokens(messages, 0)
+
+
+def _truncate(content: str) -> str:
+    return content[:TURN_TOKENS * 4]
+
+
+def is_follow_up(question: str) -> bool:
+    """Whether the question needs the chat before it to be understood."""
+    tokens = tokenize(question)
+    if not tokens:
+        return False
+    if len(tokens) <= FOLLOW_UP_TOKENS:
+        return True
+    if tokens[0] in FOLLOW_UP_STARTS or " ".join(tokens[:2]) in FOLLOW_UP_STARTS:
+        return True
+    return any(t in FOLLOW_UP_WORDS for t in tokens)
+
+
+def record(messages: list[dict], context: "Context | None", usage: dict | None = None) -> None:
+    """Records the prompt size of one expert call (the API's count when known)."""
+    prompt_tokens = (usage or {}).get("prompt_tokens") or 0
+    PROMPT_STATS.append({
+        "prompt_tokens": prompt_tokens or count_tokens(messages),
+        "estimated": not prompt_tokens,
+        "context_tokens": context.tokens if context else 0,
+        "summary_tokens": context.summary_tokens if context else 0,
+        "turns": len(context.turns) if context else 0,
+    })
+
+
+class Context:
+    """What the expert sees of the conversation before the current question."""
+
+    def __init__(self, summary: str, turns: list[dict]):
+        self.summary = summary
+        self.turns = turns  # [{"role", "content"}, ...], oldest first
+        self.summary_tokens = count_tokens([{"content": summary}])
+        self.tokens = self.summary_tokens + count_tokens(turns)
+
+    def __bool__(self):
+        return bool(self.summary or self.turns)
+
+    def recent_questions(self, limit: int = 3) -> list[str]:
+        """The last `limit` questions in the window, oldest first."""
+        questions = [m["content"] for m in self.turns if m["role"] == "user"]
+        return questions[-limit:]
+
+    def messages(self) -> list[dict]:
+        """Chat messages to put between the system prompt and the question."""
+        summary = []
+        if self.summary:
+            summary = [{"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"}]
+        return summary + self.turns
+
+
+class Conversation:
+    """
+    Rolling context of one chat session; keep one per session (st.session_state).
+    `summarize(summary, turns)` returns the summary updated with `turns`.
+    Assistant replies in `skip` (refusals) are left out, with their question.
+
+    The window is tracked by the last chat message folded into the summary, so
+    messages paged in or trimmed at the front of the history don't move it. If
+    that message is gone (chat cleared, another user's history), the
+    conversation starts over.
+    """
+
+    def __init__(self, summarize, skip=()):
+        self._summarize = summarize
+        self._skip = set(skip)
+        self.summary = ""
+        self.folds = 0
+        self._after = None    # last chat message folded into the summary
+        self._pending = None  # background summary in progress
+
+    def context(self, history: list[dict]) -> Context | None:
+        """
+        Context for a question asked after `history` (the session's chat
+        messages, oldest first). Slides the window first if needed; the summary
+        of turns that left it just now is only used from the next question on.
+        """
+        if not ENABLED:
+            return None
+        self.slide(history, background=True)
+        return Context(self.summary, self._turns(history[self._start(history):]))
+
+    def slide(self, history: list[dict], background: bool = False) -> None:
+        """Slides the window if the recent turns are over budget."""
+        if not ENABLED:
+            return
+        self._wait()
+        start = self._start(history)
+        recent = history[start:]
+        if count_tokens(self._turns(recent)) <= BUDGET:
+            return
+
+        keep = _keep_from(recent, TURN_TOKENS)
+        if keep == 0:
+            return
+        dropped = self._turns(recent[:keep])
+        self._after = recent[keep - 1]
+        if not dropped:
+            return
+        if background:
+            self._pending = _summary_pool.submit(tracing.bind(self._fold), dropped)
+        else:
+            self._fold(dropped)
+
+    def _fold(self, turns: list[dict]) -> None:
+        turns = turns[_keep_from(turns, FOLD_LIMIT):]
+        try:
+            self.summary = self._summarize(self.summary, turns).strip()
+            self.folds += 1
+        except Exception as e:
+            # The dropped turns are lost from the context, the chat goes on.
+            log.warning("conversation summary failed: %s", e)
+
+    def _wait(self) -> None:
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def _start(self, history: list[dict]) -> int:
+        if self._after is None:
+            return 0
+        for i in range(len(history) - 1, -1, -1):
+            if history[i] is self._after:
+                return i + 1
+        self.summary = ""
+        self._after = None
+        return 0
+
+    def _turns(self, messages: list[dict]) -> list[dict]:
+        turns = []
+        for message in messages:
+            if message["role"] == "assistant" and message["content"] in self._skip:
+                if turns and turns[-1]["role"] == "user":
+                    turns.pop()
+                continue
+            turns.append({"role": message["role"], "content": _truncate(message["content"])})
+        return turns
+
+
+def _keep_from(messages: list[dict], tokens: int) -> int:
+    """
+    Index of the first message of the longest tail of `messages` within
+    `tokens`, moved forward to a user message so the window starts with a
+    question. Always keeps at least the last message.
+    """
+    total = 0
+    keep = len(messages)
+    while keep > 0:
+        total += count_tokens([{"content": _truncate(messages[keep - 1]["content"])}])
+        if total > tokens:
+            break
+        keep -= 1
+    keep = min(keep, len(messages) - 1)
+    while keep < len(messages) - 1 and messages[keep]["role"] != "user":
+        keep += 1
+    return max(keep, 0)
@@ -0,0 +1,420 @@
+"""
+Pooled SQLite connection layer used by utils.auth.
+
+Every call to get_conn() used to open a fresh sqlite3 connection in rollback-journal
+mode. Under many concurrent Streamlit sessions that meant connection churn and
+"database is locked" stalls. This module keeps a bounded pool of long-lived
+connections configured for concurrent readers (WAL) and hands them out per `with` block.
+
+Configuration (environment variables, read once at first use):
+    ASTRO_DB_PATH              database file or "file:..." URI   (default users.db)
+    ASTRO_DB_POOL_SIZE         max open connections             (default 8)
+    ASTRO_DB_BUSY_TIMEOUT_MS   how long a writer waits for a lock (default 5000)
+    ASTRO_DB_SYNCHRONOUS       PRAGMA synchronous value          (default NORMAL)
+    ASTRO_DB_CACHE_KB          page cache size in KiB            (default 16384)
+    ASTRO_DB_MMAP_MB           memory-mapped I/O size in MiB     (default 128)
+    ASTRO_DB_STMT_CACHE        prepared statements kept per conn (default 256)
+
+Usage is unchanged for callers:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+
+Every statement run on a pooled connection, and every commit, is timed into
+the astro_db_query_seconds histogram (utils.metrics), labelled by its first
+keyword (select, insert, ...). Inside a traced run (utils.tracing) each one is
+also a "sqlite.<op>" span carrying the statement, and in a profiled run
+(utils.profiler) it counts towards the "db" phase. With ASTRO_DB_PROFILE=1 the
+connections are ProfiledConnection, which records per-statement stats and slow
+queries in utils.query_profile.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from utils import metrics, profiler, query_profile, tracing
+
+
+DB_PATH = os.getenv("ASTRO_DB_PATH", "users.db")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# ==========================================================
+# STATEMENT METRICS
+# ==========================================================
+
+QUERY_SECONDS = metrics.histogram(
+    "astro_db_query_seconds", "SQLite statement execution time, fetching rows excluded", ["op"]
+)
+QUERY_ERRORS = metrics.counter("astro_db_query_errors_total", "SQLite statements that raised", ["op"])
+
+_OPS = {"select", "insert", "update", "delete", "replace", "with", "create", "drop", "alter", "pragma", "begin", "commit"}
+_op_of = {}  # SQL text -> op; the app's statements are a small fixed set
+
+
+def _op(sql: str) -> str:
+    op = _op_of.get(sql)
+    if op is None:
+        words = sql.split(None, 1)
+        op = words[0].lower() if words else "other"
+        op = op if op in _OPS else "other"
+        if len(_op_of) < 1024:
+            _op_of[sql] = op
+    return op
+
+
+def _timed(op: str, run, *args, sql: str = ""):
+    span = None
+    if tracing.current() is not None:
+        span = tracing.start_span(f"sqlite.{op}", **({"statement": " ".join(sql.split())} if sql else {}))
+    profile = profiler.active()
+    outer = profile.enter("db") if profile is not None else None
+    start = time.perf_counter()
+    error = None
+    try:
+        return run(*args)
+    except Exception as e:
+        error = e
+        QUERY_ERRORS.labels(op).inc()
+        raise
+    finally:
+        QUERY_SECONDS.labels(op).observe(time.perf_counter() - start)
+        if profile is not None:
+            profile.exit(outer)
+        if span is not None:
+            span.end(error)
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _timed(_op(sql), super().execute, sql, parameters, sql=sql)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _timed(_op(sql), super().executemany, sql, seq_of_parameters, sql=sql)
+
+    def executescript(self, script):
+        return _timed("script", super().executescript, script, sql=script)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3.Connection whose statements are recorded in QUERY_SECONDS."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute* don't go through cursor(), so route them here.
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        return _timed("commit", super().commit)
+
+
+_WRITE_OPS = {"insert", "update", "delete", "replace"}
+
+
+class ProfiledCursor(TimedCursor):
+    _entry = None  # query_profile entry of the last statement, for rows fetched later
+
+    def execute(self, sql, parameters=()):
+        return self._profiled(sql, parameters, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._profiled(sql, seq_of_parameters, super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self._profiled(script, None, super().executescript, script)
+
+    def _profiled(self, sql, parameters, run, *args):
+        conn = self.connection
+        lock_wait = 0.0
+        if _op(sql) in _WRITE_OPS and not conn.in_transaction and conn.isolation_level is not None:
+            # sqlite3 would open a deferred transaction and take the write lock
+            # inside the statement; taking it first times the wait on its own.
+            start = time.perf_counter()
+            sqlite3.Cursor.execute(self, "BEGIN IMMEDIATE")
+            lock_wait = time.perf_counter() - start
+        steps = conn.steps
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = run(*args)
+            failed = False
+            return result
+        finally:
+            self._entry = query_profile.record(
+                conn, sql, parameters, time.perf_counter() - start, lock_wait, conn.steps - steps,
+                rows=-1 if failed else self.rowcount, failed=failed,
+            )
+
+    def _fetch(self, fetch, *args):
+        if self._entry is None:
+            return fetch(*args)
+        conn = self.connection
+        steps = conn.steps
+        start = time.perf_counter()
+        rows = fetch(*args)
+        count = (rows is not None) if not isinstance(rows, list) else len(rows)
+        query_profile.fetched(self._entry, count, time.perf_counter() - start, conn.steps - steps)
+        return rows
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class ProfiledConnection(TimedConnection):
+    """TimedConnection that also feeds utils.query_profile (ASTRO_DB_PROFILE=1)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.steps = 0  # progress handler calls, every PROGRESS_OPS VM instructions
+        self.set_progress_handler(self._progress, query_profile.PROGRESS_OPS)
+
+    def _progress(self):
+        self.steps += 1
+        return 0  # nonzero would abort the statement
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        start = time.perf_counter()
+        failed = True
+        try:
+            super().commit()
+            failed = False
+        finally:
+            query_profile.record(self, "COMMIT", None, time.perf_counter() - start, 0.0, 0, 0, failed=failed)
+
+
+# ==========================================================
+# CONNECTION POOL
+# ==========================================================
+
+class ConnectionPool:
+    """
+    Bounded pool of sqlite3 connections.
+    Connections are created lazily up to `size`; after that callers wait
+    for a connection to be returned.
+    """
+
+    def __init__(
+        self,
+        path: str = DB_PATH,
+        size: int = 8,
+        busy_timeout_ms: int = 5000,
+        synchronous: str = "NORMAL",
+        cache_kb: int = 16384,
+        mmap_mb: int = 128,
+        statement_cache: int = 256,
+    ):
+        self.path = path
+        self.size = max(1, size)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.cache_kb = cache_kb
+        self.mmap_mb = mmap_mb
+        self.statement_cache = statement_cache
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+        self.stats = {"opened": 0, "checkouts": 0, "waits": 0, "wait_seconds": 0.0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+            uri=self.path.startswith("file:"),
+            factory=ProfiledConnection if query_profile.ENABLED else TimedConnection,
+        )
+        if query_profile.ENABLED:
+            query_profile.start_writer()
+        cur = conn.cursor()
+        # WAL lets readers proceed while one writer commits.
+        # In-memory databases silently stay in "memory" journal mode.
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        cur.execute(f"PRAGMA synchronous={self.synchronous}")
+        cur.execute(f"PRAGMA cache_size=-{int(self.cache_kb)}")
+        cur.execute(f"PRAGMA mmap_size={int(self.mmap_mb) * 1024 * 1024}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+
+        self.stats["checkouts"] += 1
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                self.stats["opened"] += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        # Pool exhausted: wait for another thread to give a connection back.
+        start = time.perf_counter()
+        conn = self._idle.get()
+        self.stats["waits"] += 1
+        self.stats["wait_seconds"] += time.perf_counter() - start
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def discard(self, conn: sqlite3.Connection) -> None:
+        """Drops a broken connection instead of returning it to the pool."""
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._opened -= 1
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class PooledConnection:
+    """
+    Checked-out connection. Behaves like sqlite3.Connection inside a `with` block:
+    commits on success, rolls back on error, then returns itself to the pool.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+        self._conn = None
+
+    def __enter__(self):
+        self._conn = self._pool.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        conn, self._conn = self._conn, None
+        try:
+            if exc_type is None:
+                conn.commit()
+            else:
+                conn.rollback()
+        except sqlite3.Error:
+            self._pool.discard(conn)
+            raise
+        self._pool.release(conn)
+        return False
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise RuntimeError("get_conn() must be used as a context manager")
+        return getattr(self._conn, name)
+
+
+# ==========================================================
+# PROCESS-WIDE POOL
+# ==========================================================
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    path=DB_PATH,
+                    size=_env_int("ASTRO_DB_POOL_SIZE", 8),
+                    busy_timeout_ms=_env_int("ASTRO_DB_BUSY_TIMEOUT_MS", 5000),
+                    synchronous=os.getenv("ASTRO_DB_SYNCHRONOUS", "NORMAL"),
+                    cache_kb=_env_int("ASTRO_DB_CACHE_KB", 16384),
+                    mmap_mb=_env_int("ASTRO_DB_MMAP_MB", 128),
+                    statement_cache=_env_int("ASTRO_DB_STMT_CACHE", 256),
+                )
+    return _pool
+
+
+def configure_pool(path: str | None = None, **options) -> ConnectionPool:
+    """
+    Replaces the process-wide pool (e.g. to point benchmarks at another database).
+    Existing idle connections are closed.
+    """
+    global _pool, DB_PATH
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        if path is not None:
+            DB_PATH = path
+        _pool = ConnectionPool(path=DB_PATH, **options)
+    return _pool
+
+
+def get_conn() -> PooledConnection:
+    return PooledConnection(get_pool())
+
+
+def _collect_pool():
+    if _pool is None:
+        return
+    stats = _pool.stats
+    yield "astro_db_pool_connections", "gauge", "Open pooled SQLite connections", [({}, _pool._opened)]
+    yield "astro_db_pool_checkouts_total", "counter", "Connections handed out by get_conn()", [({}, stats["checkouts"])]
+    yield "astro_db_pool_waits_total", "counter", "Checkouts that waited for a free connection", [({}, stats["waits"])]
+    yield "astro_db_pool_wait_seconds_total", "counter", "Time spent waiting for a free connection", [({}, stats["wait_seconds"])]
+
+
+metrics.register_collector(_collect_pool)
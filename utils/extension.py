@@ -1,163 +1,1118 @@
-import os
-from dotenv import load_dotenv
-from groq import Groq
-from utils.auth import get_user_profile_smart
-
-load_dotenv()
-
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-
-# ==========================================================
-# SYSTEM PROMPTS
-# ==========================================================
-
-ASTRO_EXPERT_PROMPT = """
-You are an expert Indian astrologer.
-You answer ONLY astrology-related questions such as:
-- Horoscope
-- Kundali
-- Zodiac / Rashi
-- Marriage compatibility
-- Career astrology
-- Planetary doshas
-- Nakshatra analysis
-
-If the question is astrology-related, give a helpful response.
-"""
-
-ASTRO_CLASSIFIER_PROMPT = """
-You are a strict classifier.
-
-Task:
-Decide whether the user's question is related to astrology.
-
-Astrology includes:
-- Horoscope
-- Kundali
-- Zodiac / Rashi
-- Birth charts
-- Planets, doshas, nakshatras
-- Marriage, career, health via astrology
-
-Respond ONLY in JSON format like this:
-{
-  "is_astrology": true | false
-}
-
-Do NOT explain anything.
-"""
-
-# 🔴 Corrected: Output ONLY improved prompt text
-PROMPT_IMPROVER_PROMPT = """
-Rewrite the user input into a clearer, more specific,
-well-structured astrology-related prompt.
-
-STRICT RULES:
-- Output ONLY the rewritten prompt
-- Do NOT add introductions, explanations, labels, or formatting
-- Do NOT ask questions
-- Keep it concise and focused
-"""
-
-# ==========================================================
-# LLM HELPER
-# ==========================================================
-
-def llm_chat(messages, temperature=0.5, max_tokens=200):
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens,
-    )
-    return response.choices[0].message.content.strip()
-
-# ==========================================================
-# ASTROLOGY CLASSIFIER
-# ==========================================================
-def build_astro_prompt(user_question: str, profile: dict | None) -> str:
-    """
-    Attaches user profile context to the prompt ONLY if available.
-    Keeps prompt clean and professional.
-    """
-    if not profile:
-        return user_question
-
-    context_lines = []
-
-    if profile.get("dob"):
-        context_lines.append(f"Date of Birth: {profile['dob']}")
-    if profile.get("tob"):
-        context_lines.append(f"Time of Birth: {profile['tob']}")
-    if profile.get("place"):
-        context_lines.append(f"Place of Birth: {profile['place']}")
-    if profile.get("rashi"):
-        context_lines.append(f"Rashi: {profile['rashi']}")
-    if profile.get("gender"):
-        context_lines.append(f"Gender: {profile['gender']}")
-
-    context_block = "\n".join(context_lines)
-
-    return f"""
-User Question:
-{user_question}
-
-User Birth Details:
-{context_block}
-""".strip()
-
-
-def is_astrology_question(user_question: str) -> bool:
-    try:
-        result = llm_chat(
-            messages=[
-                {"role": "system", "content": ASTRO_CLASSIFIER_PROMPT},
-                {"role": "user", "content": user_question},
-            ],
-            temperature=0,
-            max_tokens=50,
-        )
-
-        result = result.lower()
-        return '"is_astrology": true' in result
-
-    except Exception:
-        return False
-
-# ==========================================================
-# MAIN ASTRO RESPONSE
-# ==========================================================
-
-def get_astro_response(user_question: str, user_id: int) -> str:
-    if not is_astrology_question(user_question):
-        return "🙏 I can answer only astrology-related questions."
-
-    profile = get_user_profile_smart(user_id)
-    final_prompt = build_astro_prompt(user_question, profile)
-
-    return llm_chat(
-        messages=[
-            {"role": "system", "content": ASTRO_EXPERT_PROMPT},
-            {"role": "user", "content": final_prompt},
-        ],
-        temperature=0.7,
-        max_tokens=500,
-    )
-# ==========================================================
-# PROMPT IMPROVER (NO ASTRO CHECK)
-# ==========================================================
-
-def improve_prompt(user_prompt: str) -> str:
-    """
-    Improves the prompt ONLY.
-    No astrology validation.
-    No extra text.
-    """
-    return llm_chat(
-        messages=[
-            {"role": "system", "content": PROMPT_IMPROVER_PROMPT},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=0.4,  # lower temp = less fluff
-        max_tokens=120,
-    )
+import os
+import hashlib
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from utils.auth import get_user_profile, get_user_profile_smart
+from utils import answer_cache, cassette, classifier, conversation, metrics, profiler, semantic_cache, tracing
+from utils.governor import GOVERNOR, PRIORITIES, PRIORITY_ANSWER, estimate_tokens, is_retryable
+from utils.batcher import MicroBatcher
+from utils.llm_async import AsyncLLM
+from utils.llm_client import get_client, make_async_client
+
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+MODEL = "llama-3.1-8b-instant"
+
+# The Groq clients are built on first use (utils.llm_client), not at import.
+
+# "async": completions go through one shared asyncio loop, and identical
+#          in-flight requests are coalesced into one upstream call (default)
+# "sync":  every call blocks on the synchronous client (previous behaviour)
+LLM_BACKEND = os.getenv("ASTRO_LLM_BACKEND", "async").lower()
+
+async_llm = AsyncLLM(make_async_client, governor=GOVERNOR)
+
+# "hybrid": local classifier, LLM only for ambiguous questions (default)
+# "local":  local classifier only, never calls the LLM
+# "llm":    always ask the LLM classifier (previous behaviour)
+CLASSIFIER_MODE = os.getenv("ASTRO_CLASSIFIER", "hybrid").lower()
+
+# "two_pass":    classifier call, then expert call (default)
+# "single_pass": one LLM call returns {"is_astrology", "answer"} together
+# "speculative": classifier and expert calls run concurrently, expert discarded on "no"
+RESPONSE_MODE = os.getenv("ASTRO_RESPONSE_MODE", "two_pass").lower()
+
+REFUSAL_MESSAGE = "🙏 I can answer only astrology-related questions."
+
+# Stream expert answers into the dashboard token by token (set to 0 to disable).
+# Every RESPONSE_MODE streams its final pass.
+STREAM_RESPONSES = os.getenv("ASTRO_STREAM_RESPONSES", "1") != "0"
+
+# ==========================================================
+# SYSTEM PROMPTS
+# ==========================================================
+
+ASTRO_EXPERT_PROMPT = """
+You are an expert Indian astrologer.
+You answer ONLY astrology-related questions such as:
+- Horoscope
+- Kundali
+- Zodiac / Rashi
+- Marriage compatibility
+- Career astrology
+- Planetary doshas
+- Nakshatra analysis
+
+If the question is astrology-related, give a helpful response.
+"""
+
+ASTRO_CLASSIFIER_PROMPT = """
+You are a strict classifier.
+
+Task:
+Decide whether the user's question is related to astrology.
+
+Astrology includes:
+- Horoscope
+- Kundali
+- Zodiac / Rashi
+- Birth charts
+- Planets, doshas, nakshatras
+- Marriage, career, health via astrology
+
+Respond ONLY in JSON format like this:
+{
+  "is_astrology": true | false
+}
+
+Do NOT explain anything.
+"""
+
+ASTRO_SINGLE_PASS_PROMPT = ASTRO_EXPERT_PROMPT + """
+Before answering, decide whether the question is astrology-related
+(horoscope, kundali, zodiac / rashi, birth charts, planets, doshas,
+nakshatras, or marriage / career / health via astrology).
+
+Respond ONLY with a single JSON object, no code fences:
+{
+  "is_astrology": true | false,
+  "answer": "<your full answer, or an empty string if not astrology>"
+}
+"""
+
+ASTRO_BATCH_CLASSIFIER_PROMPT = """
+You are a strict classifier.
+
+Task:
+You receive a numbered list of user questions. For each one, decide whether
+it is related to astrology.
+
+Astrology includes:
+- Horoscope
+- Kundali
+- Zodiac / Rashi
+- Birth charts
+- Planets, doshas, nakshatras
+- Marriage, career, health via astrology
+
+Respond ONLY with a JSON array of booleans, one per question, in the same order.
+Example for three questions: [true, false, true]
+
+Do NOT explain anything.
+"""
+
+# 🔴 Corrected: Output ONLY improved prompt text
+PROMPT_IMPROVER_PROMPT = """
+Rewrite the user input into a clearer, more specific,
+well-structured astrology-related prompt.
+
+STRICT RULES:
+- Output ONLY the rewritten prompt
+- Do NOT add introductions, explanations, labels, or formatting
+- Do NOT ask questions
+- Keep it concise and focused
+"""
+
+CONVERSATION_SUMMARY_PROMPT = """
+You keep a running summary of a chat between a user and an astrologer.
+Update the summary with the new turns.
+
+STRICT RULES:
+- Keep what the user asked, the details they shared and the key points of the answers
+- Drop greetings and repetition
+- Output ONLY the updated summary, in a few sentences
+"""
+
+# ==========================================================
+# LLM HELPER
+# ==========================================================
+
+LLM_SECONDS = metrics.histogram(
+    "astro_llm_request_seconds", "LLM call time per prompt kind (streams: until the last chunk)", ["kind"]
+)
+LLM_FIRST_CHUNK_SECONDS = metrics.histogram(
+    "astro_llm_first_chunk_seconds", "Time to the first streamed chunk per prompt kind", ["kind"]
+)
+LLM_CALLS = metrics.counter(
+    "astro_llm_calls_total", "LLM calls per prompt kind and outcome (ok, error, cancelled)", ["kind", "outcome"]
+)
+LLM_TOKENS = metrics.counter(
+    "astro_llm_tokens_total", "Tokens the API reported per prompt kind (prompt, completion)", ["kind", "type"]
+)
+
+
+def _record_call(kind, start, outcome, usage=None) -> None:
+    LLM_SECONDS.labels(kind).observe(time.perf_counter() - start)
+    LLM_CALLS.labels(kind, outcome).inc()
+    if usage:
+        _record_tokens(kind, usage)
+
+
+def _record_tokens(kind, usage: dict) -> None:
+    LLM_TOKENS.labels(kind, "prompt").inc(usage.get("prompt_tokens") or 0)
+    LLM_TOKENS.labels(kind, "completion").inc(usage.get("completion_tokens") or 0)
+
+
+def llm_complete(messages, temperature=0.5, max_tokens=200, kind="expert") -> tuple[str, dict]:
+    """
+    Like llm_chat, but also returns the token usage reported by the API.
+    `kind` ("classifier", "expert", "improver", "summarizer") picks the governor's priority lane.
+    With a cassette installed (utils.cassette), calls are recorded or replayed.
+    """
+    start = time.perf_counter()
+    with tracing.span(f"llm.{kind}", model=MODEL, max_tokens=max_tokens) as span, profiler.phase("llm"):
+        try:
+            if cassette.ACTIVE is not None:
+                text, usage = cassette.ACTIVE.complete(
+                    kind, MODEL, messages, temperature, max_tokens,
+                    lambda: _llm_complete_upstream(messages, temperature, max_tokens, kind),
+                )
+            else:
+                text, usage = _llm_complete_upstream(messages, temperature, max_tokens, kind)
+        except Exception:
+            _record_call(kind, start, "error")
+            raise
+        span.set(prompt_tokens=usage.get("prompt_tokens") or 0, completion_tokens=usage.get("completion_tokens") or 0)
+    _record_call(kind, start, "ok", usage)
+    return text, usage
+
+
+def _llm_complete_upstream(messages, temperature, max_tokens, kind) -> tuple[str, dict]:
+    priority = PRIORITIES.get(kind, PRIORITY_ANSWER)
+    tokens = estimate_tokens(messages, max_tokens)
+
+    if LLM_BACKEND == "async":
+        return async_llm.complete(
+            messages,
+            model=MODEL,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            priority=priority,
+            tokens=tokens,
+        )
+
+    def call():
+        response = get_client().chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        usage = getattr(response, "usage", None)
+        return response.choices[0].message.content.strip(), {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        }
+
+    return GOVERNOR.call(call, priority=priority, tokens=tokens)
+
+
+def llm_chat(messages, temperature=0.5, max_tokens=200, kind="expert"):
+    text, _ = llm_complete(messages, temperature=temperature, max_tokens=max_tokens, kind=kind)
+    return text
+
+
+def llm_stream(messages, temperature=0.5, max_tokens=200, kind="expert"):
+    """
+    Yields content deltas as Groq streams them. Opening the stream is
+    governed and retried; a stream that fails midway is not restarted.
+    """
+    if cassette.ACTIVE is not None:
+        chunks = cassette.ACTIVE.stream(
+            kind, MODEL, messages, temperature, max_tokens,
+            lambda: _llm_stream_upstream(messages, temperature, max_tokens, kind),
+        )
+    else:
+        chunks = _llm_stream_upstream(messages, temperature, max_tokens, kind)
+    # The span starts on the first read, under the span current now; it is only
+    # current while a chunk is produced, as the generator is read from the caller's frames.
+    # A stream closed before it was read leaves no span or call behind.
+    start_span = tracing.bind(tracing.start_span)
+    return _metered_stream(
+        kind, chunks, lambda: start_span(f"llm.{kind}", model=MODEL, max_tokens=max_tokens, stream=True)
+    )
+
+
+def _metered_stream(kind, chunks, start_span):
+    span = start_span()
+    start = time.perf_counter()
+    outcome = "error"
+    error = None
+    first = True
+    try:
+        for chunk in profiler.iterate_in_phase("llm", tracing.iterate_in(span, chunks)):
+            if first:
+                LLM_FIRST_CHUNK_SECONDS.labels(kind).observe(time.perf_counter() - start)
+                span.set(first_chunk_ms=round((time.perf_counter() - start) * 1000, 1))
+                first = False
+            yield chunk
+        outcome = "ok"
+    except GeneratorExit:
+        outcome = "cancelled"  # the reader stopped early
+        raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _record_call(kind, start, outcome)
+        span.set(outcome=outcome)
+        span.end(error)
+
+
+def _llm_stream_upstream(messages, temperature, max_tokens, kind):
+    tokens = estimate_tokens(messages, max_tokens)
+    attempt = 0
+    while True:
+        GOVERNOR.acquire(PRIORITIES.get(kind, PRIORITY_ANSWER), tokens)
+        try:
+            stream = get_client().chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            break
+        except Exception as exc:
+            GOVERNOR.release(tokens)
+            if attempt >= GOVERNOR.max_retries or not is_retryable(exc):
+                raise
+            time.sleep(GOVERNOR.backoff_delay(attempt, exc))
+            attempt += 1
+
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            # Groq reports the stream's usage in the last chunk.
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+            if usage is not None:
+                _record_tokens(kind, {
+                    "prompt_tokens": usage.prompt_tokens,
+                    "completion_tokens": usage.completion_tokens,
+                })
+    finally:
+        GOVERNOR.release(tokens)
+
+
+# Most recent streamed responses, newest last: {"ttft_ms", "total_ms", "chars"}.
+STREAM_TIMINGS = deque(maxlen=500)
+
+
+class TimedStream:
+    """
+    Iterates over text chunks while timing them.
+    After iteration: .text is the full reply, .ttft_ms the time to first
+    chunk and .total_ms the total time, both measured from `start`
+    (a time.perf_counter() value, default: construction time).
+    """
+
+    def __init__(self, chunks, start: float | None = None, on_complete=None):
+        self._chunks = chunks
+        self._start = time.perf_counter() if start is None else start
+        self._on_complete = on_complete
+        self.text = ""
+        self.ttft_ms = None
+        self.total_ms = None
+
+    def __iter__(self):
+        parts = []
+        for chunk in self._chunks:
+            if self.ttft_ms is None:
+                self.ttft_ms = (time.perf_counter() - self._start) * 1000
+            parts.append(chunk)
+            yield chunk
+        self.text = "".join(parts).strip()
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+        if self.ttft_ms is None:
+            self.ttft_ms = self.total_ms
+        STREAM_TIMINGS.append(
+            {"ttft_ms": self.ttft_ms, "total_ms": self.total_ms, "chars": len(self.text)}
+        )
+        if self._on_complete is not None:
+            self._on_complete(self.text)
+
+# ==========================================================
+# ASTROLOGY CLASSIFIER
+# ==========================================================
+# Profile fields build_astro_prompt puts into the prompt; the answer cache keys on these.
+PROMPT_PROFILE_FIELDS = ("dob", "tob", "place", "rashi", "gender")
+
+
+def build_astro_prompt(user_question: str, profile: dict | None) -> str:
+    """
+    Attaches user profile context to the prompt ONLY if available.
+    Keeps prompt clean and professional.
+    """
+    if not profile:
+        return user_question
+
+    context_lines = []
+
+    if profile.get("dob"):
+        context_lines.append(f"Date of Birth: {profile['dob']}")
+    if profile.get("tob"):
+        context_lines.append(f"Time of Birth: {profile['tob']}")
+    if profile.get("place"):
+        context_lines.append(f"Place of Birth: {profile['place']}")
+    if profile.get("rashi"):
+        context_lines.append(f"Rashi: {profile['rashi']}")
+    if profile.get("gender"):
+        context_lines.append(f"Gender: {profile['gender']}")
+
+    context_block = "\n".join(context_lines)
+
+    return f"""
+User Question:
+{user_question}
+
+User Birth Details:
+{context_block}
+""".strip()
+
+
+def _expert_messages(system_prompt: str, final_prompt: str, context=None) -> list[dict]:
+    """System prompt, then the conversation so far (utils.conversation), then the question."""
+    messages = [{"role": "system", "content": system_prompt}]
+    if context:
+        messages += context.messages()
+    messages.append({"role": "user", "content": final_prompt})
+    return messages
+
+
+def _follow_up_context(user_question: str, context=None):
+    """`context` if the question is a follow-up; standalone questions go without it."""
+    if context and conversation.is_follow_up(user_question):
+        return context
+    return None
+
+
+def _classifier_text(user_question: str, context=None) -> str:
+    """
+    The text the classifier judges. A follow-up ("is there a remedy for it?")
+    that doesn't pass on its own, and has no off-topic words, is judged
+    together with the questions it follows. Standalone questions (context is
+    None, see _follow_up_context) are judged alone, so an off-topic question
+    after astrology ones still gets refused.
+    """
+    if not context:
+        return user_question
+    if CLASSIFIER_MODE != "llm" and classifier.classify(user_question) is True:
+        return user_question
+    if classifier.lexicon_scores(user_question)[2]:
+        return user_question
+    return " ".join(context.recent_questions() + [user_question])
+
+
+@tracing.traced("classify")
+def is_astrology_question(user_question: str) -> bool:
+    """
+    Decides locally when the classifier is confident; only ambiguous
+    questions pay for an LLM round trip (see CLASSIFIER_MODE).
+    """
+    if CLASSIFIER_MODE != "llm":
+        decision = classifier.classify(user_question)
+        if decision is not None:
+            return decision
+        if CLASSIFIER_MODE == "local":
+            return classifier.probability(user_question) >= 0.5
+
+    return llm_is_astrology_question(user_question)
+
+
+def llm_is_astrology_question(user_question: str) -> bool:
+    """LLM classifier; goes through the cross-session micro-batcher when enabled."""
+    if classifier_batcher is not None:
+        with profiler.phase("llm"):
+            return classifier_batcher.submit(user_question)
+    return _llm_classify_one(user_question)
+
+
+def _llm_classify_one(user_question: str) -> bool:
+    try:
+        result = llm_chat(
+            messages=[
+                {"role": "system", "content": ASTRO_CLASSIFIER_PROMPT},
+                {"role": "user", "content": user_question},
+            ],
+            temperature=0,
+            max_tokens=50,
+            kind="classifier",
+        )
+
+        result = result.lower()
+        return '"is_astrology": true' in result
+
+    except Exception as e:
+        # Rate limits were already retried by the governor. Rather than refusing
+        # a possibly valid question, let the local model decide.
+        log.warning("LLM classifier failed, using local classifier: %s", e)
+        return classifier.probability(user_question) >= 0.5
+
+
+# ==========================================================
+# CLASSIFIER MICRO-BATCHING
+# ==========================================================
+
+_ARRAY_RE = re.compile(r"\[[^\[\]]*\]")
+
+
+def _llm_classify_batch(questions: list[str]) -> list[bool]:
+    """
+    Classifies several questions in one LLM call. If the reply is not a JSON
+    array of the right length, each question is classified on its own instead.
+    """
+    if len(questions) == 1:
+        return [_llm_classify_one(questions[0])]
+
+    numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(questions, 1))
+    try:
+        result = llm_chat(
+            messages=[
+                {"role": "system", "content": ASTRO_BATCH_CLASSIFIER_PROMPT},
+                {"role": "user", "content": numbered},
+            ],
+            temperature=0,
+            max_tokens=10 + 7 * len(questions),
+            kind="classifier",
+        )
+    except Exception as e:
+        log.warning("batched LLM classifier failed, using local classifier: %s", e)
+        return [classifier.probability(q) >= 0.5 for q in questions]
+
+    match = _ARRAY_RE.search(result.lower())
+    try:
+        verdicts = json.loads(match.group(0)) if match else None
+    except ValueError:
+        verdicts = None
+    if isinstance(verdicts, list) and len(verdicts) == len(questions):
+        return [v is True or str(v).strip().lower() == "true" for v in verdicts]
+
+    log.warning("batched LLM classifier returned %r, classifying one by one", result[:200])
+    return [_llm_classify_one(q) for q in questions]
+
+
+# Optional: ASTRO_CLASSIFIER_BATCH=1 groups LLM classifier calls from concurrent
+# sessions arriving within ASTRO_CLASSIFIER_BATCH_WINDOW_MS (or up to
+# ASTRO_CLASSIFIER_BATCH_MAX questions) into one request.
+classifier_batcher = None
+if os.getenv("ASTRO_CLASSIFIER_BATCH", "0") == "1":
+    classifier_batcher = MicroBatcher(
+        handler=_llm_classify_batch,
+        window=float(os.getenv("ASTRO_CLASSIFIER_BATCH_WINDOW_MS", "30")) / 1000,
+        max_batch=int(os.getenv("ASTRO_CLASSIFIER_BATCH_MAX", "16")),
+        name="classifier-batch",
+    )
+
+# ==========================================================
+# MAIN ASTRO RESPONSE
+# ==========================================================
+
+# Changing the expert prompt or model invalidates previously cached answers.
+_ANSWER_CACHE_NAMESPACE = hashlib.sha1(
+    (MODEL + ASTRO_EXPERT_PROMPT).encode("utf-8")
+).hexdigest()[:16]
+
+
+ANSWER_CACHE_LOOKUPS = metrics.counter(
+    "astro_answer_cache_lookups_total", "Answer cache lookups by result (exact, semantic, miss)", ["result"]
+)
+
+
+class _CacheContext:
+    """Everything the exact and semantic answer caches key on for one question."""
+
+    def __init__(self, user_question: str, user_id: int):
+        profile = get_user_profile_smart(user_id)
+        self.question = user_question
+        self.rashi = (profile or {}).get("rashi")
+        self.fingerprint = answer_cache.profile_fingerprint(profile, PROMPT_PROFILE_FIELDS)
+        self.key = answer_cache.make_key(
+            user_question, self.fingerprint, _ANSWER_CACHE_NAMESPACE
+        )
+
+    def lookup(self) -> str | None:
+        cached = answer_cache.get(self.key)
+        result = "exact"
+        if cached is None and semantic_cache.ENABLED:
+            hit = semantic_cache.SEMANTIC_CACHE.lookup(
+                self.question, self.rashi, self.fingerprint, _ANSWER_CACHE_NAMESPACE
+            )
+            cached = hit[0] if hit else None
+            result = "semantic"
+        ANSWER_CACHE_LOOKUPS.labels(result if cached is not None else "miss").inc()
+        tracing.set_attributes(cache=result if cached is not None else "miss")
+        return cached
+
+    def store(self, answer: str) -> None:
+        if not answer or answer == REFUSAL_MESSAGE:
+            return
+        answer_cache.put(self.key, self.question, answer)
+        if semantic_cache.ENABLED:
+            semantic_cache.SEMANTIC_CACHE.insert(
+                self.question, self.rashi, answer, self.fingerprint, _ANSWER_CACHE_NAMESPACE
+            )
+
+
+@tracing.traced("answer")
+def get_astro_response(
+    user_question: str, user_id: int, use_cache: bool = True, context=None
+) -> str:
+    """
+    Answers from the exact or semantic answer cache when possible, otherwise
+    via the configured RESPONSE_MODE. Refusals are not cached.
+    A conversation `context` (utils.conversation.Context) is only used for
+    follow-up questions, whose answer depends on the chat so far, so they
+    bypass the caches, as do questions without a single word (all emoji).
+    """
+    context = _follow_up_context(user_question, context)
+    if not (use_cache and answer_cache.ENABLED and answer_cache.cacheable(user_question)) or context:
+        return _get_astro_response_uncached(user_question, user_id, context)
+
+    cache = _CacheContext(user_question, user_id)
+    cached = cache.lookup()
+    if cached is not None:
+        return cached
+
+    answer = _get_astro_response_uncached(user_question, user_id)
+    cache.store(answer)
+    return answer
+
+
+def _get_astro_response_uncached(user_question: str, user_id: int, context=None) -> str:
+    if RESPONSE_MODE == "single_pass":
+        return get_astro_response_single_pass(user_question, user_id, context)
+    if RESPONSE_MODE == "speculative":
+        return get_astro_response_speculative(user_question, user_id, context)
+
+    if not is_astrology_question(_classifier_text(user_question, context)):
+        return REFUSAL_MESSAGE
+
+    profile = get_user_profile_smart(user_id)
+    final_prompt = build_astro_prompt(user_question, profile)
+    messages = _expert_messages(ASTRO_EXPERT_PROMPT, final_prompt, context)
+
+    answer, usage = llm_complete(messages=messages, temperature=0.7, max_tokens=500)
+    conversation.record(messages, context, usage)
+    return answer
+
+@tracing.traced("answer")
+def get_astro_response_stream(
+    user_question: str, user_id: int, use_cache: bool = True, context=None
+) -> TimedStream:
+    """
+    Streaming counterpart of get_astro_response, for every RESPONSE_MODE:
+        two_pass     the classifier decides up front, then the expert answer streams
+        single_pass  the answer is streamed out of the structured reply as it arrives
+        speculative  the expert stream is opened while the LLM classifier decides
+    Cache hits and refusals arrive as one chunk.
+    """
+    # Time to first token includes the cache lookup and classifier decision.
+    start = time.perf_counter()
+    context = _follow_up_context(user_question, context)
+
+    on_complete = None
+    if use_cache and answer_cache.ENABLED and answer_cache.cacheable(user_question) and not context:
+        cache = _CacheContext(user_question, user_id)
+        cached = cache.lookup()
+        if cached is not None:
+            return TimedStream(iter([cached]), start=start)
+        on_complete = cache.store
+
+    if RESPONSE_MODE == "single_pass":
+        chunks = _stream_single_pass(user_question, user_id, context)
+    elif RESPONSE_MODE == "speculative":
+        chunks = _stream_speculative(user_question, user_id, context)
+    else:
+        chunks = _stream_two_pass(user_question, user_id, context)
+    return TimedStream(chunks, start=start, on_complete=on_complete)
+
+
+def _stream_expert_messages(user_question: str, user_id: int, context=None) -> list[dict]:
+    profile = get_user_profile_smart(user_id)
+    final_prompt = build_astro_prompt(user_question, profile)
+    messages = _expert_messages(ASTRO_EXPERT_PROMPT, final_prompt, context)
+    conversation.record(messages, context)
+    return messages
+
+
+def _stream_expert(user_question: str, user_id: int, context=None):
+    messages = _stream_expert_messages(user_question, user_id, context)
+    return llm_stream(messages=messages, temperature=0.7, max_tokens=500)
+
+
+def _stream_two_pass(user_question: str, user_id: int, context=None):
+    if not is_astrology_question(_classifier_text(user_question, context)):
+        return iter([REFUSAL_MESSAGE])
+    return _stream_expert(user_question, user_id, context)
+
+# ==========================================================
+# SINGLE-PASS CLASSIFY + ANSWER
+# ==========================================================
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_FLAG_RE = re.compile(r'"?is_astrology"?\s*:\s*"?(true|false)"?', re.IGNORECASE)
+_ANSWER_RE = re.compile(r'"answer"\s*:\s*"(.*?)(?:"\s*}?\s*)?$', re.DOTALL)
+
+
+def parse_single_pass(text: str) -> tuple[bool | None, str]:
+    """
+    Parses the single-pass reply into (is_astrology, answer).
+    Tolerates code fences, surrounding chatter, raw newlines inside the answer
+    string and truncated JSON. is_astrology is None when the model ignored the
+    format entirely; answer is then the raw text.
+    """
+    cleaned = _FENCE_RE.sub("", text.strip())
+
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start != -1 and end > start:
+        try:
+            data = json.loads(cleaned[start:end + 1], strict=False)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and "is_astrology" in data:
+            flag = data["is_astrology"]
+            if isinstance(flag, str):
+                flag = flag.strip().lower() == "true"
+            return bool(flag), str(data.get("answer") or "").strip()
+
+    flag_match = _FLAG_RE.search(cleaned)
+    if flag_match:
+        answer_match = _ANSWER_RE.search(cleaned)
+        answer = ""
+        if answer_match:
+            try:
+                answer = json.loads(f'"{answer_match.group(1)}"', strict=False)
+            except ValueError:
+                answer = answer_match.group(1)
+        return flag_match.group(1).lower() == "true", answer.strip()
+
+    return None, text.strip()
+
+
+def get_astro_response_single_pass(user_question: str, user_id: int, context=None) -> str:
+    """
+    One LLM round trip for in-scope questions instead of two.
+    Questions the local classifier confidently rejects never reach the LLM.
+    """
+    classifier_text = _classifier_text(user_question, context)
+    if CLASSIFIER_MODE != "llm" and classifier.classify(classifier_text) is False:
+        return REFUSAL_MESSAGE
+
+    profile = get_user_profile_smart(user_id)
+    final_prompt = build_astro_prompt(user_question, profile)
+    messages = _expert_messages(ASTRO_SINGLE_PASS_PROMPT, final_prompt, context)
+
+    reply, usage = llm_complete(messages=messages, temperature=0.7, max_tokens=600)
+    conversation.record(messages, context, usage)
+    is_astro, answer = parse_single_pass(reply)
+
+    if is_astro is None:
+        # Model answered in free text; trust it only if the question looks in scope.
+        is_astro = classifier.probability(classifier_text) >= 0.5
+    if not is_astro:
+        return REFUSAL_MESSAGE
+    if answer:
+        return answer
+
+    # Flagged in scope but the answer came back empty: ask the expert directly.
+    return llm_chat(
+        messages=_expert_messages(ASTRO_EXPERT_PROMPT, final_prompt, context),
+        temperature=0.7,
+        max_tokens=500,
+    )
+
+
+_ANSWER_START_RE = re.compile(r'"answer"\s*:\s*"')
+_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def _decode_partial(buffer: str, pos: int) -> tuple[str, int, bool]:
+    """
+    Decodes the JSON string body starting at buffer[pos] as far as it has
+    arrived: (text, next pos, whether the closing quote was reached). An escape
+    cut off by the end of the buffer is left for the next call.
+    """
+    out = []
+    i = pos
+    while i < len(buffer):
+        c = buffer[i]
+        if c == '"':
+            return "".join(out), i + 1, True
+        if c != "\\":
+            out.append(c)
+            i += 1
+            continue
+        if i + 1 >= len(buffer):
+            break
+        escape = buffer[i + 1]
+        if escape != "u":
+            out.append(_ESCAPES.get(escape, escape))
+            i += 2
+            continue
+        if i + 6 > len(buffer):
+            break
+        try:
+            code = int(buffer[i + 2:i + 6], 16)
+        except ValueError:
+            out.append(buffer[i:i + 6])
+            i += 6
+            continue
+        if 0xD800 <= code < 0xDC00:
+            # High surrogate: wait for the low half and combine them.
+            if i + 12 > len(buffer):
+                break
+            try:
+                low = int(buffer[i + 8:i + 12], 16) if buffer[i + 6:i + 8] == "\\u" else 0
+            except ValueError:
+                low = 0
+            if 0xDC00 <= low < 0xE000:
+                out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+                continue
+        out.append(chr(code))
+        i += 6
+    return "".join(out), i, False
+
+
+def stream_single_pass(chunks, classifier_text: str, fallback):
+    """
+    Yields the answer of a streamed single-pass reply as it arrives, once the
+    reply has said is_astrology true, or the refusal as soon as it says false.
+    Replies that ignore the format are judged whole, as in parse_single_pass;
+    an empty in-scope answer streams `fallback()` instead.
+    """
+    buffer = ""
+    pos = None  # start of the not yet decoded rest of the answer string
+    closed = False
+    answered = False
+    try:
+        for chunk in chunks:
+            buffer += chunk
+            if pos is None:
+                flag = _FLAG_RE.search(buffer)
+                if flag and flag.group(1).lower() == "false":
+                    yield REFUSAL_MESSAGE
+                    return
+                answer = _ANSWER_START_RE.search(buffer)
+                if not (flag and answer):
+                    continue
+                pos = answer.end()
+            if not closed:
+                text, pos, closed = _decode_partial(buffer, pos)
+                if text:
+                    answered = True
+                    yield text
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+    if pos is None:
+        is_astro, answer = parse_single_pass(buffer)
+        if is_astro is None:
+            is_astro = classifier.probability(classifier_text) >= 0.5
+        if not is_astro:
+            yield REFUSAL_MESSAGE
+            return
+        if answer:
+            yield answer
+            return
+    elif answered:
+        return
+    yield from fallback()
+
+
+def _stream_single_pass(user_question: str, user_id: int, context=None):
+    classifier_text = _classifier_text(user_question, context)
+    if CLASSIFIER_MODE != "llm" and classifier.classify(classifier_text) is False:
+        return iter([REFUSAL_MESSAGE])
+
+    profile = get_user_profile_smart(user_id)
+    final_prompt = build_astro_prompt(user_question, profile)
+    messages = _expert_messages(ASTRO_SINGLE_PASS_PROMPT, final_prompt, context)
+    conversation.record(messages, context)
+    return stream_single_pass(
+        llm_stream(messages=messages, temperature=0.7, max_tokens=600),
+        classifier_text,
+        lambda: llm_stream(
+            messages=_expert_messages(ASTRO_EXPERT_PROMPT, final_prompt, context),
+            temperature=0.7,
+            max_tokens=500,
+        ),
+    )
+
+# ==========================================================
+# SPECULATIVE CLASSIFY || ANSWER
+# ==========================================================
+
+_speculation_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASTRO_SPECULATION_WORKERS", "16")),
+    thread_name_prefix="astro-speculate",
+)
+_speculation_lock = threading.Lock()
+
+SPECULATION_STATS = {
+    "launched": 0,              # expert calls started before the verdict
+    "used": 0,                  # ... whose answer was returned
+    "discarded": 0,             # ... thrown away because the verdict was "no"
+    "cancelled": 0,             # ... cancelled before they reached the API
+    "wasted_prompt_tokens": 0,
+    "wasted_completion_tokens": 0,
+    "saved_seconds": 0.0,       # classifier latency hidden behind the expert call
+}
+
+
+def _bump(**deltas) -> None:
+    with _speculation_lock:
+        for key, value in deltas.items():
+            SPECULATION_STATS[key] += value
+
+
+def _speculative_expert(user_question: str, user_id: int, context=None) -> tuple[str, dict]:
+    # Runs off the script thread, so use the shared profile cache rather than
+    # st.session_state (get_user_profile_smart), which needs a script context.
+    profile = get_user_profile(user_id)
+    messages = _expert_messages(ASTRO_EXPERT_PROMPT, build_astro_prompt(user_question, profile), context)
+    answer, usage = llm_complete(messages=messages, temperature=0.7, max_tokens=500)
+    conversation.record(messages, context, usage)
+    return answer, usage
+
+
+def _count_wasted(future) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    _, usage = future.result()
+    _bump(
+        wasted_prompt_tokens=usage["prompt_tokens"],
+        wasted_completion_tokens=usage["completion_tokens"],
+    )
+
+
+def get_astro_response_speculative(user_question: str, user_id: int, context=None) -> str:
+    """
+    Starts the LLM classifier and the profile lookup + expert answer together,
+    returns the answer as soon as the classifier says yes and discards it on no.
+    Questions the local classifier is sure about skip speculation entirely.
+    """
+    classifier_text = _classifier_text(user_question, context)
+    decision = None if CLASSIFIER_MODE == "llm" else classifier.classify(classifier_text)
+    if decision is False:
+        return REFUSAL_MESSAGE
+    if decision is True:
+        return _speculative_expert(user_question, user_id, context)[0]
+
+    expert = _speculation_pool.submit(tracing.bind(_speculative_expert), user_question, user_id, context)
+    _bump(launched=1)
+
+    start = time.perf_counter()
+    is_astro = llm_is_astrology_question(classifier_text)
+    classifier_seconds = time.perf_counter() - start
+
+    if not is_astro:
+        if expert.cancel():
+            _bump(cancelled=1)
+        else:
+            # The HTTP request can't be aborted; let it finish in the background
+            # and account for the tokens it burned.
+            _bump(discarded=1)
+            expert.add_done_callback(_count_wasted)
+        return REFUSAL_MESSAGE
+
+    with profiler.phase("llm"):
+        answer, _ = expert.result()
+    _bump(used=1, saved_seconds=classifier_seconds)
+    return answer
+
+
+_STREAM_END = object()
+
+
+class _Prefetch:
+    """
+    Reads a chunk stream on the speculation pool into a queue, so the expert
+    stream is opened and filling while the script thread waits for the
+    classifier. Iterating yields the chunks read so far, then the rest as they come.
+    `prompt_tokens` is the estimate discard() counts as wasted, with the
+    completion estimated from the text read, as utils.cassette records streams.
+    """
+
+    def __init__(self, chunks, prompt_tokens: int = 0):
+        self._chunks = chunks
+        self._prompt_tokens = prompt_tokens
+        self._chars = 0
+        self._failed = False
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self.future = _speculation_pool.submit(tracing.bind(self._read))
+
+    def _read(self) -> None:
+        try:
+            for chunk in self._chunks:
+                self._chars += len(chunk)
+                if self._stop.is_set():
+                    break
+                self._queue.put(chunk)
+        except Exception as e:
+            self._failed = True
+            self._queue.put(e)
+        finally:
+            self._chunks.close()
+            self._queue.put(_STREAM_END)
+
+    def cancel(self) -> bool:
+        """Stops reading; True if the stream was never opened, which is then closed unread."""
+        self._stop.set()
+        if not self.future.cancel():
+            return False
+        self._chunks.close()
+        return True
+
+    def discard(self) -> None:
+        """Stops reading an opened stream and counts its tokens as wasted once the reader ends."""
+        self._stop.set()
+        self.future.add_done_callback(lambda _: self._count_wasted())
+
+    def _count_wasted(self) -> None:
+        if self._failed:
+            return
+        _bump(
+            wasted_prompt_tokens=self._prompt_tokens,
+            wasted_completion_tokens=self._chars // 4,
+        )
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self._stop.set()
+
+
+def _stream_speculative(user_question: str, user_id: int, context=None):
+    """
+    Streaming counterpart of get_astro_response_speculative: the expert stream
+    is opened alongside the LLM classifier and shown once it says yes.
+    """
+    classifier_text = _classifier_text(user_question, context)
+    decision = None if CLASSIFIER_MODE == "llm" else classifier.classify(classifier_text)
+    if decision is False:
+        return iter([REFUSAL_MESSAGE])
+    if decision is True:
+        return _stream_expert(user_question, user_id, context)
+
+    messages = _stream_expert_messages(user_question, user_id, context)
+    expert = _Prefetch(
+        llm_stream(messages=messages, temperature=0.7, max_tokens=500),
+        prompt_tokens=estimate_tokens(messages, 0),
+    )
+    _bump(launched=1)
+
+    start = time.perf_counter()
+    is_astro = llm_is_astrology_question(classifier_text)
+    classifier_seconds = time.perf_counter() - start
+
+    if not is_astro:
+        if expert.cancel():
+            _bump(cancelled=1)
+        else:
+            # The request can't be aborted once sent; reading stops at the next
+            # chunk, and the tokens spent so far are counted.
+            _bump(discarded=1)
+            expert.discard()
+        return iter([REFUSAL_MESSAGE])
+
+    _bump(used=1, saved_seconds=classifier_seconds)
+    return profiler.iterate_in_phase("llm", expert)
+
+# ==========================================================
+# PROMPT IMPROVER (NO ASTRO CHECK)
+# ==========================================================
+
+def improve_prompt(user_prompt: str) -> str:
+    """
+    Improves the prompt ONLY.
+    No astrology validation.
+    No extra text.
+    """
+    return llm_chat(
+        messages=[
+            {"role": "system", "content": PROMPT_IMPROVER_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ],
+        temperature=0.4,  # lower temp = less fluff
+        max_tokens=120,
+        kind="improver",
+    )
+
+# ==========================================================
+# CONVERSATION SUMMARY
+# ==========================================================
+
+def summarize_conversation(summary: str, turns: list[dict]) -> str:
+    """Folds chat turns that left the context window into the running summary."""
+    lines = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in turns)
+    current = f"Current summary:\n{summary}\n\n" if summary else ""
+    return llm_chat(
+        messages=[
+            {"role": "system", "content": CONVERSATION_SUMMARY_PROMPT},
+            {"role": "user", "content": f"{current}New turns:\n{lines}"},
+        ],
+        temperature=0.2,
+        max_tokens=conversation.SUMMARY_TOKENS,
+        kind="summarizer",
+    )
+
+
+def new_conversation() -> conversation.Conversation:
+    """Rolling context for one chat session (see utils.conversation)."""
+    return conversation.Conversation(summarize_conversation, skip=(REFUSAL_MESSAGE,))
+
+# ==========================================================
+# METRICS
+# ==========================================================
+
+def _collect_metrics():
+    """Governor, coalescing, speculation and batching stats, read at export time."""
+    governor = GOVERNOR.snapshot()
+    yield "astro_llm_queue_depth", "gauge", "LLM calls waiting for the governor", [({}, governor["queue_depth"])]
+    yield "astro_llm_in_flight", "gauge", "LLM requests in flight", [({}, governor["in_flight"])]
+    yield "astro_llm_governor_wait_seconds_total", "counter", "Time LLM calls waited for the governor", [({}, governor["wait_seconds_total"])]
+    yield "astro_llm_governor_events_total", "counter", "Governor retries, throttles, timeouts and failures", [
+        ({"event": event}, governor[event]) for event in ("retries", "throttled", "timeouts", "failures")
+    ]
+    yield "astro_llm_coalesced_total", "counter", "Calls served by an identical in-flight request", [({}, async_llm.stats["coalesced"])]
+    yield "astro_speculation_total", "counter", "Speculative expert calls by result", [
+        ({"result": result}, SPECULATION_STATS[result]) for result in ("launched", "used", "discarded", "cancelled")
+    ]
+    if classifier_batcher is not None:
+        stats = classifier_batcher.stats
+        yield "astro_classifier_batches_total", "counter", "Batched LLM classifier requests", [({}, stats["batches"])]
+        yield "astro_classifier_batched_items_total", "counter", "Questions classified in batches", [({}, stats["items"])]
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,251 @@
+"""
+Process-wide governor for Groq calls: rate limits, concurrency and retries.
+
+Every completion passes through one Governor, which enforces:
+    - a requests-per-minute and a tokens-per-minute token bucket
+      (tokens are estimated up front and corrected with the real usage afterwards)
+    - a bounded number of requests in flight
+    - priority lanes: lower number goes first (answers before prompt improvements)
+    - jittered exponential backoff on 429 / 5xx / connection errors, honouring
+      Retry-After; a 429 also pauses every lane until the provider is ready again
+
+snapshot() reports queue depth, in-flight count and wait times for quota sizing.
+
+Configuration (environment variables):
+    ASTRO_LLM_RPM             requests per minute              (default 30)
+    ASTRO_LLM_TPM             tokens per minute                (default 6000)
+    ASTRO_LLM_CONCURRENCY     max requests in flight           (default 8)
+    ASTRO_LLM_MAX_RETRIES     retries after the first attempt  (default 4)
+    ASTRO_LLM_MAX_WAIT_S      max time queued before giving up (default 30)
+
+The defaults match Groq's free tier for llama-3.1-8b-instant.
+"""
+
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from utils import tracing
+
+
+PRIORITY_ANSWER = 0
+PRIORITY_BACKGROUND = 1
+
+# Completion kinds used by utils.extension and their lanes.
+PRIORITIES = {
+    "classifier": PRIORITY_ANSWER,
+    "expert": PRIORITY_ANSWER,
+    "improver": PRIORITY_BACKGROUND,
+    "summarizer": PRIORITY_BACKGROUND,
+}
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError"}
+
+
+class TokenBucket:
+    """Continuous-refill bucket; `per_minute` units refill evenly over a minute."""
+
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (requests larger than the bucket wait for a full one)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        """Returns over-reserved tokens (a negative amount charges extra)."""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def estimate_tokens(messages, max_tokens: int) -> int:
+    # ~4 characters per token for English prompts, plus the completion budget.
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // 4 + max_tokens
+
+
+def status_code(exc: Exception) -> int | None:
+    return getattr(exc, "status_code", None)
+
+
+def is_retryable(exc: Exception) -> bool:
+    return status_code(exc) in RETRYABLE_STATUS or type(exc).__name__ in RETRYABLE_ERRORS
+
+
+def retry_after(exc: Exception) -> float | None:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class Governor:
+    def __init__(
+        self,
+        rpm: float = 30,
+        tpm: float = 6000,
+        max_concurrency: int = 8,
+        max_retries: int = 4,
+        max_wait: float = 30.0,
+        base_backoff: float = 0.5,
+        max_backoff: float = 20.0,
+    ):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+
+        self.stats = {
+            "acquired": 0,
+            "timeouts": 0,
+            "retries": 0,
+            "throttled": 0,
+            "failures": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    # ---------- ADMISSION ----------
+
+    @tracing.traced("llm.admission")
+    def acquire(self, priority: int, tokens: int) -> float:
+        """
+        Blocks until this request may start; returns the time spent waiting.
+        Raises TimeoutError after max_wait seconds in the queue.
+        """
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        entry = (priority, next(self._seq))
+
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    timeout = deadline - now
+                    if self._waiting[0] == entry and self._active < self.max_concurrency:
+                        delay = max(
+                            self._paused_until - now,
+                            self.requests.delay(1, now),
+                            self.tokens.delay(tokens, now),
+                        )
+                        if delay <= 0:
+                            break
+                        timeout = min(timeout, delay)
+                    if now >= deadline:
+                        self.stats["timeouts"] += 1
+                        raise TimeoutError("LLM request waited too long for rate-limit capacity")
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._waiting)
+            self.requests.take(1, now)
+            self.tokens.take(tokens, now)
+            self._active += 1
+            waited = now - start
+            self.stats["acquired"] += 1
+            self.stats["wait_seconds_total"] += waited
+            self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], waited)
+            # The next request in line may now be at the head of the queue.
+            self._cond.notify_all()
+        return waited
+
+    def release(self, reserved_tokens: int, used_tokens: int | None = None) -> None:
+        with self._cond:
+            self._active -= 1
+            if used_tokens is not None:
+                self.tokens.give_back(reserved_tokens - used_tokens)
+            self._cond.notify_all()
+
+    # ---------- RETRIES ----------
+
+    def backoff_delay(self, attempt: int, exc: Exception) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        hinted = retry_after(exc)
+        if hinted is not None:
+            delay = max(delay, hinted)
+        if status_code(exc) == 429:
+            # The whole quota is exhausted: hold every lane, not just this caller.
+            with self._cond:
+                self.stats["throttled"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, fn, priority: int = PRIORITY_ANSWER, tokens: int = 0):
+        """
+        Runs fn() under the governor with retries. fn must return (text, usage)
+        like utils.extension.llm_complete so the token bucket can be corrected.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority, tokens)
+            try:
+                text, usage = fn()
+            except Exception as exc:
+                self.release(tokens)
+                if attempt == self.max_retries or not is_retryable(exc):
+                    self.stats["failures"] += 1
+                    raise
+                self.stats["retries"] += 1
+                time.sleep(self.backoff_delay(attempt, exc))
+                continue
+            self.release(tokens, usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+            return text, usage
+
+    # ---------- OBSERVABILITY ----------
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            acquired = self.stats["acquired"]
+            return {
+                **self.stats,
+                "queue_depth": len(self._waiting),
+                "in_flight": self._active,
+                "wait_seconds_avg": self.stats["wait_seconds_total"] / acquired if acquired else 0.0,
+                "paused_for": max(0.0, self._paused_until - time.monotonic()),
+                "rpm_available": self.requests.tokens,
+                "tpm_available": self.tokens.tokens,
+            }
+
+
+GOVERNOR = Governor(
+    rpm=float(os.getenv("ASTRO_LLM_RPM", "30")),
+    tpm=float(os.getenv("ASTRO_LLM_TPM", "6000")),
+    max_concurrency=int(os.getenv("ASTRO_LLM_CONCURRENCY", "8")),
+    max_retries=int(os.getenv("ASTRO_LLM_MAX_RETRIES", "4")),
+    max_wait=float(os.getenv("ASTRO_LLM_MAX_WAIT_S", "30")),
+)
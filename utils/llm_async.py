@@ -0,0 +1,154 @@
+"""
+asyncio-based Groq layer with single-flight request coalescing.
+
+One event loop runs in a daemon thread for the whole process; Streamlit session
+threads submit work to it and block only on their own result. Concurrent calls
+with an identical (model, messages, temperature, max_tokens) share one upstream
+request: the first caller starts it, later callers await the same task. This
+is what happens when many users click the same suggestion button at once.
+
+    llm = AsyncLLM(lambda: AsyncGroq(api_key=...), governor=GOVERNOR)
+    text, usage = llm.complete(messages, model=..., temperature=0.7, max_tokens=500)
+
+With a governor (utils.governor), only the upstream request of a coalesced
+group is admitted and charged against the rate limits, and retries happen
+inside it, so every waiting caller benefits from them.
+
+Coroutines run under the caller's tracing span (utils.tracing), so the upstream
+request and its admission wait show up in the trace of the run that started it.
+"""
+
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import tracing
+from utils.governor import PRIORITY_ANSWER, is_retryable
+
+
+class AsyncLLM:
+    def __init__(self, client_factory, governor=None):
+        """
+        client_factory builds the async client. It is called on the loop thread,
+        so the client's HTTP connection pool is bound to that loop.
+        """
+        self._client_factory = client_factory
+        self._governor = governor
+        # Governor admission blocks, so it waits on these threads, not the loop.
+        self._admission = ThreadPoolExecutor(max_workers=64, thread_name_prefix="astro-llm-admit")
+        self._client = None
+        self._loop = None
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> asyncio.Task, only touched on the loop thread
+        self.stats = {"requests": 0, "upstream": 0, "coalesced": 0, "errors": 0}
+
+    # ---------- EVENT LOOP ----------
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(
+                        target=loop.run_forever, name="astro-llm-loop", daemon=True
+                    ).start()
+                    self._loop = loop
+        return self._loop
+
+    def run(self, coro):
+        """Runs a coroutine on the shared loop and blocks the calling thread for its result."""
+        return asyncio.run_coroutine_threadsafe(tracing.bind_coroutine(coro), self.loop).result()
+
+    def warm_up(self) -> None:
+        """Builds the client now and opens a pooled connection with a cheap request."""
+        self.run(self._warm_up())
+
+    async def _warm_up(self) -> None:
+        if self._client is None:
+            self._client = self._client_factory()
+        await self._client.models.list()
+
+    # ---------- COALESCING ----------
+
+    @staticmethod
+    def request_key(model, messages, temperature, max_tokens) -> str:
+        return json.dumps([model, messages, temperature, max_tokens], sort_keys=True)
+
+    def complete(
+        self, messages, model, temperature=0.5, max_tokens=200, priority=PRIORITY_ANSWER, tokens=0
+    ) -> tuple[str, dict]:
+        """Blocking entry point for script threads."""
+        return self.run(
+            self.complete_async(messages, model, temperature, max_tokens, priority, tokens)
+        )
+
+    async def complete_async(
+        self, messages, model, temperature=0.5, max_tokens=200, priority=PRIORITY_ANSWER, tokens=0
+    ) -> tuple[str, dict]:
+        key = self.request_key(model, messages, temperature, max_tokens)
+        self.stats["requests"] += 1
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(
+                self._upstream(messages, model, temperature, max_tokens, priority, tokens)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+            tracing.set_attributes(coalesced=True)
+
+        # shield: one caller giving up must not cancel the shared request.
+        text, usage = await asyncio.shield(task)
+        return text, dict(usage)
+
+    async def _upstream(self, messages, model, temperature, max_tokens, priority, tokens) -> tuple[str, dict]:
+        with tracing.span("llm.upstream", model=model) as span:
+            text, usage, attempts = await self._request(messages, model, temperature, max_tokens, priority, tokens)
+            span.set(attempts=attempts)
+        return text, usage
+
+    async def _request(self, messages, model, temperature, max_tokens, priority, tokens) -> tuple[str, dict, int]:
+        if self._client is None:
+            self._client = self._client_factory()
+        self.stats["upstream"] += 1
+        governor = self._governor
+        loop = asyncio.get_running_loop()
+        attempt = 0
+
+        while True:
+            if governor is not None:
+                await loop.run_in_executor(self._admission, tracing.bind(governor.acquire), priority, tokens)
+            try:
+                response = await self._client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                )
+            except Exception as exc:
+                if governor is None:
+                    self.stats["errors"] += 1
+                    raise
+                governor.release(tokens)
+                if attempt >= governor.max_retries or not is_retryable(exc):
+                    governor.stats["failures"] += 1
+                    self.stats["errors"] += 1
+                    raise
+                governor.stats["retries"] += 1
+                await asyncio.sleep(governor.backoff_delay(attempt, exc))
+                attempt += 1
+                continue
+            break
+
+        usage = getattr(response, "usage", None)
+        usage = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        }
+        if governor is not None:
+            governor.release(tokens, usage["prompt_tokens"] + usage["completion_tokens"])
+        return response.choices[0].message.content.strip(), usage, attempt + 1
@@ -0,0 +1,141 @@
+"""
+Lazily built Groq clients, and connection warm-up at server start.
+
+Importing the groq SDK and building a client (an httpx pool with its own SSL
+context) takes a few hundred ms, and Groq() raises without GROQ_API_KEY. So
+utils.extension gets its client from get_client() on the first LLM call rather
+than at import, and the module imports without credentials.
+
+start_warm_up() (called from app.py, once per process) does that work in a
+background thread before the first user asks anything:
+    - resolves the API host, so DNS problems show up in the log at startup
+    - imports utils.extension (groq, the classifier model)
+    - builds the clients and makes one cheap request (GET /models), leaving an
+      open keep-alive connection in each client's pool for the first question
+
+Pooled connections stay open for ASTRO_LLM_KEEPALIVE_S idle seconds; httpx
+closes them after 5 s by default, which is shorter than a typical gap between
+questions.
+
+Configuration (environment variables):
+    ASTRO_LLM_WARMUP            0 to skip the warm-up (default 1)
+    ASTRO_LLM_KEEPALIVE_S       idle seconds a pooled connection is kept (default 60)
+    ASTRO_LLM_MAX_CONNECTIONS   max connections per client              (default 20)
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+log = logging.getLogger(__name__)
+
+WARMUP = os.getenv("ASTRO_LLM_WARMUP", "1") != "0"
+KEEPALIVE_S = float(os.getenv("ASTRO_LLM_KEEPALIVE_S", "60"))
+MAX_CONNECTIONS = int(os.getenv("ASTRO_LLM_MAX_CONNECTIONS", "20"))
+
+DEFAULT_BASE_URL = "https://api.groq.com"
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def base_url() -> str:
+    return os.getenv("GROQ_BASE_URL") or DEFAULT_BASE_URL
+
+
+def _limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_S,
+    )
+
+
+# ==========================================================
+# CLIENTS
+# ==========================================================
+
+def get_client():
+    """The process-wide synchronous client, built on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from groq import DefaultHttpxClient, Groq
+
+                # Retries are handled by the governor, so the SDK's own retries are disabled.
+                _client = Groq(
+                    api_key=os.getenv("GROQ_API_KEY"),
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=_limits()),
+                )
+    return _client
+
+
+def make_async_client():
+    """Builds an async client; call it on the event loop that will use it."""
+    from groq import AsyncGroq, DefaultAsyncHttpxClient
+
+    return AsyncGroq(
+        api_key=os.getenv("GROQ_API_KEY"),
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(limits=_limits()),
+    )
+
+
+# ==========================================================
+# WARM-UP
+# ==========================================================
+
+WARMUP_STATS = {}  # step -> ms, plus "error" if a step failed
+
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
+
+
+def resolve_endpoint() -> list[str]:
+    url = urlsplit(base_url())
+    port = url.port or (443 if url.scheme == "https" else 80)
+    infos = socket.getaddrinfo(url.hostname, port, type=socket.SOCK_STREAM)
+    return sorted({info[4][0] for info in infos})
+
+
+def _step(name, fn):
+    start = time.perf_counter()
+    result = fn()
+    WARMUP_STATS[name] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def warm_up() -> dict:
+    """Runs the warm-up steps in this thread; returns WARMUP_STATS. Never raises."""
+    try:
+        _step("resolve_ms", resolve_endpoint)
+        extension = _step("import_ms", lambda: __import__("utils.extension", fromlist=["_"]))
+        if not os.getenv("GROQ_API_KEY") or extension.cassette.ACTIVE is not None:
+            return WARMUP_STATS  # nothing to connect to
+        _step("sync_connect_ms", lambda: get_client().models.list())
+        if extension.LLM_BACKEND == "async":
+            _step("async_connect_ms", extension.async_llm.warm_up)
+    except Exception as exc:
+        WARMUP_STATS["error"] = f"{type(exc).__name__}: {exc}"
+        log.warning("LLM warm-up failed: %s", exc)
+    return WARMUP_STATS
+
+
+def start_warm_up() -> None:
+    """Starts warm_up() in a daemon thread, once per process."""
+    global _warm_up_started
+    if _warm_up_started or not WARMUP:
+        return
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up, name="astro-llm-warmup", daemon=True).start()
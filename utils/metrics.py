@@ -0,0 +1,386 @@
+"""
+In-process metrics: counters, gauges and fixed-bucket histograms.
+
+Hot paths record into metrics defined next to them (LLM calls in
+utils.extension, SQL statements in utils.db, script runs in app.py):
+
+    LLM_SECONDS = metrics.histogram("astro_llm_request_seconds", "...", ["kind"])
+    LLM_SECONDS.labels("expert").observe(elapsed)
+
+Recording is a dict lookup and a short lock, about a microsecond, so the
+metrics are always on. Stats the app already keeps (connection pool, governor,
+caches) are read at export time by collectors instead of being copied on every
+update.
+
+Everything is exported in the Prometheus text format: from render(), on the
+admin-only Metrics page, and by start_exporters() (called from app.py, once per
+process) to a file and/or a local HTTP endpoint:
+
+Configuration (environment variables):
+    ASTRO_METRICS_FILE         write the metrics to this file, e.g. for node_exporter's
+                               textfile collector                      (default unset)
+    ASTRO_METRICS_INTERVAL_S   seconds between file writes              (default 15)
+    ASTRO_METRICS_PORT         serve GET /metrics on this port           (default unset)
+    ASTRO_METRICS_HOST         address the endpoint binds to       (default 127.0.0.1)
+"""
+
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+log = logging.getLogger(__name__)
+
+METRICS_FILE = os.getenv("ASTRO_METRICS_FILE")
+INTERVAL_S = float(os.getenv("ASTRO_METRICS_INTERVAL_S", "15"))
+PORT = int(os.getenv("ASTRO_METRICS_PORT", "0"))
+HOST = os.getenv("ASTRO_METRICS_HOST", "127.0.0.1")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers cache hits and SQL statements up to slow LLM answers.
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+# ==========================================================
+# METRICS
+# ==========================================================
+
+class _CounterValue:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate, interpolated inside the bucket (as Prometheus' histogram_quantile)."""
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class _Metric:
+    kind = ""
+    _value_type = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}  # label values -> value object
+        self._lock = threading.Lock()
+        if not self.label_names:
+            self._default = self.labels()
+
+    def _new_value(self):
+        return self._value_type()
+
+    def labels(self, *values: str):
+        """The time series for these label values (strings, in `labels` order)."""
+        value = self._values.get(values)
+        if value is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} takes labels {self.label_names}, got {values}")
+            with self._lock:
+                value = self._values.setdefault(values, self._new_value())
+        return value
+
+    def series(self) -> dict:
+        """label values -> value object, one entry per time series."""
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(_Metric):
+    kind = "counter"
+    _value_type = _CounterValue
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    _value_type = _GaugeValue
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+
+# ==========================================================
+# REGISTRY
+# ==========================================================
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help, labels, **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **options)
+            elif type(metric) is not cls or metric.label_names != tuple(labels):
+                raise ValueError(f"metric {name} is already registered as a different {metric.kind}")
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._get_or_create(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labels, buckets=buckets)
+
+    def get(self, name: str) -> _Metric | None:
+        return self._metrics.get(name)
+
+    def register_collector(self, collect) -> None:
+        """
+        `collect()` is called at export time and yields (name, kind, help,
+        samples), samples being [(labels dict, value), ...]. Kind is
+        "counter" or "gauge".
+        """
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in sorted(self._metrics.values(), key=lambda m: m.name):
+            lines += [f"# HELP {metric.name} {_escape_help(metric.help)}", f"# TYPE {metric.name} {metric.kind}"]
+            for key, value in sorted(metric.series().items()):
+                labels = dict(zip(metric.label_names, key))
+                if metric.kind == "histogram":
+                    lines += _histogram_lines(metric.name, labels, value)
+                else:
+                    lines.append(f"{metric.name}{_labels(labels)} {_number(value.value)}")
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                log.warning("metrics collector %s failed: %s", getattr(collect, "__qualname__", collect), e)
+                continue
+            for name, kind, help, samples in families:
+                samples = list(samples)
+                if not samples:
+                    continue
+                lines += [f"# HELP {name} {_escape_help(help)}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_labels(labels)} {_number(value)}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _histogram_lines(name: str, labels: dict, value: _HistogramValue) -> list[str]:
+    with value._lock:
+        counts, total, count = list(value.counts), value.sum, value.count
+    lines = []
+    cumulative = 0
+    for bound, n in zip(value.buckets + (math.inf,), counts):
+        cumulative += n
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}")
+    lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+    lines.append(f"{name}_count{_labels(labels)} {count}")
+    return lines
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+register_collector = REGISTRY.register_collector
+render = REGISTRY.render
+
+
+@contextmanager
+def timed(metric: Histogram, *labels, errors: Counter | None = None):
+    """Observes the block's duration; counts it in `errors` (same labels) if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.labels(*labels).inc()
+        raise
+    finally:
+        metric.labels(*labels).observe(time.perf_counter() - start)
+
+
+# ==========================================================
+# CACHES
+# ==========================================================
+
+_caches = {}  # name -> utils.cache.LRUCache
+
+
+def register_cache(name: str, cache) -> None:
+    """Exports an LRUCache's hit/miss/eviction counters and size under `name`."""
+    _caches[name] = cache
+
+
+def _collect_caches():
+    stats = {name: cache.stats() for name, cache in _caches.items()}
+    for key, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("size", "gauge")):
+        metric = f"astro_cache_{key}_total" if kind == "counter" else f"astro_cache_{key}"
+        yield metric, kind, f"In-process cache {key}", [({"cache": name}, s[key]) for name, s in stats.items()]
+
+
+register_collector(_collect_caches)
+
+
+# ==========================================================
+# EXPORT
+# ==========================================================
+
+def write_textfile(path: str) -> None:
+    """Writes the metrics atomically, so a scraper never reads a partial file."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def _write_loop(path: str, interval: float) -> None:
+    while True:
+        try:
+            write_textfile(path)
+        except OSError as e:
+            log.warning("writing metrics to %s failed: %s", path, e)
+        time.sleep(interval)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port: int = PORT, host: str = HOST) -> ThreadingHTTPServer:
+    """Serves GET /metrics from a daemon thread; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="astro-metrics-http", daemon=True).start()
+    return server
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters() -> None:
+    """Starts the configured file writer and HTTP endpoint, once per process."""
+    global _exporters_started
+    if _exporters_started or not (METRICS_FILE or PORT):
+        return
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if METRICS_FILE:
+        threading.Thread(
+            target=_write_loop, args=(METRICS_FILE, INTERVAL_S), name="astro-metrics-file", daemon=True
+        ).start()
+    if PORT:
+        try:
+            start_http_server(PORT, HOST)
+        except OSError as e:
+            # Another server process on this machine already has the port.
+            log.warning("metrics endpoint on %s:%s not started: %s", HOST, PORT, e)
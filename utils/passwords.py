@@ -0,0 +1,221 @@
+"""
+Password hashing with a slow KDF, run on a bounded worker pool.
+
+New hashes use scrypt (default) or PBKDF2-SHA256 from hashlib, at a cost tuned
+per deployment. Every user row stores the scheme it was hashed with
+(users.password_scheme), e.g. "scrypt:n=32768,r=8,p=1" or
+"pbkdf2_sha256:i=600000"; legacy rows (NULL) are the old single salted SHA-256.
+utils.auth.verify_user rehashes a legacy or outdated hash with the current
+scheme after a successful login.
+
+Hashing runs on a pool of ASTRO_PASSWORD_WORKERS threads (hashlib releases the
+GIL while deriving), so a login storm uses at most that many cores. Other
+sessions' reruns keep the rest. Callers beyond workers + ASTRO_PASSWORD_QUEUE wait
+for a slot instead of piling more work onto the pool. ASTRO_PASSWORD_POOL=process
+uses worker processes instead.
+
+Configuration (environment variables):
+    ASTRO_PASSWORD_SCHEME        scrypt (default) or pbkdf2
+    ASTRO_PASSWORD_SCRYPT_N      scrypt CPU/memory cost, a power of two   (default 32768)
+    ASTRO_PASSWORD_SCRYPT_R      scrypt block size                        (default 8)
+    ASTRO_PASSWORD_SCRYPT_P      scrypt parallelism                       (default 1)
+    ASTRO_PASSWORD_PBKDF2_ITERATIONS                                      (default 600000)
+    ASTRO_PASSWORD_WORKERS       hashing workers                          (default 4)
+    ASTRO_PASSWORD_QUEUE         extra callers allowed to queue           (default 64)
+    ASTRO_PASSWORD_POOL          thread (default) or process
+
+Calibrate the cost for this machine:
+    python -m utils.passwords --calibrate --target-ms 250
+"""
+
+import argparse
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+LEGACY_SCHEME = "sha256"
+
+SCHEME = os.getenv("ASTRO_PASSWORD_SCHEME", "scrypt").lower()
+SCRYPT_N = int(os.getenv("ASTRO_PASSWORD_SCRYPT_N", "32768"))
+SCRYPT_R = int(os.getenv("ASTRO_PASSWORD_SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("ASTRO_PASSWORD_SCRYPT_P", "1"))
+PBKDF2_ITERATIONS = int(os.getenv("ASTRO_PASSWORD_PBKDF2_ITERATIONS", "600000"))
+
+WORKERS = int(os.getenv("ASTRO_PASSWORD_WORKERS", "4"))
+QUEUE = int(os.getenv("ASTRO_PASSWORD_QUEUE", "64"))
+POOL = os.getenv("ASTRO_PASSWORD_POOL", "thread").lower()
+
+
+# ==========================================================
+# SCHEMES
+# ==========================================================
+
+def format_scheme(name: str, **params) -> str:
+    return name + ":" + ",".join(f"{k}={v}" for k, v in params.items())
+
+
+def parse_scheme(scheme: str | None) -> tuple[str, dict]:
+    if not scheme or scheme == LEGACY_SCHEME:
+        return LEGACY_SCHEME, {}
+    name, _, params = scheme.partition(":")
+    return name, {k: int(v) for k, v in (p.split("=") for p in params.split(",") if p)}
+
+
+def current_scheme() -> str:
+    if SCHEME == "pbkdf2":
+        return format_scheme("pbkdf2_sha256", i=PBKDF2_ITERATIONS)
+    return format_scheme("scrypt", n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+
+
+def derive(password: str, salt: str, scheme: str | None) -> str:
+    """Computes the stored hash (hex). Runs on the worker pool; must stay picklable."""
+    name, params = parse_scheme(scheme)
+    if name == LEGACY_SCHEME:
+        return hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
+    if name == "scrypt":
+        n, r, p = params["n"], params["r"], params["p"]
+        return hashlib.scrypt(
+            password.encode("utf-8"),
+            salt=salt.encode("utf-8"),
+            n=n, r=r, p=p,
+            maxmem=256 * n * r * p + (1 << 20),
+            dklen=32,
+        ).hex()
+    if name == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), params["i"]).hex()
+    raise ValueError(f"unknown password scheme {scheme!r}")
+
+
+def needs_rehash(scheme: str | None) -> bool:
+    return (scheme or LEGACY_SCHEME) != current_scheme()
+
+
+# ==========================================================
+# WORKER POOL
+# ==========================================================
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, WORKERS) + max(0, QUEUE))
+
+STATS = {"hashes": 0, "verifications": 0, "hash_seconds": 0.0, "slot_waits": 0}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                if POOL == "process":
+                    _executor = ProcessPoolExecutor(max_workers=max(1, WORKERS))
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix="astro-pwhash")
+    return _executor
+
+
+def _run(password: str, salt: str, scheme: str | None) -> str:
+    if not _slots.acquire(blocking=False):
+        STATS["slot_waits"] += 1
+        _slots.acquire()
+    try:
+        start = time.perf_counter()
+        digest = _get_executor().submit(derive, password, salt, scheme).result()
+        STATS["hash_seconds"] += time.perf_counter() - start
+        return digest
+    finally:
+        _slots.release()
+
+
+def hash_password(password: str, scheme: str | None = None) -> tuple[str, str, str]:
+    """Returns (salt, hash, scheme) for a new password."""
+    scheme = scheme or current_scheme()
+    salt = secrets.token_hex(16)
+    STATS["hashes"] += 1
+    return salt, _run(password, salt, scheme), scheme
+
+
+def verify_password(password: str, salt: str, stored_hash: str, scheme: str | None) -> bool:
+    STATS["verifications"] += 1
+    return hmac.compare_digest(_run(password, salt, scheme), stored_hash or "")
+
+
+# Random salt and hash no password derives to; only the KDF run matters.
+_DUMMY_SALT, _DUMMY_HASH = secrets.token_hex(16), secrets.token_hex(32)
+
+
+def verify_dummy(password: str) -> bool:
+    """
+    A full verification in the current scheme that always fails. Login for an
+    unknown email calls this, so it takes as long as for a known one.
+    """
+    return verify_password(password, _DUMMY_SALT, _DUMMY_HASH, current_scheme())
+
+
+# ==========================================================
+# CALIBRATION
+# ==========================================================
+
+def _time_scheme(scheme: str, rounds: int = 3) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        derive("calibration-password", "0" * 32, scheme)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate(target_ms: float, r: int = 8, p: int = 1, max_n: int = 1 << 20) -> dict:
+    """Picks scrypt N and PBKDF2 iterations whose hash time is closest to target_ms here."""
+    target = target_ms / 1000
+
+    n, timings = 1 << 12, {}
+    while n <= max_n:
+        timings[n] = _time_scheme(format_scheme("scrypt", n=n, r=r, p=p))
+        if timings[n] >= target:
+            break
+        n <<= 1
+    best_n = min(timings, key=lambda k: abs(timings[k] - target))
+
+    probe = 50_000
+    per_iteration = _time_scheme(format_scheme("pbkdf2_sha256", i=probe)) / probe
+    iterations = max(10_000, int(target / per_iteration) // 1000 * 1000)
+
+    return {
+        "scrypt": {"n": best_n, "r": r, "p": p, "ms": timings[best_n] * 1000, "memory_mb": 128 * best_n * r / 2**20},
+        "pbkdf2": {"iterations": iterations, "ms": per_iteration * iterations * 1000},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Password hashing tools.")
+    parser.add_argument("--calibrate", action="store_true", help="pick KDF costs for a target hash time")
+    parser.add_argument("--target-ms", type=float, default=250.0)
+    parser.add_argument("--r", type=int, default=8, help="scrypt block size")
+    args = parser.parse_args()
+
+    if not args.calibrate:
+        print(f"current scheme: {current_scheme()}")
+        print(f"measured: {_time_scheme(current_scheme()) * 1000:.1f} ms per hash")
+        return
+
+    result = calibrate(args.target_ms, r=args.r)
+    s, k = result["scrypt"], result["pbkdf2"]
+    print(f"scrypt  n={s['n']} r={s['r']} p={s['p']}: {s['ms']:.1f} ms, {s['memory_mb']:.0f} MiB per hash")
+    print(f"pbkdf2  {k['iterations']} iterations: {k['ms']:.1f} ms\n")
+    print("# deployment environment (scrypt):")
+    print("ASTRO_PASSWORD_SCHEME=scrypt")
+    print(f"ASTRO_PASSWORD_SCRYPT_N={s['n']}")
+    print(f"ASTRO_PASSWORD_SCRYPT_R={s['r']}")
+    print(f"ASTRO_PASSWORD_SCRYPT_P={s['p']}")
+    print("# or (PBKDF2):")
+    print("# ASTRO_PASSWORD_SCHEME=pbkdf2")
+    print(f"# ASTRO_PASSWORD_PBKDF2_ITERATIONS={k['iterations']}")
+
+
+if __name__ == "__main__":
+    main()
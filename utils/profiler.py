@@ -0,0 +1,310 @@
+"""
+Per-rerun sampling profiler, opt-in per session.
+
+app.py runs the page router inside rerun(). For a profiled session, every
+script run is sampled: a background thread reads the script thread's stack
+every ASTRO_PROFILE_INTERVAL_MS and counts it in collapsed form
+("frame;frame;frame count", root first, from app.py down), which flamegraph.pl,
+inferno and speedscope read as is. Phase timings are recorded alongside:
+
+    css     injecting the view's stylesheet bundle (utils.assets)
+    db      SQL statements and commits on pooled connections (utils.db)
+    llm     waiting for LLM calls, streamed chunks, the speculative expert
+    render  Streamlit element calls, estimated from the share of samples in them
+    other   the rest of the run
+
+css, db and llm are measured exactly by phase() hooks on the script thread;
+work on other threads (speculation, summaries) only counts while the script
+thread waits for it.
+
+A session is profiled if it was sampled when it started (ASTRO_PROFILE_SAMPLE,
+e.g. 0.01 for 1% of sessions) or an admin switched "Profile my page runs" on
+the Metrics page (st.session_state._profile_reruns). Each profiled run writes
+ASTRO_PROFILE_DIR/<time>-<session>-<page>.folded and appends its phase timings
+to ASTRO_PROFILE_DIR/reruns.jsonl; RECENT keeps the latest in memory.
+
+    flamegraph.pl profiles/*-dashboard.folded > dashboard.svg
+
+Outside a profiled run every hook costs a contextvar lookup.
+
+Configuration (environment variables):
+    ASTRO_PROFILE_SAMPLE        fraction of sessions profiled, 0..1     (default 0)
+    ASTRO_PROFILE_INTERVAL_MS   sampling interval                       (default 5)
+    ASTRO_PROFILE_DIR           output directory                 (default profiles)
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+
+log = logging.getLogger(__name__)
+
+SAMPLE = float(os.getenv("ASTRO_PROFILE_SAMPLE", "0"))
+INTERVAL_MS = float(os.getenv("ASTRO_PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("ASTRO_PROFILE_DIR", "profiles")
+
+PHASES = ("css", "db", "llm", "render", "other")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(ROOT, "app.py")
+_STREAMLIT = os.sep + "streamlit" + os.sep
+
+# Phase timings of the most recent profiled runs, newest last.
+RECENT = deque(maxlen=200)
+
+_active = contextvars.ContextVar("astro_profile", default=None)
+
+
+# ==========================================================
+# RUN PROFILE
+# ==========================================================
+
+class RerunProfile:
+    def __init__(self, session: str):
+        self.session = session
+        self.page = ""
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.stacks = Counter()         # collapsed stack -> samples
+        self.sample_phases = Counter()  # phase -> samples
+        self.phases = Counter()         # phase -> seconds, measured by the hooks
+        self._phase = None
+        self._phase_start = 0.0
+
+    def set_page(self, page: str) -> None:
+        self.page = page
+
+    # ---------- PHASES ----------
+
+    def enter(self, name: str):
+        """Starts phase `name`, pausing the current one; returns what exit() needs."""
+        now = time.perf_counter()
+        outer = self._phase
+        if outer is not None:
+            self.phases[outer] += now - self._phase_start
+        self._phase, self._phase_start = name, now
+        return outer
+
+    def exit(self, outer) -> None:
+        now = time.perf_counter()
+        self.phases[self._phase] += now - self._phase_start
+        self._phase, self._phase_start = outer, now
+
+    # ---------- SAMPLES ----------
+
+    def sample(self, frame) -> None:
+        """Counts the stack under `frame`; called from the sampler thread."""
+        labels = []
+        owner = None  # "render" or "other": who runs the innermost frame of Streamlit or the app
+        while frame is not None:
+            code = frame.f_code
+            labels.append(_label(code))
+            if owner is None:
+                if _STREAMLIT in code.co_filename:
+                    owner = "render"
+                elif code.co_filename.startswith(ROOT + os.sep):
+                    owner = "other"
+            if code.co_filename == APP_FILE and code.co_name == "<module>":
+                break
+            frame = frame.f_back
+        self.stacks[";".join(reversed(labels))] += 1
+        self.sample_phases[self._phase or owner or "other"] += 1
+
+    def summary(self, total: float) -> dict:
+        samples = sum(self.sample_phases.values())
+        phases = {name: self.phases[name] for name in ("css", "db", "llm")}
+        phases["render"] = total * self.sample_phases["render"] / samples if samples else 0.0
+        phases["other"] = max(0.0, total - sum(phases.values()))
+        return {
+            "time": datetime.fromtimestamp(self.started_at).isoformat(timespec="milliseconds"),
+            "session": self.session,
+            "page": self.page,
+            "total_ms": round(total * 1000, 2),
+            "phases_ms": {name: round(seconds * 1000, 2) for name, seconds in phases.items()},
+            "samples": samples,
+            "interval_ms": INTERVAL_MS,
+        }
+
+
+class _NoProfile:
+    """Stands in for a profile when the run isn't profiled."""
+
+    def set_page(self, page: str) -> None:
+        pass
+
+
+NO_PROFILE = _NoProfile()
+
+_labels = {}  # code object -> frame label
+
+
+def _label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if path.startswith(ROOT + os.sep):
+            path = os.path.relpath(path, ROOT)
+        elif "site-packages" + os.sep in path:
+            path = path.split("site-packages" + os.sep, 1)[1]
+        else:
+            path = os.path.basename(path)
+        name = getattr(code, "co_qualname", code.co_name)
+        # ';' separates frames in the collapsed format.
+        label = _labels[code] = f"{name} ({path})".replace(";", ":")
+    return label
+
+
+# ==========================================================
+# SAMPLER
+# ==========================================================
+
+class _Sampler:
+    """One daemon thread sampling the stacks of every script thread being profiled."""
+
+    def __init__(self):
+        self._targets = {}  # thread id -> RerunProfile
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, profile: RerunProfile) -> None:
+        with self._lock:
+            self._targets[profile.thread_id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="astro-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, profile: RerunProfile) -> None:
+        # Holding the lock means no sample of this profile is in progress.
+        with self._lock:
+            self._targets.pop(profile.thread_id, None)
+
+    def _run(self) -> None:
+        interval = INTERVAL_MS / 1000
+        while True:
+            if not self._targets:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            time.sleep(interval)
+            with self._lock:
+                if not self._targets:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, profile in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profile.sample(frame)
+            del frames
+
+
+_sampler = _Sampler()
+
+
+# ==========================================================
+# HOOKS
+# ==========================================================
+
+def active() -> RerunProfile | None:
+    return _active.get()
+
+
+@contextmanager
+def phase(name: str):
+    """Times the block as phase `name` of the profiled run, if any."""
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    outer = profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit(outer)
+
+
+def iterate_in_phase(name: str, iterable):
+    """Yields from `iterable`, timing the production of each item as phase `name`."""
+    profile = _active.get()
+    if profile is None:
+        yield from iterable
+        return
+    it = iter(iterable)
+    try:
+        while True:
+            outer = profile.enter(name)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                profile.exit(outer)
+            yield item
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()
+
+
+# ==========================================================
+# RUNS
+# ==========================================================
+
+def session_profiled(session_state) -> bool:
+    """Whether this session's runs are profiled; the sampling decision is made once per session."""
+    if session_state.get("_profile_reruns"):
+        return True
+    sampled = session_state.get("_profile_sampled")
+    if sampled is None:
+        sampled = session_state["_profile_sampled"] = SAMPLE > 0 and random.random() < SAMPLE
+    return sampled
+
+
+def session_id(session_state) -> str:
+    if "_profile_session" not in session_state:
+        session_state["_profile_session"] = secrets.token_hex(4)
+    return session_state["_profile_session"]
+
+
+@contextmanager
+def rerun(session_state):
+    """Profiles the block (one script run) if the session is profiled."""
+    if not session_profiled(session_state):
+        yield NO_PROFILE
+        return
+    profile = RerunProfile(session_id(session_state))
+    token = _active.set(profile)
+    _sampler.add(profile)
+    try:
+        yield profile
+    finally:
+        _sampler.remove(profile)
+        _active.reset(token)
+        _finish(profile, time.perf_counter() - profile.start)
+
+
+def _finish(profile: RerunProfile, total: float) -> None:
+    summary = profile.summary(total)
+    stamp = datetime.fromtimestamp(profile.started_at).strftime("%Y%m%d-%H%M%S-%f")[:-3]
+    summary["file"] = f"{stamp}-{profile.session}-{profile.page or 'unknown'}.folded"
+    RECENT.append(summary)
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, summary["file"]), "w", encoding="utf-8") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in profile.stacks.items())
+        with open(os.path.join(PROFILE_DIR, "reruns.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary) + "\n")
+    except OSError as e:
+        log.warning("writing the run profile to %s failed: %s", PROFILE_DIR, e)
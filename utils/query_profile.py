@@ -0,0 +1,335 @@
+"""
+SQLite query profiler: per-statement stats for everything run through get_conn().
+
+With ASTRO_DB_PROFILE=1, pooled connections (utils.db) are opened as
+ProfiledConnection and every statement is recorded under its normalized text
+(literals replaced by ?, whitespace collapsed):
+
+    calls, total/max time, rows returned (fetched, or changed by DML),
+    write-lock wait, VM instructions executed, errors
+
+VM instructions are counted with the connection's progress handler, every
+PROGRESS_OPS instructions. Many instructions per row returned is the sign of a
+scan, e.g. a lookup by a column without an index as `users` grows. Lock wait
+is measured by taking the write lock of an implicit transaction with an
+explicit, timed BEGIN IMMEDIATE instead of sqlite3's deferred BEGIN, so it is
+the time a writer spent in SQLite's busy handler.
+
+Statements slower than ASTRO_DB_SLOW_MS are logged (warning) and kept in
+SLOW_QUERIES, and appended to ASTRO_DB_SLOW_LOG if set. The first time a
+statement is slow, its EXPLAIN QUERY PLAN is captured with the same
+parameters; the parameters themselves are never stored.
+
+Each process writes its profile to ASTRO_DB_PROFILE_FILE every
+ASTRO_DB_PROFILE_INTERVAL_S seconds and at exit. To list the statements that
+took the most time:
+
+    python -m utils.query_profile                    # top 15 by total time
+    python -m utils.query_profile --top 30 --sort max --plans
+
+Configuration (environment variables):
+    ASTRO_DB_PROFILE              1 to profile statements             (default 0)
+    ASTRO_DB_SLOW_MS              slow-query threshold, ms             (default 50)
+    ASTRO_DB_SLOW_LOG             JSONL file for slow queries      (default unset)
+    ASTRO_DB_PROFILE_FILE         profile written here     (default db_profile.json)
+    ASTRO_DB_PROFILE_INTERVAL_S   seconds between profile writes      (default 15)
+"""
+
+import argparse
+import atexit
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from utils import metrics
+
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("ASTRO_DB_PROFILE", "0") == "1"
+SLOW_MS = float(os.getenv("ASTRO_DB_SLOW_MS", "50"))
+SLOW_LOG = os.getenv("ASTRO_DB_SLOW_LOG")
+PROFILE_FILE = os.getenv("ASTRO_DB_PROFILE_FILE", "db_profile.json")
+INTERVAL_S = float(os.getenv("ASTRO_DB_PROFILE_INTERVAL_S", "15"))
+
+PROGRESS_OPS = 1000  # progress handler granularity, in VM instructions
+
+# Most recent slow statements, newest last.
+SLOW_QUERIES = deque(maxlen=200)
+
+SLOW_QUERIES_TOTAL = metrics.counter(
+    "astro_db_slow_queries_total", "SQLite statements slower than ASTRO_DB_SLOW_MS (profiler on)"
+)
+
+_stats = {}  # normalized SQL -> entry dict
+_lock = threading.Lock()
+
+
+# ==========================================================
+# NORMALIZATION
+# ==========================================================
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\(\?(?:, ?\?)+\)")
+
+_normalized = {}  # SQL text -> normalized; the app's statements are a small fixed set
+
+
+def normalize(sql: str) -> str:
+    """`sql` with literals replaced by ? and whitespace collapsed, so the same statement groups together."""
+    text = _normalized.get(sql)
+    if text is None:
+        text = _STRING.sub("?", sql)
+        text = _NUMBER.sub("?", text)
+        text = _SPACE.sub(" ", text).strip()
+        text = _IN_LIST.sub("(?, ...)", text)
+        if len(_normalized) < 1024:
+            _normalized[sql] = text
+    return text
+
+
+# ==========================================================
+# RECORDING
+# ==========================================================
+
+def _new_entry(sql: str) -> dict:
+    return {
+        "sql": sql,
+        "calls": 0,
+        "errors": 0,
+        "total_s": 0.0,     # execute() plus fetching
+        "max_s": 0.0,       # one execute(), up to the first row
+        "rows": 0,
+        "lock_wait_s": 0.0,
+        "lock_wait_max_s": 0.0,
+        "vm_steps": 0,      # approximate, in units of PROGRESS_OPS
+        "slow": 0,
+        "plan": None,       # EXPLAIN QUERY PLAN lines, captured when first slow
+    }
+
+
+def record(conn, sql: str, parameters, seconds: float, lock_wait: float, steps: int, rows: int,
+           failed: bool = False) -> dict:
+    """
+    Adds one execute() to its statement's entry; returns the entry for fetched().
+    `steps` is the number of progress handler calls it made.
+    """
+    key = normalize(sql)
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = _new_entry(key)
+        entry["calls"] += 1
+        entry["errors"] += failed
+        entry["total_s"] += seconds
+        entry["max_s"] = max(entry["max_s"], seconds)
+        entry["rows"] += max(rows, 0)
+        entry["lock_wait_s"] += lock_wait
+        entry["lock_wait_max_s"] = max(entry["lock_wait_max_s"], lock_wait)
+        entry["vm_steps"] += steps * PROGRESS_OPS
+    if not failed and seconds * 1000 >= SLOW_MS:
+        _slow(conn, sql, parameters, entry, seconds, lock_wait, rows, steps)
+    return entry
+
+
+def fetched(entry: dict, rows: int, seconds: float, steps: int) -> None:
+    """Adds rows fetched after execute() (and the time and work it took) to the statement."""
+    with _lock:
+        entry["rows"] += rows
+        entry["total_s"] += seconds
+        entry["vm_steps"] += steps * PROGRESS_OPS
+
+
+def _slow(conn, sql, parameters, entry, seconds, lock_wait, rows, steps) -> None:
+    SLOW_QUERIES_TOTAL.inc()
+    if entry["plan"] is None:
+        plan = explain(conn, sql, parameters)
+        with _lock:
+            entry["plan"] = plan
+    with _lock:
+        entry["slow"] += 1
+    slow = {
+        "time": datetime.now().isoformat(timespec="milliseconds"),
+        "sql": entry["sql"],
+        "ms": round(seconds * 1000, 2),
+        "lock_wait_ms": round(lock_wait * 1000, 2),
+        "rows": max(rows, 0),
+        "vm_steps": steps * PROGRESS_OPS,
+        "plan": entry["plan"],
+    }
+    SLOW_QUERIES.append(slow)
+    log.warning("slow query %.1f ms (lock wait %.1f ms): %s", slow["ms"], slow["lock_wait_ms"], entry["sql"])
+    if SLOW_LOG:
+        try:
+            with open(SLOW_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(slow) + "\n")
+        except OSError as e:
+            log.warning("writing the slow-query log to %s failed: %s", SLOW_LOG, e)
+
+
+_EXPLAINABLE = {"select", "insert", "update", "delete", "replace", "with"}
+
+
+def explain(conn, sql: str, parameters) -> list[str]:
+    """EXPLAIN QUERY PLAN of `sql`, one indented line per step; [] if it has none."""
+    words = sql.split(None, 1)
+    if not words or words[0].lower() not in _EXPLAINABLE:
+        return []
+    if not isinstance(parameters, (tuple, list, dict)):
+        return []  # executemany's parameters may be a one-shot iterator
+    if isinstance(parameters, list) and parameters and isinstance(parameters[0], (tuple, list, dict)):
+        parameters = parameters[0]  # executemany: plan for the first row
+    try:
+        # The base class's execute(), so this isn't profiled itself.
+        rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def full_scans(plan: list[str] | None) -> list[str]:
+    """Tables the plan reads in full (SCAN without an index)."""
+    return [line.split()[1] for line in plan or [] if re.fullmatch(r"\s*SCAN \S+", line)]
+
+
+# ==========================================================
+# SNAPSHOTS
+# ==========================================================
+
+def snapshot() -> list[dict]:
+    """Copies of all statement entries, most total time first."""
+    with _lock:
+        entries = [dict(e) for e in _stats.values()]
+    return sorted(entries, key=lambda e: e["total_s"], reverse=True)
+
+
+def reset() -> None:
+    with _lock:
+        _stats.clear()
+    SLOW_QUERIES.clear()
+
+
+def write_profile(path: str = PROFILE_FILE) -> None:
+    """Writes the profile atomically, so a reader never sees a partial file."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({
+            "pid": os.getpid(),
+            "written_at": datetime.now().isoformat(timespec="seconds"),
+            "slow_ms": SLOW_MS,
+            "statements": snapshot(),
+            "slow": list(SLOW_QUERIES),
+        }, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _write_loop() -> None:
+    while True:
+        time.sleep(INTERVAL_S)
+        try:
+            write_profile()
+        except OSError as e:
+            log.warning("writing the query profile to %s failed: %s", PROFILE_FILE, e)
+
+
+_writer_started = False
+_writer_lock = threading.Lock()
+
+
+def start_writer() -> None:
+    """Writes the profile every INTERVAL_S and at exit, once per process."""
+    global _writer_started
+    if _writer_started:
+        return
+    with _writer_lock:
+        if _writer_started:
+            return
+        _writer_started = True
+    threading.Thread(target=_write_loop, name="astro-query-profile", daemon=True).start()
+    atexit.register(write_profile)
+
+
+# ==========================================================
+# REPORT
+# ==========================================================
+
+def _merge(paths: list[str]) -> tuple[list[dict], list[dict]]:
+    """Statements and slow queries from several processes' profile files, combined."""
+    merged, slow = {}, []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+        slow += profile.get("slow", [])
+        for e in profile["statements"]:
+            m = merged.get(e["sql"])
+            if m is None:
+                merged[e["sql"]] = dict(e)
+                continue
+            for key in ("calls", "errors", "total_s", "rows", "lock_wait_s", "vm_steps", "slow"):
+                m[key] += e[key]
+            for key in ("max_s", "lock_wait_max_s"):
+                m[key] = max(m[key], e[key])
+            m["plan"] = m["plan"] or e["plan"]
+    return list(merged.values()), sorted(slow, key=lambda s: s["time"])
+
+
+_SORT_KEYS = {
+    "total": "total_s",
+    "max": "max_s",
+    "calls": "calls",
+    "lock": "lock_wait_s",
+    "steps": "vm_steps",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Top SQLite statements from ASTRO_DB_PROFILE=1 profiles.")
+    parser.add_argument("files", nargs="*", default=[PROFILE_FILE],
+                        help="profile files (ASTRO_DB_PROFILE_FILE), one per process; combined")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--sort", choices=sorted(_SORT_KEYS), default="total")
+    parser.add_argument("--plans", action="store_true", help="print the captured query plans")
+    parser.add_argument("--slow", type=int, default=5, help="most recent slow queries to list")
+    parser.add_argument("--width", type=int, default=70, help="max statement width")
+    args = parser.parse_args()
+
+    entries, slow = _merge(args.files)
+    entries.sort(key=lambda e: e[_SORT_KEYS[args.sort]], reverse=True)
+    total = sum(e["total_s"] for e in entries) or 1.0
+    print(f"{len(entries)} statements, {sum(e['calls'] for e in entries)} calls, "
+          f"{total * 1000:.1f} ms total; top {args.top} by {args.sort}\n")
+    print(f"{'total ms':>10}{'%':>6}{'calls':>8}{'mean ms':>9}{'max ms':>9}{'rows/call':>10}"
+          f"{'lock ms':>9}{'steps/call':>11}  statement")
+    for e in entries[:args.top]:
+        calls = e["calls"] or 1
+        sql = e["sql"] if len(e["sql"]) <= args.width else e["sql"][:args.width - 1] + "…"
+        scans = full_scans(e["plan"])
+        note = f"  [full scan: {', '.join(scans)}]" if scans else ""
+        print(f"{e['total_s'] * 1000:>10.1f}{e['total_s'] / total * 100:>6.1f}{e['calls']:>8}"
+              f"{e['total_s'] / calls * 1000:>9.2f}{e['max_s'] * 1000:>9.2f}{e['rows'] / calls:>10.1f}"
+              f"{e['lock_wait_s'] * 1000:>9.1f}{e['vm_steps'] / calls:>11.0f}  {sql}{note}")
+        if args.plans and e["plan"]:
+            for line in e["plan"]:
+                print(f"{'':>74}{line}")
+
+    if slow and args.slow:
+        print(f"\nlast {min(args.slow, len(slow))} of {len(slow)} slow queries:")
+        for s in slow[-args.slow:]:
+            print(f"  {s['time']}  {s['ms']:>8.1f} ms  lock {s['lock_wait_ms']:.1f} ms  {s['sql'][:args.width]}")
+
+
+if __name__ == "__main__":
+    main()
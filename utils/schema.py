@@ -0,0 +1,201 @@
+"""
+Versioned schema bootstrap.
+
+ensure_schema() runs once per process (per database path): it reads the
+`schema_version` table, applies any pending forward migrations in order and
+records them. Later calls return immediately without touching SQLite, so the
+Streamlit script can call it at the top of every rerun for free.
+
+Adding a migration: append a new (version, description, steps) entry to MIGRATIONS.
+A step is either an SQL string or a callable taking a cursor. Never edit a
+migration that has already shipped.
+"""
+
+import threading
+import time
+
+from utils import db
+
+
+def _normalize_emails(cur) -> None:
+    # create_user/verify_user already lower-case emails; legacy rows may not be.
+    # Rows whose lower-cased email would collide with another row are left alone,
+    # and of several rows differing only by case only the first (MIN(id)) is
+    # normalized; the others are left for manual handling. Once every stored
+    # email is lower-case, the UNIQUE(email) index serves all lookups, so no
+    # separate lower(email) index is needed.
+    cur.execute(
+        """
+        UPDATE users SET email = lower(email)
+        WHERE email <> lower(email)
+          AND NOT EXISTS (
+              SELECT 1 FROM users u2
+              WHERE u2.email = lower(users.email) AND u2.id <> users.id
+          )
+          AND id = (SELECT MIN(u3.id) FROM users u3 WHERE lower(u3.email) = lower(users.email))
+        """
+    )
+
+
+MIGRATIONS = [
+    (
+        1,
+        "users and user_profiles tables",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                email TEXT UNIQUE,
+                password_hash TEXT,
+                salt TEXT,
+                reset_token TEXT,
+                reset_token_expiry INTEGER
+            )
+            """,
+            # user_id UNIQUE gives the user_id lookup index for free.
+            """
+            CREATE TABLE IF NOT EXISTS user_profiles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER UNIQUE,
+                dob TEXT,
+                tob TEXT,
+                place TEXT,
+                fav_color TEXT,
+                rashi TEXT,
+                language TEXT,
+                gender TEXT,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "case-normalized emails and reset-token index",
+        [
+            _normalize_emails,
+            # Only rows with an outstanding token are indexed, so this stays tiny.
+            """
+            CREATE INDEX IF NOT EXISTS idx_users_reset_token
+            ON users(reset_token) WHERE reset_token IS NOT NULL
+            """,
+        ],
+    ),
+    (
+        3,
+        "answer cache",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                key TEXT PRIMARY KEY,
+                question TEXT,
+                answer TEXT,
+                created_at INTEGER,
+                expires_at INTEGER,
+                hits INTEGER DEFAULT 0,
+                last_used_at INTEGER
+            ) WITHOUT ROWID
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_answer_cache_last_used
+            ON answer_cache(last_used_at)
+            """,
+        ],
+    ),
+    (
+        4,
+        "password hashing scheme per user",
+        [
+            # NULL = legacy salted SHA-256; see utils.passwords.
+            "ALTER TABLE users ADD COLUMN password_scheme TEXT",
+        ],
+    ),
+    (
+        5,
+        "chat history",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at INTEGER,
+                ttft_ms REAL,
+                total_ms REAL
+            )
+            """,
+            # Serves "latest N" and "N before id" pages for one user.
+            """
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_user
+            ON chat_messages(user_id, id)
+            """,
+        ],
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ==========================================================
+# BOOTSTRAP
+# ==========================================================
+
+_ready_paths = set()
+_lock = threading.Lock()
+
+
+def current_version(cur) -> int:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at INTEGER
+        )
+        """
+    )
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+def migrate() -> int:
+    """
+    Applies pending migrations and returns the resulting schema version.
+    All pending migrations commit in one transaction with their schema_version rows.
+    """
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        # Take the write lock up front so two processes can't migrate at once.
+        cur.execute("BEGIN IMMEDIATE")
+        version = current_version(cur)
+
+        for target, description, steps in MIGRATIONS:
+            if target <= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(cur)
+                else:
+                    cur.execute(step)
+            cur.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (target, description, int(time.time())),
+            )
+            version = target
+
+        conn.commit()
+    return version
+
+
+def ensure_schema() -> None:
+    """Run-once schema bootstrap; a no-op after the first successful call."""
+    path = db.get_pool().path
+    if path in _ready_paths:
+        return
+    with _lock:
+        if path in _ready_paths:
+            return
+        migrate()
+        _ready_paths.add(path)
@@ -0,0 +1,324 @@
+"""
+Semantic near-duplicate answer cache for get_astro_response.
+
+The exact answer cache (utils.answer_cache) misses paraphrases such as
+"will I marry soon" / "when will my marriage happen". This cache embeds each
+question locally (hashed bag of content words and character trigrams, NumPy only)
+and serves a stored answer when the cosine similarity to a previous question
+is above a threshold.
+
+Three safeguards keep paraphrase matching from crossing topics:
+    - topic words are mapped to concepts (marry/marriage/shaadi -> marriage,
+      job/career/promotion -> career, ...) and a match requires the exact same
+      set of concepts, so "lucky colour" never answers "lucky number";
+    - negations and relative time words are concepts too, so "is saturn not
+      good for me" never answers "is saturn good for me", nor "horoscope for
+      tomorrow" "horoscope". So are gender words, and every number must match
+      exactly: "saturn in 7th house" never answers "saturn in 8th house", nor
+      "in 2025" "in 2026", nor "for men" "for women";
+    - the index is partitioned by rashi, and by default also requires the same
+      profile fingerprint as the exact cache (ASTRO_SEMANTIC_CACHE_SCOPE=rashi
+      relaxes this to "same rashi").
+
+Like the exact cache, entries expire after ASTRO_ANSWER_CACHE_TTL, and only
+match lookups with the same namespace (a hash of the expert prompt and model).
+
+Each partition is a preallocated float32 matrix grown by doubling; a lookup is
+one matrix-vector product over that partition. Evicted rows are zeroed and
+their slots reused, least recently used first.
+
+It is off unless ASTRO_SEMANTIC_CACHE=1: a wrong near-miss answer costs more
+than the LLM call it saves. benchmarks.bench_semantic_cache checks known
+near-miss pairs before it measures anything.
+
+Configuration (environment variables):
+    ASTRO_SEMANTIC_CACHE            set to 1 to enable                    (default 0)
+    ASTRO_SEMANTIC_CACHE_THRESHOLD  minimum cosine similarity for a hit   (default 0.8)
+    ASTRO_SEMANTIC_CACHE_MAX        max entries across all partitions     (default 100000)
+    ASTRO_SEMANTIC_CACHE_SCOPE      "profile" (default) or "rashi"
+"""
+
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from utils.answer_cache import TTL_SECONDS
+from utils.classifier import feature_bucket, tokenize
+
+
+ENABLED = os.getenv("ASTRO_SEMANTIC_CACHE", "0") == "1"
+THRESHOLD = float(os.getenv("ASTRO_SEMANTIC_CACHE_THRESHOLD", "0.8"))
+MAX_ENTRIES = int(os.getenv("ASTRO_SEMANTIC_CACHE_MAX", "100000"))
+SCOPE = os.getenv("ASTRO_SEMANTIC_CACHE_SCOPE", "profile").lower()
+
+EMBED_DIM = 256
+
+STOPWORDS = set(
+    """
+    i me my mine we our you your the a an is are am be been will would shall can could
+    should do does did what when where which who whom how why of in on for to about as
+    per and or it its this that these those there with from at by get got going have
+    has had tell please any according say says happen happens let know me
+    """.split()
+)
+
+_CONCEPT_WORDS = {
+    "marriage": "marry marriage married wedding shaadi shadi spouse husband wife vivah",
+    "divorce": "divorce separation separate",
+    "love": "love relationship partner boyfriend girlfriend soulmate romance",
+    "career": "career job jobs work promotion profession naukri employment",
+    "government": "government govt sarkari",
+    "business": "business startup trade",
+    "wealth": "money wealth rich finance financial dhan",
+    "health": "health illness disease",
+    "education": "education exam exams study studies college",
+    "travel": "travel abroad foreign visa settle",
+    "children": "child children baby kids santan pregnancy",
+    "property": "property house home land flat",
+    "color": "color colour colors colours",
+    "number": "number numbers",
+    "gemstone": "gemstone gem stone ratna",
+    "remedy": "remedy remedies upay",
+    "compatibility": "compatibility compatible matching milan match",
+    "daily": "daily today todays",
+    "weekly": "weekly week",
+    "monthly": "monthly month",
+    "yearly": "yearly year annual",
+    "sun": "sun surya",
+    "moon": "moon chandra",
+    "mars": "mars mangal",
+    "mercury": "mercury budh",
+    "jupiter": "jupiter guru brihaspati",
+    "venus": "venus shukra",
+    "saturn": "saturn shani",
+    "rahu": "rahu",
+    "ketu": "ketu",
+    # Not topics, but they change the answer as much as one.
+    "negation": "not no never nor without don't dont doesn't doesnt isn't isnt aren't arent "
+                "won't wont can't cant cannot didn't didnt shouldn't wouldn't",
+    "tomorrow": "tomorrow tomorrows",
+    "yesterday": "yesterday",
+    "tonight": "tonight",
+    "next": "next upcoming coming",
+    "last": "last previous past",
+    "male": "he him his man men male males boy boys son sons ladka",
+    "female": "she her hers woman women female females girl girls daughter daughters ladki",
+}
+CONCEPTS = {word: concept for concept, words in _CONCEPT_WORDS.items() for word in words.split()}
+
+# Numbers are concepts of their own value, so houses, years and ages match exactly.
+_NUMBER_RE = re.compile(r"(\d+)(?:st|nd|rd|th)?")
+_ORDINALS = (
+    "first second third fourth fifth sixth seventh eighth ninth tenth eleventh twelfth"
+).split()
+for _n, _word in enumerate(_ORDINALS, 1):
+    CONCEPTS[_word] = f"#{_n}"
+
+CONCEPT_WEIGHT = 2.0
+WORD_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.3
+
+
+# ==========================================================
+# EMBEDDING
+# ==========================================================
+
+def embed(text: str, dim: int = EMBED_DIM) -> tuple[np.ndarray, int]:
+    """
+    Returns (unit vector, concept signature). Two questions can only match
+    when their concept signatures are equal.
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    concepts = set()
+
+    for tok in tokenize(text):
+        if tok in STOPWORDS:
+            continue
+        concept = CONCEPTS.get(tok)
+        number = _NUMBER_RE.fullmatch(tok)
+        if number:
+            concept = f"#{int(number.group(1))}"
+        if concept:
+            concepts.add(concept)
+            vec[feature_bucket("k:" + concept, dim)] += CONCEPT_WEIGHT
+            continue
+        vec[feature_bucket("w:" + tok, dim)] += WORD_WEIGHT
+        padded = f"#{tok}#"
+        for j in range(len(padded) - 2):
+            vec[feature_bucket("c:" + padded[j:j + 3], dim)] += TRIGRAM_WEIGHT
+
+    norm = float(np.linalg.norm(vec))
+    if norm:
+        vec /= norm
+    return vec, _signature(" ".join(sorted(concepts)))
+
+
+def _signature(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+# ==========================================================
+# INDEX
+# ==========================================================
+
+class _Partition:
+    """One rashi's rows: vectors, match tags, expiry and LRU clocks and answers."""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.tags = np.zeros(capacity, dtype=np.int64)
+        self.expires = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.answers = [None] * capacity
+        self.high_water = 0
+        self.free = []
+        self.live = 0
+
+    def _grow(self) -> None:
+        capacity = len(self.answers) * 2
+        dim = self.vectors.shape[1]
+        vectors = np.zeros((capacity, dim), dtype=np.float32)
+        vectors[: self.high_water] = self.vectors[: self.high_water]
+        tags = np.zeros(capacity, dtype=np.int64)
+        tags[: self.high_water] = self.tags[: self.high_water]
+        expires = np.zeros(capacity, dtype=np.float64)
+        expires[: self.high_water] = self.expires[: self.high_water]
+        last_used = np.zeros(capacity, dtype=np.float64)
+        last_used[: self.high_water] = self.last_used[: self.high_water]
+        self.vectors, self.tags, self.expires, self.last_used = vectors, tags, expires, last_used
+        self.answers.extend([None] * (capacity - len(self.answers)))
+
+    def add(self, vec: np.ndarray, tag: int, answer: str, now: float, expires_at: float) -> None:
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.high_water == len(self.answers):
+                self._grow()
+            slot = self.high_water
+            self.high_water += 1
+        self.vectors[slot] = vec
+        self.tags[slot] = tag
+        self.expires[slot] = expires_at
+        self.last_used[slot] = now
+        self.answers[slot] = answer
+        self.live += 1
+
+    def best(self, vec: np.ndarray, tag: int, now: float) -> tuple[int, float]:
+        n = self.high_water
+        if not n:
+            return -1, 0.0
+        scores = self.vectors[:n] @ vec
+        # Free slots have zero vectors (score 0); rows with another tag or
+        # past their expiry can't match. Expired rows go with LRU eviction.
+        scores = np.where((self.tags[:n] == tag) & (self.expires[:n] > now), scores, -1.0)
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot])
+
+    def remove_oldest(self, count: int) -> int:
+        n = self.high_water
+        live_slots = np.flatnonzero(self.last_used[:n] > 0)
+        count = min(count, len(live_slots))
+        if not count:
+            return 0
+        ages = self.last_used[live_slots]
+        victims = live_slots[np.argpartition(ages, count - 1)[:count]]
+        self.vectors[victims] = 0.0
+        self.tags[victims] = 0
+        self.expires[victims] = 0.0
+        self.last_used[victims] = 0.0
+        for slot in victims.tolist():
+            self.answers[slot] = None
+            self.free.append(slot)
+        self.live -= count
+        return count
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        threshold: float = THRESHOLD,
+        max_entries: int = MAX_ENTRIES,
+        scope: str = SCOPE,
+        dim: int = EMBED_DIM,
+        ttl: float = TTL_SECONDS,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.scope = scope
+        self.dim = dim
+        self._partitions = {}
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "inserts": 0, "evictions": 0}
+
+    def _tag(self, signature: int, fingerprint: str, namespace: str) -> int:
+        if self.scope == "profile":
+            return _signature(f"{namespace}:{signature}:{fingerprint}")
+        return _signature(f"{namespace}:{signature}")
+
+    def __len__(self) -> int:
+        return sum(p.live for p in self._partitions.values())
+
+    def lookup(
+        self, question: str, rashi: str | None, fingerprint: str = "", namespace: str = ""
+    ) -> tuple[str, float] | None:
+        """
+        Returns (answer, similarity) for the closest unexpired cached question
+        above threshold. `namespace` is the exact cache's (see answer_cache.make_key).
+        """
+        vec, signature = embed(question, self.dim)
+        return self.lookup_vector(vec, self._tag(signature, fingerprint, namespace), rashi)
+
+    def lookup_vector(self, vec: np.ndarray, tag: int, rashi: str | None) -> tuple[str, float] | None:
+        with self._lock:
+            partition = self._partitions.get(rashi or "")
+            if partition is None:
+                self.stats["misses"] += 1
+                return None
+            now = time.monotonic()
+            slot, score = partition.best(vec, tag, now)
+            if slot < 0 or score < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            partition.last_used[slot] = now
+            self.stats["hits"] += 1
+            return partition.answers[slot], score
+
+    def insert(
+        self, question: str, rashi: str | None, answer: str, fingerprint: str = "", namespace: str = ""
+    ) -> None:
+        vec, signature = embed(question, self.dim)
+        self.insert_vector(vec, self._tag(signature, fingerprint, namespace), rashi, answer)
+
+    def insert_vector(
+        self, vec: np.ndarray, tag: int, rashi: str | None, answer: str, ttl: float | None = None
+    ) -> None:
+        now = time.monotonic()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            partition = self._partitions.get(rashi or "")
+            if partition is None:
+                partition = self._partitions[rashi or ""] = _Partition(self.dim)
+            partition.add(vec, tag, answer, now, expires_at)
+            self.stats["inserts"] += 1
+            if len(self) > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Drop ~1% of capacity at once from the fullest partition, so eviction
+        # cost is amortized over many inserts.
+        partition = max(self._partitions.values(), key=lambda p: p.live)
+        batch = max(1, self.max_entries // 100, len(self) - self.max_entries)
+        self.stats["evictions"] += partition.remove_oldest(batch)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._partitions.clear()
+
+
+# Process-wide instance used by utils.extension.
+SEMANTIC_CACHE = SemanticCache()
@@ -0,0 +1,470 @@
+"""
+Request-scoped tracing: one trace per script run, with spans for the work in it.
+
+app.py opens the root span of every Streamlit rerun with trace(); inside it,
+auth functions, SQL statements, governor admission and LLM calls open child
+spans, so a slow run shows where its time went:
+
+    with tracing.trace("rerun", page=page):
+        ...
+        with tracing.span("llm.expert", max_tokens=500) as span:
+            ...
+            span.set(prompt_tokens=812)
+
+The current span lives in a contextvar. Work handed to another thread
+(speculative expert, micro-batches, background summaries) or to the async LLM
+loop takes it along with bind() / bind_coroutine(), so it shows up in the
+trace of the run that started it. Outside a trace every helper is a no-op that
+costs a contextvar lookup.
+
+A finished trace is kept if its run was sampled (ASTRO_TRACE_SAMPLE) or took
+longer than ASTRO_TRACE_SLOW_MS, and appended to ASTRO_TRACE_FILE as one line
+of OTLP/JSON (an ExportTraceServiceRequest), the format the OpenTelemetry
+Collector's otlpjsonfile receiver reads. Spans that end after their run (a
+summary still being written) are appended on their own line with the same
+trace id.
+
+    python -m utils.tracing                    # waterfalls of the 5 slowest runs
+    python -m utils.tracing --top 10 --attr page=dashboard --min-ms 1000
+
+Configuration (environment variables):
+    ASTRO_TRACE_SAMPLE    fraction of runs traced, 0..1             (default 0)
+    ASTRO_TRACE_SLOW_MS   also keep every run slower than this; 0 = off (default 0)
+    ASTRO_TRACE_FILE      JSONL file the traces are appended to (default traces.jsonl)
+Tracing is off unless one of the first two is set.
+"""
+
+import argparse
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+log = logging.getLogger(__name__)
+
+SAMPLE = float(os.getenv("ASTRO_TRACE_SAMPLE", "0"))
+SLOW_MS = float(os.getenv("ASTRO_TRACE_SLOW_MS", "0"))
+TRACE_FILE = os.getenv("ASTRO_TRACE_FILE", "traces.jsonl")
+
+MAX_SPANS = 2000  # per trace; a run issuing more keeps the first ones
+
+SERVICE_NAME = "astro-app"
+
+_current = contextvars.ContextVar("astro_span", default=None)
+
+
+# ==========================================================
+# SPANS
+# ==========================================================
+
+class _Trace:
+    """Spans of one run, held until the root ends and the run is kept or dropped."""
+
+    def __init__(self, sampled: bool):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.sampled = sampled
+        self.root = None
+        self.spans = []
+        self.dropped = 0
+        self.done = False  # root ended; later spans are exported on their own
+        self.keep = False
+        self._lock = threading.Lock()
+
+    def finished(self, span: "Span") -> None:
+        with self._lock:
+            if not self.done:
+                if len(self.spans) < MAX_SPANS or span is self.root:
+                    self.spans.append(span)
+                else:
+                    self.dropped += 1
+                if span is not self.root:
+                    return
+                self.done = True
+                self.keep = self.sampled or (SLOW_MS > 0 and span.duration_ms >= SLOW_MS)
+                if self.dropped:
+                    span.attributes["dropped_spans"] = self.dropped
+                spans, self.spans = self.spans, []
+            else:
+                spans = [span]
+        if self.keep:
+            _export(spans)
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, trace: _Trace, name: str, parent_id: str | None, attributes: dict):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.error = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException | None = None) -> None:
+        if self.end_ns:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.finished(self)
+
+
+class _NoSpan:
+    """Stands in for a span outside a trace, so callers never check."""
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def end(self, error: BaseException | None = None) -> None:
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+def current() -> Span | None:
+    return _current.get()
+
+
+def start_span(name: str, **attributes) -> Span | _NoSpan:
+    """
+    A child of the current span that is not made current; end() it yourself.
+    For work that outlives the calling frame, such as a generator being read.
+    """
+    parent = _current.get()
+    if parent is None:
+        return NO_SPAN
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """A child span of the current one around the block; a no-op outside a trace."""
+    parent = _current.get()
+    if parent is None:
+        yield NO_SPAN
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current.set(child)
+    error = None
+    try:
+        yield child
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        child.end(error)
+
+
+@contextmanager
+def trace(name: str, sampled: bool | None = None, **attributes):
+    """
+    The root span of a run. `sampled` forces the decision; by default a
+    fraction ASTRO_TRACE_SAMPLE of runs is kept, plus the slow ones.
+    Inside another trace this is an ordinary child span.
+    """
+    if _current.get() is not None:
+        with span(name, **attributes) as child:
+            yield child
+        return
+    if sampled is None:
+        sampled = SAMPLE > 0 and random.random() < SAMPLE
+    if not (sampled or SLOW_MS > 0):
+        yield NO_SPAN
+        return
+    run = _Trace(sampled)
+    root = run.root = Span(run, name, None, attributes)
+    token = _current.set(root)
+    error = None
+    try:
+        yield root
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        root.end(error)
+
+
+def set_attributes(**attributes) -> None:
+    """Adds attributes to the current span, if any."""
+    current_span = _current.get()
+    if current_span is not None:
+        current_span.attributes.update(attributes)
+
+
+def traced(name: str):
+    """Decorator: runs the function in a span called `name`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ==========================================================
+# PROPAGATION
+# ==========================================================
+
+def bind(fn, parent: Span | None = None):
+    """
+    fn, made to run under `parent` (default: the current span) in whatever
+    thread calls it. Thread pools don't carry contextvars over by themselves.
+    """
+    parent = parent or _current.get()
+    if parent is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def iterate_in(span: Span | _NoSpan, iterable):
+    """
+    Yields from `iterable` with `span` current while each item is produced, so
+    the work a lazy generator does (admission, the request) nests under it.
+    """
+    if span is NO_SPAN:
+        yield from iterable
+        return
+    it = iter(iterable)
+    try:
+        while True:
+            token = _current.set(span)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield item
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()
+
+
+def bind_coroutine(coro):
+    """coro, made to run under the current span when scheduled on another thread's loop."""
+    parent = _current.get()
+    if parent is None:
+        return coro
+    return _run_under(parent, coro)
+
+
+async def _run_under(parent: Span, coro):
+    # The task runs in its own copy of the context, so this doesn't leak.
+    _current.set(parent)
+    return await coro
+
+
+# ==========================================================
+# EXPORT
+# ==========================================================
+
+_file = None
+_file_lock = threading.Lock()
+
+
+def _value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}  # int64 is a string in OTLP/JSON
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: dict) -> list[dict]:
+    return [{"key": key, "value": _value(value)} for key, value in attributes.items()]
+
+
+def _otlp_span(span: Span) -> dict:
+    record = {
+        "traceId": span.trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _attributes(span.attributes),
+    }
+    if span.parent_id:
+        record["parentSpanId"] = span.parent_id
+    if span.error:
+        record["status"] = {"code": 2, "message": span.error}  # STATUS_CODE_ERROR
+    return record
+
+
+def _resource() -> dict:
+    return {"attributes": _attributes({"service.name": SERVICE_NAME, "process.pid": os.getpid()})}
+
+
+def _export(spans: list[Span]) -> None:
+    global _file
+    line = json.dumps({"resourceSpans": [{
+        "resource": _resource(),
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [_otlp_span(s) for s in spans]}],
+    }]}, separators=(",", ":"))
+    with _file_lock:
+        try:
+            if _file is None:
+                _file = open(TRACE_FILE, "a", encoding="utf-8")
+            _file.write(line + "\n")
+            _file.flush()
+        except OSError as e:
+            log.warning("writing traces to %s failed: %s", TRACE_FILE, e)
+
+
+# ==========================================================
+# WATERFALL REPORT
+# ==========================================================
+
+def _plain(value: dict):
+    for key in ("stringValue", "boolValue", "doubleValue"):
+        if key in value:
+            return value[key]
+    return int(value.get("intValue", 0))
+
+
+def load(path: str) -> dict:
+    """trace id -> list of span dicts (name, start/end in ns, attributes, ...)."""
+    traces = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource in json.loads(line).get("resourceSpans", []):
+                for scope in resource.get("scopeSpans", []):
+                    for record in scope.get("spans", []):
+                        traces.setdefault(record["traceId"], []).append({
+                            "span_id": record["spanId"],
+                            "parent_id": record.get("parentSpanId"),
+                            "name": record["name"],
+                            "start": int(record["startTimeUnixNano"]),
+                            "end": int(record["endTimeUnixNano"]),
+                            "attributes": {a["key"]: _plain(a["value"]) for a in record.get("attributes", [])},
+                            "error": record.get("status", {}).get("message"),
+                        })
+    return traces
+
+
+def _root(spans: list[dict]) -> dict | None:
+    return next((s for s in spans if not s["parent_id"]), None)
+
+
+def _ordered(spans: list[dict], root: dict) -> list[tuple[int, dict]]:
+    """(depth, span) in start order, children under their parent."""
+    ids = {s["span_id"] for s in spans}
+    children = {}
+    for s in spans:
+        if s is root:
+            continue
+        # A parent that was dropped (MAX_SPANS) hangs its children off the root.
+        parent = s["parent_id"] if s["parent_id"] in ids else root["span_id"]
+        children.setdefault(parent, []).append(s)
+    rows = []
+    stack = [(0, root)]
+    while stack:
+        depth, s = stack.pop()
+        rows.append((depth, s))
+        for child in sorted(children.get(s["span_id"], []), key=lambda c: c["start"], reverse=True):
+            stack.append((depth + 1, child))
+    return rows
+
+
+def _describe(attributes: dict, limit: int = 60) -> str:
+    text = " ".join(f"{k}={v}" for k, v in attributes.items())
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def waterfall(spans: list[dict], width: int = 40) -> list[str]:
+    root = _root(spans)
+    total = max(root["end"] - root["start"], 1)
+    lines = [f"{'start ms':>10}{'ms':>10}  {'':<{width}}  span"]
+    for depth, s in _ordered(spans, root):
+        offset = s["start"] - root["start"]
+        duration = s["end"] - s["start"]
+        col = min(int(offset / total * width), width - 1)
+        length = max(1, round(duration / total * width))
+        bar = (" " * col + "█" * length)[:width].ljust(width)
+        name = "  " * depth + s["name"]
+        if s["error"]:
+            name += "  !" + s["error"]
+        detail = _describe(s["attributes"])
+        lines.append(f"{offset / 1e6:>10.1f}{duration / 1e6:>10.1f}  {bar}  {name}" + (f"  {detail}" if detail else ""))
+    return lines
+
+
+def slowest(traces: dict, top: int = 5, name: str | None = None, attrs: dict | None = None,
+            min_ms: float = 0) -> list[tuple[float, str, list[dict]]]:
+    """(duration ms, trace id, spans) of the slowest complete traces matching the filters."""
+    found = []
+    for trace_id, spans in traces.items():
+        root = _root(spans)
+        if root is None or (name and root["name"] != name):
+            continue
+        if attrs and any(str(root["attributes"].get(k)) != v for k, v in attrs.items()):
+            continue
+        duration = (root["end"] - root["start"]) / 1e6
+        if duration >= min_ms:
+            found.append((duration, trace_id, spans))
+    found.sort(key=lambda t: t[0], reverse=True)
+    return found[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Waterfalls of the slowest traced script runs.")
+    parser.add_argument("--file", default=TRACE_FILE, help="ASTRO_TRACE_FILE")
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--name", default="rerun", help="root span name ('' for any)")
+    parser.add_argument("--attr", action="append", default=[], metavar="KEY=VALUE",
+                        help="only traces whose root has this attribute, e.g. page=dashboard")
+    parser.add_argument("--min-ms", type=float, default=0)
+    parser.add_argument("--width", type=int, default=40, help="bar width in characters")
+    args = parser.parse_args()
+
+    attrs = dict(a.split("=", 1) for a in args.attr)
+    traces = load(args.file)
+    found = slowest(traces, args.top, args.name or None, attrs, args.min_ms)
+    print(f"{len(traces)} traces in {args.file}; {len(found)} slowest shown\n")
+    for duration, trace_id, spans in found:
+        root = _root(spans)
+        started = datetime.fromtimestamp(root["start"] / 1e9).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{duration:.1f} ms  {root['name']}  {_describe(root['attributes'])}  {started}  trace {trace_id}")
+        print("\n".join(waterfall(spans, args.width)))
+        print()
+
+
+if __name__ == "__main__":
+    main()
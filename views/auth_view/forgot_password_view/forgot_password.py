@@ -1,16 +1,12 @@
 import streamlit as st
 import re
+from utils.assets import inject_css
 from utils.auth import generate_reset_token, reset_password
-from pathlib import Path
 
 EMAIL_REGEX = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
-def load_css(path):
-    with open(path) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-
 def forgot_password_page():
-    load_css(Path(__file__).with_suffix(".css"))
+    inject_css("forgot_password")
 
     st.markdown('<h1>Reset Password</h1>', unsafe_allow_html=True)
 
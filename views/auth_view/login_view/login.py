@@ -1,13 +1,9 @@
 import streamlit as st
+from utils.assets import inject_css
 from utils.auth import verify_user
-from pathlib import Path
-
-def load_css(path):
-    with open(path) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
 def login_page():
-    load_css(Path(__file__).with_suffix(".css"))
+    inject_css("login")
 
     st.markdown('<h1>Welcome Back</h1>', unsafe_allow_html=True)
     st.markdown('<p class="subtitle">Sign in to continue</p>', unsafe_allow_html=True)
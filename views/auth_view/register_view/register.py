@@ -6,21 +6,14 @@ import streamlit as st
 # It checks if an email address contains an @ symbol and a dot after it, ensuring it's a valid email format.
 import re
 from utils.auth import create_user, user_exists
-# The 'pathlib' library provides a way to flexibly construct and inspect file paths.
-# In this code, it is used to get the path of the CSS file that matches the current Python file name,
-# i.e., if the file is 'register.py', then Path(__file__).with_suffix('.css') yields 'register.css'.
-# This ensures that when there are multiple CSS files, only the CSS file with the same base name as this Python file
-# (i.e., 'register.css' for 'register.py') is selected and loaded, keeping style management modular and specific.
-from pathlib import Path
+# The stylesheet for this page is 'register.css' next to this file. utils.assets
+# loads and minifies it once per process (the "register" bundle), so reruns reuse it.
+from utils.assets import inject_css
 
 EMAIL_REGEX = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
-def load_css(path):
-    with open(path) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-
 def register_page():
-    load_css(Path(__file__).with_suffix(".css"))
+    inject_css("register")
 
     st.markdown('<h1>Create Account</h1>', unsafe_allow_html=True)
 
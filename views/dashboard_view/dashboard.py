@@ -1,13 +1,21 @@
 import streamlit as st
-from pathlib import Path
-from utils.extension import get_astro_response, improve_prompt
+from utils import chat_history
+from utils.assets import inject_css
+from utils.auth import is_admin
+from utils.extension import (
+    STREAM_RESPONSES,
+    get_astro_response,
+    get_astro_response_stream,
+    improve_prompt,
+    new_conversation,
+)
 
 
-# ---------- LOAD CSS ----------
-def load_css():
-    css = Path(__file__).with_suffix(".css")
-    with open(css) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+# The dashboard is split into fragments (st.fragment). A widget inside a
+# fragment reruns only that fragment, so typing, improving a prompt or paging
+# in older messages does not re-render the whole chat and sidebar. Anything that
+# adds a message (send, suggestions, improved prompt) needs the chat log,
+# suggestions and sidebar redrawn, and does one full-app rerun from its callback.
 
 
 # ---------- DYNAMIC TEXTAREA HEIGHT ----------
@@ -27,71 +35,99 @@ def calculate_textarea_height(
     return max(min_height, min(height, max_height))
 
 
-def astrology_dashboard(logout_callback):
-    load_css()
+# ---------- CHAT HISTORY ----------
+def load_chat_history(user_id):
+    """Starts the session with the latest messages from the persistent history."""
+    messages = chat_history.load_recent(user_id)
+    st.session_state.messages = messages
+    st.session_state.history_user = user_id
+    st.session_state.history_has_older = bool(messages) and chat_history.has_before(
+        user_id, messages[0].get("id")
+    )
 
-    # ---------- SESSION INIT ----------
-    st.session_state.setdefault("current_page", "dashboard")
-    st.session_state.setdefault("messages", [])
-    st.session_state.setdefault("show_suggestions", True)
-    st.session_state.setdefault("suggestion_set", 0)
-    st.session_state.setdefault("pending_prompt", None)
-    st.session_state.setdefault("improved_prompt", None)
-    st.session_state.setdefault("prompt_input", "")
-    st.session_state.setdefault("reset_prompt", False)
-    st.session_state.setdefault("improve_version", 0)
-    st.session_state.setdefault("menu_reset", False)
-    
 
-    # ---------- SAFE RESET ----------
-    if st.session_state.reset_prompt:
-        st.session_state.prompt_input = ""
-        st.session_state.reset_prompt = False
+def load_older_messages():
+    messages = st.session_state.messages
+    oldest = next((m["id"] for m in messages if m.get("id")), None)
+    room = chat_history.MEMORY_CAP - len(messages)
+    older = chat_history.load_before(
+        st.session_state.user, oldest, min(chat_history.PAGE, room)
+    ) if oldest else []
+    messages[:0] = older
+    st.session_state.history_has_older = bool(older) and chat_history.has_before(
+        st.session_state.user, older[0]["id"]
+    )
 
-    # ---------- SUGGESTIONS ----------
-    SUGGESTIONS = [
-        [
-        "🧘 Daily Horoscope Prediction",
-        "💍 Marriage Compatibility Astrology",
-        "💼 Career Astrology Guidance",
-        "🌙 Moon Sign Astrology Meaning",
-        "🪐 Planetary Dosha Analysis"
-    ],
-    [
-        "📈 Business Astrology Prediction",
-        "❤️ Love Life Astrology Prediction",
-        "🏡 Property Yoga in Kundali",
-        "🧿 Rahu–Ketu Dosha Effects",
-        "🔮 Lucky Colors as per Astrology"
-    ],
-    [
-        "🌟 Career Growth as per Kundali",
-        "💰 Wealth Yoga in Horoscope",
-        "💏 Relationship Compatibility Astrology",
-        "🕉️ Spiritual Path as per Horoscope",
-        "🌌 Planet Positions in Birth Chart"
-    ],
-    ]
 
-    current_suggestions = SUGGESTIONS[
-        st.session_state.suggestion_set % len(SUGGESTIONS)
-    ]
+def add_chat_message(user_id, role, content, **timings):
+    message = {"role": role, "content": content, **timings}
+    message["id"] = chat_history.append(user_id, role, content, **timings)
+    messages = st.session_state.messages
+    messages.append(message)
+
+    # Bound per-session memory; trimmed messages stay in the store.
+    overflow = len(messages) - chat_history.MEMORY_CAP
+    if overflow > 0:
+        del messages[:overflow]
+        st.session_state.history_has_older = True
+
+
+# ---------- PROMPT CALLBACKS ----------
+def queue_prompt(prompt, hide_suggestions=False, standalone=False):
+    """
+    Widget callback: the full-app rerun it starts answers `prompt` in the chat log.
+    A `standalone` prompt (a suggestion) is answered without the conversation context.
+    """
+    st.session_state.pending_prompt = prompt
+    st.session_state.pending_standalone = standalone
+    st.session_state.improved_prompt = None
+    st.session_state.reset_prompt = True
+    if hide_suggestions:
+        st.session_state.show_suggestions = False
+    st.rerun()
+
+
+def rerun_for_pending_prompt():
+    # Streamlit versions that ignore st.rerun() in callbacks rerun just the
+    # fragment; escalate from its body instead.
+    if st.session_state.pending_prompt:
+        st.rerun()
+
+
+def send_prompt():
+    user_input = st.session_state.prompt_input
+    if user_input.strip():
+        queue_prompt(user_input)
+
+
+def send_improved_prompt(editor_key):
+    st.session_state.improve_version += 1  # reset editor
+    queue_prompt(st.session_state[editor_key])
+
 
-    # ================= SIDEBAR =================
-    st.sidebar.title("☰ Menu")
+# ================= SIDEBAR =================
+@st.fragment
+def sidebar(logout_callback):
+    st.title("☰ Menu")
     if st.session_state.menu_reset:
         st.session_state.sidebar_menu = "— Select —"
         st.session_state.menu_reset = False
 
-    menu_action = st.sidebar.selectbox(
+    options = ["— Select —", "🧹 Clear Chat", "👤 Profile", "🚪 Logout"]
+    if is_admin(st.session_state.user):
+        options.insert(3, "📈 Metrics")
+
+    menu_action = st.selectbox(
         "Choose an option",
-        ["— Select —", "🧹 Clear Chat", "👤 Profile", "🚪 Logout"],
+        options,
         key="sidebar_menu",
         label_visibility="collapsed"
     )
 
     if menu_action == "🧹 Clear Chat":
+        chat_history.clear(st.session_state.user)
         st.session_state.messages.clear()
+        st.session_state.history_has_older = False
         st.session_state.show_suggestions = True
         st.session_state.suggestion_set = 0
         st.session_state.improved_prompt = None
@@ -104,9 +140,15 @@ def astrology_dashboard(logout_callback):
         st.session_state.current_page = "profile"  
         st.session_state.menu_reset = True
         st.rerun()
+    elif menu_action == "📈 Metrics":
+        st.session_state.current_page = "metrics"
+        st.session_state.menu_reset = True
+        st.rerun()
     elif menu_action == "🚪 Logout":     
         st.session_state.current_page = "dashboard"   
         st.session_state.messages.clear()
+        # Whoever logs in next, even the same user, gets their history reloaded.
+        st.session_state.history_user = None
         st.session_state.show_suggestions = True
         st.session_state.suggestion_set = 0
         st.session_state.improved_prompt = None
@@ -126,15 +168,16 @@ def astrology_dashboard(logout_callback):
     #     st.session_state.reset_prompt = True
     #     st.rerun()
 
-    st.sidebar.title("🔮 Chat History")
+    st.title("🔮 Chat History")
 
-    if not st.session_state.messages:
-        st.sidebar.info("No conversations yet")
+    recent = chat_history.preview(st.session_state.user)
+    if not recent:
+        st.info("No conversations yet")
     else:
-        for msg in st.session_state.messages[-10:]:
-            icon = "🧑" if msg["role"] == "user" else "🤖"
-            preview = msg["content"][:40] + "..."
-            st.sidebar.markdown(
+        for role, text in recent:
+            icon = "🧑" if role == "user" else "🤖"
+            preview = text + "..."
+            st.markdown(
                 f"<div class='sidebar-msg'>{icon} {preview}</div>",
                 unsafe_allow_html=True
             )
@@ -142,13 +185,18 @@ def astrology_dashboard(logout_callback):
     # st.sidebar.markdown("---")
     # st.sidebar.button("🚪 Logout", on_click=logout_callback)
 
-    # ================= MAIN =================
-    st.markdown(
-        "<h1 class='dashboard-title'>🔮 Ask Your Astrology Question</h1>",
-        unsafe_allow_html=True
-    )
 
-    # ---------- CHAT ----------
+# ---------- CHAT ----------
+@st.fragment
+def chat_log():
+    if (
+        st.session_state.history_has_older
+        and len(st.session_state.messages) < chat_history.MEMORY_CAP
+    ):
+        st.button(
+            "⬆ Load older messages", key="load_older", on_click=load_older_messages
+        )
+
     for msg in st.session_state.messages:
         css = "chat-user" if msg["role"] == "user" else "chat-bot"
         st.markdown(
@@ -156,7 +204,77 @@ def astrology_dashboard(logout_callback):
             unsafe_allow_html=True
         )
 
-    # ---------- PROMPT BAR ----------
+    # ---------- PROCESS PROMPT ----------
+    # Only ever set by queue_prompt, so this runs in a full-app rerun: the
+    # prompt bar, suggestions and sidebar below are drawn after the answer.
+    if st.session_state.pending_prompt:
+        prompt = st.session_state.pending_prompt
+        st.session_state.pending_prompt = None
+
+        conversation = st.session_state.conversation
+        context = None
+        if not st.session_state.get("pending_standalone"):
+            context = conversation.context(st.session_state.messages)
+        add_chat_message(st.session_state.user, "user", prompt)
+        st.markdown(
+            f"<div class='chat-user'>{prompt}</div>",
+            unsafe_allow_html=True
+        )
+
+        if STREAM_RESPONSES:
+            bubble = st.empty()
+            bubble.markdown(
+                "<div class='chat-bot'>🔮 Reading your stars...</div>",
+                unsafe_allow_html=True
+            )
+
+            stream = get_astro_response_stream(
+                prompt, st.session_state.user, context=context
+            )
+            shown = ""
+            for chunk in stream:
+                shown += chunk
+                bubble.markdown(
+                    f"<div class='chat-bot'>{shown}</div>",
+                    unsafe_allow_html=True
+                )
+
+            add_chat_message(
+                st.session_state.user,
+                "assistant",
+                stream.text,
+                ttft_ms=stream.ttft_ms,
+                total_ms=stream.total_ms,
+            )
+        else:
+            with st.spinner("🔮 Reading your stars..."):
+                reply = get_astro_response(
+                    prompt, st.session_state.user, context=context
+                )
+
+            add_chat_message(st.session_state.user, "assistant", reply)
+            st.markdown(
+                f"<div class='chat-bot'>{reply}</div>",
+                unsafe_allow_html=True
+            )
+
+        # Summarize turns leaving the context window while the user reads.
+        conversation.slide(st.session_state.messages, background=True)
+
+        st.session_state.suggestion_set += 1
+        st.session_state.show_suggestions = True
+
+
+# ---------- PROMPT BAR ----------
+@st.fragment
+def prompt_bar():
+    rerun_for_pending_prompt()
+
+    # ---------- SAFE RESET ----------
+    if st.session_state.reset_prompt:
+        st.session_state.prompt_input = ""
+        st.session_state.reset_prompt = False
+
     st.markdown("<div class='prompt-parent'>", unsafe_allow_html=True)
 
     c1, c2, c3 = st.columns([6,0.4,0.3])
@@ -170,7 +288,7 @@ def astrology_dashboard(logout_callback):
         )
 
     with c2:
-        send = st.button("Send")
+        st.button("Send", on_click=send_prompt)
 
     with c3:
         improve = st.button("↺")
@@ -185,75 +303,123 @@ def astrology_dashboard(logout_callback):
             with st.spinner("✨ Improving your prompt..."):
                 st.session_state.improved_prompt = improve_prompt(user_input)
             st.session_state.improve_version += 1
-            st.rerun()
 
-    # ---------- IMPROVED PROMPT UI ----------
-    if st.session_state.improved_prompt:
-        st.markdown("<div class='improve-box'>", unsafe_allow_html=True)
-        st.markdown("✨ **Your prompt could be improved like this:**")
+    improved_prompt_editor()
 
-        dynamic_height = calculate_textarea_height(
-            st.session_state.improved_prompt
-        )
-        
-        improved_text = st.text_area(
-            "",
-            value=st.session_state.improved_prompt,
-            height=dynamic_height,
-            key=f"improved_prompt_editor_{st.session_state.improve_version}"
-        )
-        
 
-        if st.button("Send Improved Prompt"):
-            st.session_state.pending_prompt = improved_text
-            st.session_state.improved_prompt = None
-            st.session_state.reset_prompt = True
-            st.session_state.improve_version += 1  # reset editor
-            st.rerun()
+# ---------- IMPROVED PROMPT UI ----------
+@st.fragment
+def improved_prompt_editor():
+    rerun_for_pending_prompt()
+    if not st.session_state.improved_prompt:
+        return
 
-        st.markdown("</div>", unsafe_allow_html=True)
+    st.markdown("<div class='improve-box'>", unsafe_allow_html=True)
+    st.markdown("✨ **Your prompt could be improved like this:**")
 
-    # ---------- SEND NORMAL ----------
-    if send and user_input.strip():
-        st.session_state.pending_prompt = user_input
-        st.session_state.improved_prompt = None
-        st.session_state.reset_prompt = True
-        st.rerun()
+    dynamic_height = calculate_textarea_height(
+        st.session_state.improved_prompt
+    )
+    
+    editor_key = f"improved_prompt_editor_{st.session_state.improve_version}"
+    st.text_area(
+        "",
+        value=st.session_state.improved_prompt,
+        height=dynamic_height,
+        key=editor_key
+    )
+    
 
-    # ---------- SUGGESTIONS ----------
-    if st.session_state.show_suggestions:
-        st.markdown(
-            "<h3 class='suggestion-title'>✨ Suggested Topics</h3>",
-            unsafe_allow_html=True
-        )
-        cols = st.columns(5)
+    st.button(
+        "Send Improved Prompt",
+        on_click=send_improved_prompt,
+        args=(editor_key,),
+    )
 
-        for i, col in enumerate(cols):
-            with col:
-                if st.button(current_suggestions[i], key=f"suggestion_{i}"):
-                    st.session_state.pending_prompt = current_suggestions[i]
-                    st.session_state.improved_prompt = None
-                    st.session_state.show_suggestions = False
-                    st.session_state.reset_prompt = True
-                    st.rerun()
+    st.markdown("</div>", unsafe_allow_html=True)
 
-    # ---------- PROCESS PROMPT ----------
-    if st.session_state.pending_prompt:
-        prompt = st.session_state.pending_prompt
-        st.session_state.pending_prompt = None
 
-        st.session_state.messages.append(
-            {"role": "user", "content": prompt}
-        )
+# ---------- SUGGESTIONS ----------
+SUGGESTIONS = [
+    [
+    "🧘 Daily Horoscope Prediction",
+    "💍 Marriage Compatibility Astrology",
+    "💼 Career Astrology Guidance",
+    "🌙 Moon Sign Astrology Meaning",
+    "🪐 Planetary Dosha Analysis"
+],
+[
+    "📈 Business Astrology Prediction",
+    "❤️ Love Life Astrology Prediction",
+    "🏡 Property Yoga in Kundali",
+    "🧿 Rahu–Ketu Dosha Effects",
+    "🔮 Lucky Colors as per Astrology"
+],
+[
+    "🌟 Career Growth as per Kundali",
+    "💰 Wealth Yoga in Horoscope",
+    "💏 Relationship Compatibility Astrology",
+    "🕉️ Spiritual Path as per Horoscope",
+    "🌌 Planet Positions in Birth Chart"
+],
+]
+
+
+@st.fragment
+def suggestions():
+    rerun_for_pending_prompt()
+    if not st.session_state.show_suggestions:
+        return
 
-        with st.spinner("🔮 Reading your stars..."):
-            reply = get_astro_response(prompt,st.session_state.user)
+    current_suggestions = SUGGESTIONS[
+        st.session_state.suggestion_set % len(SUGGESTIONS)
+    ]
 
-        st.session_state.messages.append(
-            {"role": "assistant", "content": reply}
-        )
+    st.markdown(
+        "<h3 class='suggestion-title'>✨ Suggested Topics</h3>",
+        unsafe_allow_html=True
+    )
+    cols = st.columns(5)
+
+    for i, col in enumerate(cols):
+        with col:
+            st.button(
+                current_suggestions[i],
+                key=f"suggestion_{i}",
+                on_click=queue_prompt,
+                args=(current_suggestions[i], True, True),
+            )
 
-        st.session_state.suggestion_set += 1
-        st.session_state.show_suggestions = True
 
-        st.rerun()
+def astrology_dashboard(logout_callback):
+    inject_css("dashboard")
+
+    # ---------- SESSION INIT ----------
+    st.session_state.setdefault("current_page", "dashboard")
+    if st.session_state.get("history_user") != st.session_state.user:
+        load_chat_history(st.session_state.user)
+    st.session_state.setdefault("show_suggestions", True)
+    st.session_state.setdefault("suggestion_set", 0)
+    st.session_state.setdefault("pending_prompt", None)
+    if "conversation" not in st.session_state:
+        st.session_state.conversation = new_conversation()
+    st.session_state.setdefault("improved_prompt", None)
+    st.session_state.setdefault("prompt_input", "")
+    st.session_state.setdefault("reset_prompt", False)
+    st.session_state.setdefault("improve_version", 0)
+    st.session_state.setdefault("menu_reset", False)
+    
+
+    # ================= MAIN =================
+    st.markdown(
+        "<h1 class='dashboard-title'>🔮 Ask Your Astrology Question</h1>",
+        unsafe_allow_html=True
+    )
+
+    chat_log()
+    prompt_bar()
+    suggestions()
+
+    # Drawn last so its preview includes a message answered in this run.
+    with st.sidebar:
+        sidebar(logout_callback)
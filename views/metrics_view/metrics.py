@@ -0,0 +1,125 @@
+import math
+import os
+
+import streamlit as st
+from utils import metrics, profiler
+from utils.auth import is_admin
+
+
+# Admin-only view of the process's metrics (utils.metrics). The numbers are
+# this server process's since it started; Prometheus scrapes the same data
+# from ASTRO_METRICS_PORT / ASTRO_METRICS_FILE.
+
+
+def _ms(seconds):
+    return None if math.isnan(seconds) else round(seconds * 1000, 1)
+
+
+def _latency(series) -> dict:
+    return {
+        "count": series.count,
+        "mean ms": _ms(series.sum / series.count if series.count else math.nan),
+        "p50 ms": _ms(series.quantile(0.50)),
+        "p95 ms": _ms(series.quantile(0.95)),
+        "p99 ms": _ms(series.quantile(0.99)),
+    }
+
+
+def _values(name) -> dict:
+    """label values -> value of a counter or gauge (empty if not registered yet)."""
+    metric = metrics.REGISTRY.get(name)
+    return {key: series.value for key, series in metric.series().items()} if metric else {}
+
+
+def _latency_rows(name, label, extra=None) -> list[dict]:
+    histogram = metrics.REGISTRY.get(name)
+    if histogram is None:
+        return []
+    rows = []
+    for key, series in sorted(histogram.series().items()):
+        row = {label: key[0], **_latency(series)}
+        if extra:
+            row.update(extra(key[0]))
+        rows.append(row)
+    return rows
+
+
+def _table(title, rows, empty):
+    st.subheader(title)
+    if rows:
+        st.dataframe(rows, hide_index=True)
+    else:
+        st.caption(empty)
+
+
+def _set_profile_reruns():
+    st.session_state._profile_reruns = st.session_state.profile_reruns
+
+
+def metrics_page():
+    if not is_admin(st.session_state.get("user")):
+        st.error("Admins only")
+        return
+
+    st.markdown("<h1>📈 Metrics</h1>", unsafe_allow_html=True)
+    st.caption(f"Server process {os.getpid()}, since it started. Percentiles are estimated from histogram buckets.")
+
+    if st.button("⬅ Back to Dashboard"):
+        st.session_state.current_page = "dashboard"
+        st.rerun()
+
+    calls = _values("astro_llm_calls_total")
+    tokens = _values("astro_llm_tokens_total")
+    _table(
+        "LLM calls",
+        _latency_rows(
+            "astro_llm_request_seconds", "kind",
+            lambda kind: {
+                "errors": int(calls.get((kind, "error"), 0)),
+                "prompt tokens": int(tokens.get((kind, "prompt"), 0)),
+                "completion tokens": int(tokens.get((kind, "completion"), 0)),
+            },
+        ),
+        "No LLM calls yet",
+    )
+
+    page_errors = _values("astro_page_errors_total")
+    _table(
+        "Pages",
+        _latency_rows("astro_page_run_seconds", "page", lambda page: {"errors": int(page_errors.get((page,), 0))}),
+        "No page runs yet",
+    )
+
+    query_errors = _values("astro_db_query_errors_total")
+    _table(
+        "SQLite statements",
+        _latency_rows("astro_db_query_seconds", "op", lambda op: {"errors": int(query_errors.get((op,), 0))}),
+        "No statements yet",
+    )
+
+    st.subheader("Page run profiles")
+    # Streamlit drops a widget's key once it isn't drawn, so the setting lives
+    # in its own key and stays on across the other pages.
+    st.toggle(
+        "Profile my page runs",
+        value=st.session_state.get("_profile_reruns", False),
+        key="profile_reruns",
+        on_change=_set_profile_reruns,
+        help=f"Samples this session's script runs into {profiler.PROFILE_DIR}/ (flamegraph .folded files)",
+    )
+    session = st.session_state.get("_profile_session")
+    runs = [r for r in profiler.RECENT if r["session"] == session][-20:]
+    if runs:
+        st.dataframe(
+            [{"time": r["time"][11:], "page": r["page"], "total ms": r["total_ms"],
+              **{f"{name} ms": r["phases_ms"][name] for name in profiler.PHASES},
+              "samples": r["samples"], "file": r["file"]} for r in reversed(runs)],
+            hide_index=True,
+        )
+    else:
+        st.caption("No profiled runs in this session yet")
+
+    exported = metrics.render()
+    with st.expander("Prometheus export"):
+        st.download_button("Download metrics.prom", exported, file_name="metrics.prom", mime="text/plain")
+        st.code(exported, language="text")